@@ -9,8 +9,9 @@ echo.
 echo 1. Sto accendendo il server...
 cd /d "%~dp0"
 
-:: Avvia Python ridotto a icona
-start "GestionaleServer" /min py app.py
+:: Avvia Python ridotto a icona (server waitress, 8 richieste in parallelo)
+:: Per il vecchio server di sviluppo: py app.py --debug
+start "GestionaleServer" /min py app.py --threads 8
 
 echo 2. Attendi qualche secondo che si carichi tutto...
 :: Qui aspetta 15 secondi (il >nul nasconde il conto alla rovescia brutto)
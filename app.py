@@ -1,11 +1,12 @@
 import json
+import re
 import os
 import signal
 import time
 import threading
 import logging
-import shutil
-import smtplib
+import secrets
+import tempfile
 import pandas as pd
 import io # Serve per gestire il file in memoria RAM
 
@@ -14,27 +15,30 @@ load_dotenv() # Carica le variabili dal file .env
 
 from logging.handlers import RotatingFileHandler
 from datetime import datetime, timedelta
-
-# Importazioni per la creazione dell'excel
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
-
-# Importazioni per la gestione delle Email (MIME)
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+from collections import OrderedDict
 
 # Importazioni Flask e Database
+import click
 from flask import Flask, render_template, request, redirect, url_for, flash, send_file, session, jsonify
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func, desc, extract
+from sqlalchemy import func, desc, extract, text, bindparam, event, case
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload, joinedload
 from fpdf import FPDF
 
 # Importazione Modelli dal file models.py
-from models import db, Prodotto, Cliente, Ordine, DettaglioOrdine
+from models import (
+    db, Prodotto, Cliente, Ordine, DettaglioOrdine, RiepilogoVendite, UltimoAcquisto, BozzaOrdine, BozzaRiga, PrezzoListino,
+    SQL_RICOSTRUZIONE_RIEPILOGO, SQL_RICOSTRUZIONE_ULTIMO_ACQUISTO, SQL_RICOSTRUZIONE_ULTIMO_ACQUISTO_COPPIA,
+)
+from migrazioni import applica_migrazioni, versione_database
+from connessione_db import imposta_connessione, apri_connessione
+from coda_email import accoda_email, avvia_postino, ferma_postino
+from matrice_ordine import costruisci_matrice, separa_nome_codice
+from excel_ordini import crea_workbook, scrivi_foglio_ordine
+from denaro import a_centesimi, in_euro
+from verifiche import registra_verifiche
 
 app = Flask(__name__)
 
@@ -60,11 +64,20 @@ app.logger.addHandler(handler)
 # ==============================================================================
 # Ora la chiave segreta la prende dal file .env
 app.secret_key = os.getenv('SECRET_KEY', 'chiave_di_riserva_se_manca_env')
+
+# Prezzi nel DB in centesimi: nei template {{ p.prezzo|euro }}
+app.add_template_filter(in_euro, 'euro')
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///gestionale.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db.init_app(app)
 
+# Stesse impostazioni SQLite degli script (WAL, busy_timeout, cache...) su OGNI connessione,
+# registrate qui così valgono per il server, i comandi "flask ..." e chi importa app:app
+# (vedi connessione_db.py)
+with app.app_context():
+    event.listen(db.engine, 'connect', imposta_connessione)
+
 # ==============================================================================
 # 3. CONFIGURAZIONE EMAIL (SICURO)
 # ==============================================================================
@@ -73,6 +86,14 @@ EMAIL_MITTENTE = os.getenv('EMAIL_MITTENTE')
 EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
 EMAIL_DESTINATARIO = os.getenv('EMAIL_DESTINATARIO')
 
+# Server di posta usato dal "postino" (coda_email.py) che invia in background.
+# Per le prove si può puntare a un server SMTP locale (es. SMTP_HOST=localhost, SMTP_PORT=1025, SMTP_SSL=0)
+app.config['EMAIL_MITTENTE'] = EMAIL_MITTENTE
+app.config['EMAIL_PASSWORD'] = EMAIL_PASSWORD
+app.config['SMTP_HOST'] = os.getenv('SMTP_HOST', 'smtp.mail.yahoo.com')
+app.config['SMTP_PORT'] = int(os.getenv('SMTP_PORT', '465'))
+app.config['SMTP_SSL'] = os.getenv('SMTP_SSL', '1') != '0'
+
 # ==============================================================================
 # 4. ROTTE PRINCIPALI
 # ==============================================================================
@@ -121,9 +142,9 @@ def aggiungi_prodotto():
         # 'next' ci dice se veniamo dalla pagina Ordine o dalla Gestione
         next_page = request.form.get('next')
         try:
-            prezzo = float(request.form.get('prezzo', 0.0).replace(',', '.'))
+            prezzo = a_centesimi(request.form.get('prezzo'))
         except:
-            prezzo = 0.0
+            prezzo = 0
 
         if not codice or not nome:
             flash('Codice e Nome sono obbligatori!', 'error')
@@ -152,6 +173,17 @@ def aggiungi_prodotto():
         flash(f"Errore di sistema: {e}", 'error')
         return redirect(url_for('gestione_prodotti'))
 
+def cambia_prezzo_listino(prodotto, nuovo_prezzo):
+    """
+    Se il prezzo cambia, aggiunge una versione di listino valida da oggi
+    (la versione precedente la chiude il trigger, vedi migrazione 6).
+    nuovo_prezzo in centesimi.
+    """
+    if (prodotto.prezzo or 0) == nuovo_prezzo:
+        return
+    db.session.add(PrezzoListino(prodotto_id=prodotto.id, valido_dal=datetime.now().date(), prezzo=nuovo_prezzo))
+    prodotto.prezzo = nuovo_prezzo
+
 @app.route('/prodotti/modifica/<int:id_prodotto>', methods=['GET', 'POST'])
 def modifica_prodotto(id_prodotto):
     try:
@@ -167,9 +199,10 @@ def modifica_prodotto(id_prodotto):
                 prodotto.nome = request.form.get('nome')
                 prodotto.ingredienti = request.form.get('ingredienti')
                 try:
-                    prodotto.prezzo = float(request.form.get('prezzo', 0.0).replace(',', '.'))
+                    nuovo_prezzo = a_centesimi(request.form.get('prezzo'))
                 except:
-                    prodotto.prezzo = 0.0
+                    nuovo_prezzo = 0
+                cambia_prezzo_listino(prodotto, nuovo_prezzo)
                 
                 db.session.commit()
                 flash('Prodotto modificato con successo!', 'success')
@@ -315,11 +348,10 @@ def elimina_cliente(id_cliente):
 
 @app.route('/crea_ordine')
 def crea_ordine():
-    # Passiamo solo clienti e prodotti ATTIVI alle select
-    tutti_clienti = Cliente.query.filter_by(attivo=True).all()
-    tutti_prodotti = Prodotto.query.filter_by(attivo=True).all()
+    # Clienti e prodotti NON vengono più passati alla pagina: le select li cercano
+    # a pagine su /api/catalogo/... mentre si scrive
     open_modal = request.args.get('open_modal')
-    return render_template('crea_ordine.html', clienti=tutti_clienti, prodotti=tutti_prodotti, open_modal=open_modal)
+    return render_template('crea_ordine.html', open_modal=open_modal)
 
 def pulisci_testo(testo):
     """Pulisce i caratteri strani per evitare crash del PDF"""
@@ -332,49 +364,436 @@ class PDF(FPDF):
         self.cell(0, 10, 'Agente 15 ALOISI GIANCARLO', align='C', new_x="LMARGIN", new_y="NEXT")
         self.ln(1) # Spazio dopo l'intestazione
 
-@app.route('/api/suggerimenti_cliente/<int:cliente_id>')
-def api_suggerimenti_cliente(cliente_id):
-    # Trova i prodotti comprati da questo cliente e quante volte
-    # Restituisce: {id_prodotto: totale_acquistato}
-    risultati = db.session.query(
+# ------------------------------------------------------------------------------
+# SUGGERIMENTI CLIENTE IN MEMORIA
+# ------------------------------------------------------------------------------
+# Ogni volta che si sceglie un cliente, la pagina chiede i prodotti che compra di
+# solito. Invece di rifare ogni volta la somma su tutto lo storico, teniamo in RAM
+# per ogni cliente: totale comprato, punteggio "recente" e ultima data d'ordine.
+# - All'avvio si caricano tutti i clienti con UNA query (carica_tutti_suggerimenti).
+# - Quando un ordine viene salvato, modificato o eliminato si butta via SOLO la voce
+#   dei clienti toccati (invalida_suggerimenti): alla richiesta dopo si ricarica.
+# Gli script di importazione scrivono da fuori: dopo un import a programma acceso
+# i suggerimenti si aggiornano al riavvio.
+
+# Punteggio recente: una quantità ordinata EMIVITA giorni fa conta la metà di oggi
+EMIVITA_SUGGERIMENTI_GIORNI = 90
+suggerimenti_clienti = {}   # cliente_id -> {'totali': {...}, 'completo': {...}}
+versioni_suggerimenti = {}  # cliente_id -> n° di invalidazioni (vedi leggi_suggerimenti)
+lock_suggerimenti = threading.Lock()
+
+def query_suggerimenti_cliente(cliente_id=None):
+    """Quantità per cliente, prodotto e giorno (di un cliente, o di tutti se None)."""
+    query = db.session.query(
+        DettaglioOrdine.cliente_id,
         DettaglioOrdine.prodotto_id,
+        Ordine.data_consegna,
         func.sum(DettaglioOrdine.quantita).label('totale')
     ).join(Ordine).filter(
-        DettaglioOrdine.cliente_id == cliente_id,
         Ordine.stato == 'inviato' # Consideriamo solo ordini confermati? O tutti? Meglio tutti per sicurezza
-    ).group_by(DettaglioOrdine.prodotto_id).all()
-    
-    # Creiamo un dizionario semplice { "ID_PRODOTTO": TOTALE }
-    suggerimenti = {str(r.prodotto_id): r.totale for r in risultati}
-    return jsonify(suggerimenti)
+    )
+    if cliente_id is not None:
+        query = query.filter(DettaglioOrdine.cliente_id == cliente_id)
+    return query.group_by(DettaglioOrdine.cliente_id, DettaglioOrdine.prodotto_id, Ordine.data_consegna)
+
+def calcola_suggerimenti(righe):
+    """
+    righe: (cliente_id, prodotto_id, data_consegna, totale).
+    Restituisce {cliente_id: {'totali': {"id_prodotto": totale},
+                              'completo': {"id_prodotto": {totale, punteggio, ultima_data}}}}.
+    """
+    oggi = datetime.now().date()
+    per_cliente = {}
+    for cliente_id, prodotto_id, data_consegna, totale in righe:
+        prodotti = per_cliente.setdefault(cliente_id, {})
+        voce = prodotti.setdefault(prodotto_id, {'totale': 0, 'punteggio': 0.0, 'ultima_data': data_consegna})
+        giorni = max((oggi - data_consegna).days, 0)
+        voce['totale'] += totale or 0
+        voce['punteggio'] += (totale or 0) * 0.5 ** (giorni / EMIVITA_SUGGERIMENTI_GIORNI)
+        voce['ultima_data'] = max(voce['ultima_data'], data_consegna)
+
+    risultato = {}
+    for cliente_id, prodotti in per_cliente.items():
+        risultato[cliente_id] = {
+            'totali': {str(p_id): v['totale'] for p_id, v in prodotti.items()},
+            'completo': {str(p_id): {'totale': v['totale'],
+                                     'punteggio': round(v['punteggio'], 2),
+                                     'ultima_data': v['ultima_data'].strftime('%Y-%m-%d')}
+                         for p_id, v in prodotti.items()},
+        }
+    return risultato
+
+def carica_tutti_suggerimenti():
+    """Riempie la cache per tutti i clienti (all'avvio)."""
+    with lock_suggerimenti:
+        versioni = dict(versioni_suggerimenti)
+    calcolati = calcola_suggerimenti(query_suggerimenti_cliente().all())
+    with lock_suggerimenti:
+        suggerimenti_clienti.clear()
+        for cliente_id, voce in calcolati.items():
+            if versioni_suggerimenti.get(cliente_id, 0) == versioni.get(cliente_id, 0):
+                suggerimenti_clienti[cliente_id] = voce
+    return len(calcolati)
+
+def leggi_suggerimenti(cliente_id):
+    """Voce del cliente dalla cache; se manca la calcola (e la salva)."""
+    vuoto = {'totali': {}, 'completo': {}}
+    with lock_suggerimenti:
+        voce = suggerimenti_clienti.get(cliente_id)
+        if voce is not None:
+            return voce
+        versione = versioni_suggerimenti.get(cliente_id, 0)
+
+    voce = calcola_suggerimenti(query_suggerimenti_cliente(cliente_id).all()).get(cliente_id, vuoto)
+    with lock_suggerimenti:
+        # Se nel frattempo un ordine ha invalidato il cliente, quello che abbiamo letto
+        # potrebbe essere già vecchio: lo restituiamo ma non lo teniamo
+        if versioni_suggerimenti.get(cliente_id, 0) == versione:
+            suggerimenti_clienti[cliente_id] = voce
+    return voce
+
+def invalida_suggerimenti(clienti_ids):
+    """Da chiamare DOPO il commit di un ordine salvato/modificato/eliminato."""
+    with lock_suggerimenti:
+        for cliente_id in set(int(c) for c in clienti_ids):
+            suggerimenti_clienti.pop(cliente_id, None)
+            versioni_suggerimenti[cliente_id] = versioni_suggerimenti.get(cliente_id, 0) + 1
+
+@app.route('/api/suggerimenti_cliente/<int:cliente_id>')
+def api_suggerimenti_cliente(cliente_id):
+    # Restituisce: {id_prodotto: totale_acquistato}
+    # Con ?completo=1: {id_prodotto: {totale, punteggio, ultima_data}}
+    voce = leggi_suggerimenti(cliente_id)
+    if request.args.get('completo') == '1':
+        return jsonify(voce['completo'])
+    return jsonify(voce['totali'])
+
+# ------------------------------------------------------------------------------
+# CATALOGO CLIENTI/PRODOTTI PER LE SELECT (ricerca a pagine)
+# ------------------------------------------------------------------------------
+# Le pagine crea_ordine e modifica_ordine non ricevono più TUTTI i clienti e i
+# prodotti come <option>: Select2 chiede al server una pagina di risultati alla
+# volta mentre si scrive.
+#   /api/catalogo/clienti?q=ros&pagina=1
+#   /api/catalogo/prodotti?q=krap&cliente_id=5&pagina=1
+#   /api/catalogo/prodotti?ids=3,7,9          (testi aggiornati di righe già in tabella)
+# Ordine: per i prodotti prima quelli che il cliente compra (punteggio recente),
+# poi quelli che INIZIANO con la parola cercata, poi alfabetico.
+# Ogni risposta ha un ETag: se non è cambiato nulla il browser riceve un 304 vuoto.
+# (Le pagine ordine cercano i prodotti nella copia del catalogo nel browser, vedi
+# sotto: static/js/catalogo.js usa lo stesso ordine.)
+
+PER_PAGINA_CATALOGO = 30
+
+def testo_opzione(voce):
+    return f"{voce.nome} (Cod. {voce.codice})"
+
+def ricerca_catalogo(modello, testo):
+    """Elementi attivi in cui ogni parola cercata compare nel nome o nel codice."""
+    query = db.session.query(modello).filter(modello.attivo == True)
+    for parola in (testo or '').split():
+        simile = f"%{parola}%"
+        query = query.filter(db.or_(modello.nome.ilike(simile), modello.codice.ilike(simile)))
+    return query.all()
+
+def inizia_con(voce, testo):
+    parola = (testo or '').split()[:1]
+    if not parola:
+        return False
+    parola = parola[0].lower()
+    return voce.nome.lower().startswith(parola) or voce.codice.lower().startswith(parola)
+
+def elementi_per_id(modello, testo_ids):
+    ids = [int(i) for i in testo_ids.split(',') if i.strip().isdigit()]
+    if not ids:
+        return []
+    return modello.query.filter(modello.id.in_(ids), modello.attivo == True).all()
+
+def pagina_catalogo(elementi, pagina):
+    inizio = (pagina - 1) * PER_PAGINA_CATALOGO
+    return elementi[inizio:inizio + PER_PAGINA_CATALOGO], len(elementi) > inizio + PER_PAGINA_CATALOGO
+
+def risposta_con_etag(dati):
+    """JSON con ETag (impronta del contenuto): a parità di risposta il browser riceve un 304."""
+    risposta = jsonify(dati)
+    risposta.add_etag()
+    risposta.headers['Cache-Control'] = 'private, no-cache' # Il browser la tiene, ma chiede sempre se è cambiata
+    return risposta.make_conditional(request)
+
+@app.route('/api/catalogo/clienti')
+def api_catalogo_clienti():
+    try:
+        testo = request.args.get('q', '')
+        pagina = max(request.args.get('pagina', 1, type=int), 1)
+        if request.args.get('ids'):
+            clienti, altri = elementi_per_id(Cliente, request.args['ids']), False
+        else:
+            clienti = sorted(ricerca_catalogo(Cliente, testo),
+                             key=lambda c: (not inizia_con(c, testo), c.nome.lower()))
+            clienti, altri = pagina_catalogo(clienti, pagina)
+
+        return risposta_con_etag({
+            'status': 'OK',
+            'risultati': [{'id': c.id, 'text': testo_opzione(c), 'tipo': 'clienti'} for c in clienti],
+            'altri': altri
+        })
+    except Exception as e:
+        app.logger.error(f"Errore API CATALOGO CLIENTI: {e}")
+        return jsonify({'status': 'KO', 'errore': str(e)}), 500
+
+@app.route('/api/catalogo/prodotti')
+def api_catalogo_prodotti():
+    try:
+        testo = request.args.get('q', '')
+        pagina = max(request.args.get('pagina', 1, type=int), 1)
+        cliente_id = request.args.get('cliente_id', type=int)
+        storico = leggi_suggerimenti(cliente_id)['completo'] if cliente_id else {}
+
+        def punteggio(p):
+            return storico.get(str(p.id), {}).get('punteggio', 0)
+
+        if request.args.get('ids'):
+            prodotti, altri = elementi_per_id(Prodotto, request.args['ids']), False
+        else:
+            prodotti = sorted(ricerca_catalogo(Prodotto, testo),
+                              key=lambda p: (-punteggio(p), not inizia_con(p, testo), p.nome.lower()))
+            prodotti, altri = pagina_catalogo(prodotti, pagina)
+
+        return risposta_con_etag({
+            'status': 'OK',
+            'risultati': [{
+                'id': p.id, 'text': testo_opzione(p), 'tipo': 'prodotti', 'prezzo': in_euro(p.prezzo),
+                # Pezzi comprati dal cliente (la "stella" nella select)
+                'acquistati': storico.get(str(p.id), {}).get('totale', 0)
+            } for p in prodotti],
+            'altri': altri
+        })
+    except Exception as e:
+        app.logger.error(f"Errore API CATALOGO PRODOTTI: {e}")
+        return jsonify({'status': 'KO', 'errore': str(e)}), 500
+
+# ------------------------------------------------------------------------------
+# COPIA DEL CATALOGO PRODOTTI NEL BROWSER (versione + differenze)
+# ------------------------------------------------------------------------------
+# Il catalogo cambia di rado (anagrafica prodotti e import del listino): le pagine
+# ordine ne tengono una copia nel browser (IndexedDB, static/js/catalogo.js) e la
+# ricerca prodotti gira lì, senza chiedere nulla al server a ogni tasto.
+# Ogni modifica a prodotto fa crescere catalogo_versione (trigger, migrazione 5),
+# e ogni prodotto ricorda la versione in cui è cambiato l'ultima volta.
+#   /api/catalogo/snapshot              -> catalogo completo (solo prodotti attivi)
+#   /api/catalogo/snapshot?since=120    -> solo i prodotti cambiati dopo la 120
+# L'ETag è "versione-since": se la copia è già aggiornata si risponde 304 senza
+# leggere i prodotti.
+
+CAMPI_SNAPSHOT = ['id', 'codice', 'nome', 'prezzo']
+
+def versione_catalogo():
+    """(versione attuale, versione dell'ultima cancellazione vera di un prodotto)."""
+    return tuple(db.session.execute(db.text(
+        "SELECT versione, versione_eliminazione FROM catalogo_versione WHERE id = 1"
+    )).one())
+
+@app.route('/api/catalogo/snapshot')
+def api_catalogo_snapshot():
+    try:
+        versione, versione_eliminazione = versione_catalogo()
+        since = request.args.get('since', type=int)
+        # Dopo una cancellazione vera (o con una copia "dal futuro") si rimanda tutto
+        completo = since is None or since < versione_eliminazione or since > versione
+
+        etag = f"{versione}-{'completo' if completo else since}"
+        if request.if_none_match.contains(etag):
+            risposta = app.response_class(status=304)
+        else:
+            if completo:
+                righe = db.session.execute(db.text(
+                    "SELECT id, codice, nome, prezzo, attivo FROM prodotto WHERE attivo = 1"
+                )).all()
+            else:
+                righe = db.session.execute(db.text(
+                    "SELECT id, codice, nome, prezzo, attivo FROM prodotto WHERE versione > :since"
+                ), {'since': since}).all()
+
+            risposta = jsonify({
+                'status': 'OK',
+                'versione': versione,
+                'completo': completo,
+                'campi': CAMPI_SNAPSHOT,
+                # Liste al posto di dizionari: metà dei byte sul catalogo intero
+                'prodotti': [[r.id, r.codice, r.nome, in_euro(r.prezzo)] for r in righe if r.attivo],
+                # Prodotti archiviati dopo "since": la copia nel browser li toglie
+                'rimossi': [r.id for r in righe if not r.attivo]
+            })
+
+        risposta.set_etag(etag)
+        risposta.headers['Cache-Control'] = 'private, no-cache'
+        return risposta
+    except Exception as e:
+        app.logger.error(f"Errore API CATALOGO SNAPSHOT: {e}")
+        return jsonify({'status': 'KO', 'errore': str(e)}), 500
+
+# ------------------------------------------------------------------------------
+# ANTEPRIME PDF IN MEMORIA
+# ------------------------------------------------------------------------------
+# Il PDF di anteprima non passa più dalla cartella static/temp: resta in RAM
+# (come bytes) associato a un "token" casuale. Teniamo solo le ultime
+# MAX_ANTEPRIME_PDF anteprime: quando se ne aggiunge una nuova, esce la più vecchia.
+# Così due schede aperte insieme non si cancellano più i file a vicenda.
+
+MAX_ANTEPRIME_PDF = 20
+anteprime_pdf = OrderedDict() # token -> {'nome_file': ..., 'pdf': bytes, 'ordine': {...}}
+lock_anteprime = threading.Lock()
+
+def salva_anteprima_pdf(nome_file, contenuto_pdf, ordine=None):
+    # 'ordine' = i dati (data, note, righe) da cui è nato il PDF: invia_definitivo salva
+    # esattamente quelli, anche se nel frattempo la bozza è stata cambiata
+    token = secrets.token_urlsafe(16)
+    with lock_anteprime:
+        anteprime_pdf[token] = {'nome_file': nome_file, 'pdf': contenuto_pdf, 'ordine': ordine}
+        while len(anteprime_pdf) > MAX_ANTEPRIME_PDF:
+            anteprime_pdf.popitem(last=False)
+    return token
+
+def leggi_anteprima_pdf(token):
+    """Restituisce {'nome_file', 'pdf', 'ordine'} oppure None se l'anteprima è scaduta."""
+    with lock_anteprime:
+        anteprima = anteprime_pdf.get(token)
+        if anteprima is not None:
+            anteprime_pdf.move_to_end(token) # Usata di recente: la teniamo
+        return anteprima
+
+def elimina_anteprima_pdf(token):
+    with lock_anteprime:
+        anteprime_pdf.pop(token, None)
+
+# ------------------------------------------------------------------------------
+# BOZZA ORDINE LATO SERVER
+# ------------------------------------------------------------------------------
+# L'ordine in preparazione non viaggia più nel cookie di sessione (limite ~4KB e
+# rifirmato a ogni risposta): sta nelle tabelle bozza_ordine / bozza_riga e nel
+# cookie resta solo session['bozza_id'].
+# La pagina crea_ordine.html manda solo le righe CAMBIATE (autosalvataggio) a
+# /api/bozza; le bozze non toccate da BOZZA_DURATA_ORE vengono cancellate.
+
+BOZZA_DURATA_ORE = 48
+RIGHE_BOZZA_PER_INSERT = 500 # Limite di parametri SQLite: inseriamo a pacchetti
+
+def pulisci_bozze_scadute():
+    limite = datetime.now() - timedelta(hours=BOZZA_DURATA_ORE)
+    scadute = db.session.query(BozzaOrdine.id).filter(BozzaOrdine.aggiornata_il < limite)
+    BozzaRiga.query.filter(BozzaRiga.bozza_id.in_(scadute.scalar_subquery())).delete(synchronize_session=False)
+    BozzaOrdine.query.filter(BozzaOrdine.aggiornata_il < limite).delete(synchronize_session=False)
+
+def bozza_corrente(crea=False):
+    """La bozza di questa sessione (o None). Con crea=True ne apre una nuova se manca."""
+    bozza_id = session.get('bozza_id')
+    bozza = db.session.get(BozzaOrdine, bozza_id) if bozza_id else None
+    if bozza is None and crea:
+        pulisci_bozze_scadute()
+        bozza = BozzaOrdine(id=secrets.token_urlsafe(16), aggiornata_il=datetime.now())
+        db.session.add(bozza)
+        session['bozza_id'] = bozza.id
+    return bozza
+
+def aggiorna_bozza(bozza, dati):
+    """
+    Applica alla bozza le modifiche mandate dalla pagina (tutte facoltative):
+      data, note  -> campi dell'ordine
+      svuota      -> true: toglie tutte le righe prima di applicare le altre
+      righe       -> righe nuove o cambiate [{cliente_id, prodotto_id, quantita, cliente_check, prodotto_check}]
+      tolte       -> righe rimosse [{cliente_id, prodotto_id}]
+    """
+    if 'data' in dati:
+        bozza.data_consegna = dati['data']
+    if 'note' in dati:
+        bozza.note = dati['note']
+    if dati.get('svuota'):
+        BozzaRiga.query.filter_by(bozza_id=bozza.id).delete(synchronize_session=False)
+
+    for riga in dati.get('tolte') or []:
+        BozzaRiga.query.filter_by(bozza_id=bozza.id, cliente_id=int(riga['cliente_id']),
+                                  prodotto_id=int(riga['prodotto_id'])).delete(synchronize_session=False)
+
+    valori = [{
+        'bozza_id': bozza.id,
+        'cliente_id': int(r['cliente_id']),
+        'prodotto_id': int(r['prodotto_id']),
+        'quantita': int(r['quantita']),
+        'cliente_check': r.get('cliente_check'),
+        'prodotto_check': r.get('prodotto_check'),
+    } for r in dati.get('righe') or []]
+    for inizio in range(0, len(valori), RIGHE_BOZZA_PER_INSERT):
+        stmt = sqlite_insert(BozzaRiga).values(valori[inizio:inizio + RIGHE_BOZZA_PER_INSERT])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['bozza_id', 'cliente_id', 'prodotto_id'],
+            set_={
+                'quantita': stmt.excluded.quantita,
+                'cliente_check': stmt.excluded.cliente_check,
+                'prodotto_check': stmt.excluded.prodotto_check
+            }
+        )
+        db.session.execute(stmt)
+
+    bozza.aggiornata_il = datetime.now()
+
+def righe_bozza(bozza):
+    """Righe della bozza nell'ordine in cui sono state aggiunte (stesso formato che mandava la pagina)."""
+    righe = BozzaRiga.query.filter_by(bozza_id=bozza.id).order_by(BozzaRiga.id).all()
+    return [{'cliente_id': r.cliente_id, 'prodotto_id': r.prodotto_id, 'quantita': r.quantita,
+             'cliente_check': r.cliente_check, 'prodotto_check': r.prodotto_check} for r in righe]
+
+def elimina_bozza(bozza_id):
+    if not bozza_id:
+        return
+    BozzaRiga.query.filter_by(bozza_id=bozza_id).delete(synchronize_session=False)
+    BozzaOrdine.query.filter_by(id=bozza_id).delete(synchronize_session=False)
+
+@app.route('/api/bozza', methods=['GET', 'POST'])
+def api_bozza():
+    """GET: contenuto della bozza. POST: autosalvataggio (solo le modifiche, vedi aggiorna_bozza)."""
+    try:
+        if request.method == 'GET':
+            bozza = bozza_corrente()
+            if bozza is None:
+                return jsonify({"status": "OK", "data": None, "note": None, "righe": []})
+            return jsonify({"status": "OK", "data": bozza.data_consegna, "note": bozza.note, "righe": righe_bozza(bozza)})
+
+        bozza = bozza_corrente(crea=True)
+        aggiorna_bozza(bozza, request.get_json() or {})
+        db.session.commit()
+        return jsonify({"status": "OK", "num_righe": BozzaRiga.query.filter_by(bozza_id=bozza.id).count()})
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Errore BOZZA ORDINE: {e}")
+        return jsonify({"status": "KO", "errore": str(e)}), 500
 
 @app.route('/genera_anteprima', methods=['POST'])
 def genera_anteprima():
     """
-    Riceve i dati dal frontend, crea il PDF nella cartella temp 
-    e salva i dati in Sessione per l'invio successivo.
+    Crea il PDF in memoria partendo dalla bozza dell'ordine (lato server).
+    La pagina manda data e note (le righe sono già nella bozza grazie all'autosalvataggio)
+    e 'num_righe' per controllo. Se manda anche 'righe', la bozza viene sostituita con quelle.
     """
     try:
-        # 1. Creazione cartella temp e pulizia vecchi file
-        percorso_temp = os.path.join(app.root_path, 'static', 'temp')
-        if not os.path.exists(percorso_temp):
-            os.makedirs(percorso_temp)
-        
-        for filename in os.listdir(percorso_temp):
-            file_path = os.path.join(percorso_temp, filename)
-            try:
-                if os.path.isfile(file_path):
-                    os.unlink(file_path)
-            except Exception as e:
-                print(f"Errore pulizia: {e}")
+        # 1. Aggiorniamo la BOZZA e leggiamo da lì le righe
+        dati_json = request.get_json() or {}
+        bozza = bozza_corrente(crea=True)
+        if 'righe' in dati_json:
+            dati_json = dict(dati_json, svuota=True)
+        aggiorna_bozza(bozza, dati_json)
+        db.session.commit()
 
-        # 2. Riceviamo i dati e li SALVIAMO IN SESSIONE
-        dati_json = request.get_json()
-        session['dati_ordine_temp'] = dati_json
+        righe = righe_bozza(bozza)
+        num_attese = dati_json.get('num_righe')
+        if num_attese is not None and int(num_attese) != len(righe):
+            # Autosalvataggio perso (es. sessione nuova): la pagina rimanda tutto
+            return jsonify({"status": "KO", "risincronizza": True,
+                            "errore": "La bozza sul server non è aggiornata."}), 409
+        if not righe:
+            return jsonify({"status": "KO", "errore": "Ordine vuoto!"}), 400
 
-        raw_data = dati_json.get('data', 'N/D')
-        note_generali = dati_json.get('note', '')
-        righe = dati_json.get('righe', [])
+        raw_data = bozza.data_consegna or 'N/D'
+        note_generali = bozza.note or ''
 
         # Parsing Data (Doppio formato: per PDF e per Nome File)
         try:
@@ -385,51 +804,29 @@ def genera_anteprima():
             data_per_pdf = raw_data
             data_per_filename = "senza_data"
 
-        # 3. Trasformazione Dati in Matrice per il PDF
-        clienti_header = {} 
-        prodotti_matrix = {} 
-        totali_per_cliente = {} 
-
+        # 2. Trasformazione Dati in Matrice per il PDF
+        # I nomi arrivano come "Nome (Cod. X)": li separiamo UNA volta per cliente/prodotto
+        clienti_header = {}
+        prodotti_header = {}
         for riga in righe:
             c_id = str(riga['cliente_id'])
             p_id = str(riga['prodotto_id'])
-            qta = int(riga['quantita'])
-            
-            # Parsing Cliente
-            c_raw = riga.get('cliente_check', 'Sconosciuto')
-            if ' (' in c_raw:
-                parts = c_raw.split(' (Cod. ')
-                c_nome = parts[0]
-                c_cod = parts[1].replace(')', '') if len(parts) > 1 else "N/D"
-            else:
-                c_nome = c_raw
-                c_cod = "N/D"
-            
             if c_id not in clienti_header:
+                c_nome, c_cod = separa_nome_codice(riga.get('cliente_check') or 'Sconosciuto')
                 clienti_header[c_id] = {'nome': pulisci_testo(c_nome), 'codice': pulisci_testo(c_cod)}
-                totali_per_cliente[c_id] = 0
-
-            totali_per_cliente[c_id] += qta
-
-            # Parsing Prodotto
-            p_raw = riga.get('prodotto_check', 'Sconosciuto')
-            if ' (' in p_raw:
-                parts = p_raw.split(' (Cod. ')
-                p_nome = parts[0]
-                p_cod = parts[1].replace(')', '') if len(parts) > 1 else "N/D"
-            else:
-                p_nome = p_raw
-                p_cod = "N/D"
-
-            if p_id not in prodotti_matrix:
-                prodotti_matrix[p_id] = {
-                    'nome': pulisci_testo(p_nome),
-                    'codice': pulisci_testo(p_cod),
-                    'qta_clienti': {}
-                }
-            prodotti_matrix[p_id]['qta_clienti'][c_id] = qta
-
-        # 4. Creazione PDF Grafico SU MISURA
+            if p_id not in prodotti_header:
+                p_nome, p_cod = separa_nome_codice(riga.get('prodotto_check') or 'Sconosciuto')
+                prodotti_header[p_id] = {'nome': pulisci_testo(p_nome), 'codice': pulisci_testo(p_cod)}
+
+        matrice = costruisci_matrice(
+            [str(r['cliente_id']) for r in righe],
+            [str(r['prodotto_id']) for r in righe],
+            [int(r['quantita']) for r in righe],
+            clienti_header,
+            prodotti_header
+        )
+
+        # 3. Creazione PDF Grafico SU MISURA
         
         # --- A. DEFINIZIONE MISURE ---
         w_cod_prod = 20   
@@ -441,13 +838,13 @@ def genera_anteprima():
 
         # --- B. CALCOLO LARGHEZZA ---
         # MargineSX + Cod + Nome + (NumeroClienti * LarghezzaCliente) + Totale + MargineDX
-        num_clienti = len(clienti_header)
+        num_clienti = len(matrice['clienti'])
         width_custom = margine_laterale + w_cod_prod + w_nom_prod + (num_clienti * w_cli) + w_tot + margine_laterale
 
         # --- C. CALCOLO ALTEZZA ---
         
         # 1. Calcoliamo il numero di prodotti (righe)
-        num_prodotti = len(prodotti_matrix)
+        num_prodotti = len(matrice['prodotti'])
 
         # 2. Altezza della struttura base (Intestazione + Tabella + Totali)
         # 30mm (Header Pagina) + 2 righe (Header Tabella) + N righe prodotti + 1 riga Totali
@@ -484,13 +881,12 @@ def genera_anteprima():
 
         # Testata
         pdf.cell(0, 6, f"Riepilogo del {data_per_pdf}", new_x="LMARGIN", new_y="NEXT")
-        num_ordini = len(clienti_header)
+        num_ordini = len(matrice['clienti'])
         pdf.cell(0, 6, f"Numero ordini: {num_ordini}", new_x="LMARGIN", new_y="NEXT")
         pdf.ln(2)     
 
-        # --- TABELLA (Preparazione Dati) ---
-        clienti_ordinati = sorted(clienti_header.items(), key=lambda x: x[1]['nome'])
-        ids_clienti_ordinati = [x[0] for x in clienti_ordinati]
+        # --- TABELLA (Dati già ordinati per nome dalla matrice) ---
+        clienti_ordinati = matrice['clienti']
 
         # Calcolo larghezza totale tabella (serve per la cornice finale)
         total_table_width = w_cod_prod + w_nom_prod + (len(clienti_ordinati) * w_cli) + w_tot
@@ -506,14 +902,14 @@ def genera_anteprima():
         # RIGA 1 INTESTAZIONE
         pdf.cell(w_cod_prod, h_row, "", border=1)
         pdf.cell(w_nom_prod, h_row, "Cod. Cliente", border=1, align='C')
-        for c_id, dati_c in clienti_ordinati:
+        for dati_c in clienti_ordinati:
             pdf.cell(w_cli, h_row, dati_c['codice'], border=1, align='C', fill=False)
         pdf.cell(w_tot, h_row, "TOT", border=1, align='C', new_x="LMARGIN", new_y="NEXT") 
 
         # RIGA 2 INTESTAZIONE
         pdf.cell(w_cod_prod, h_row, "Cod. Prod.", border=1, align='C')
         pdf.cell(w_nom_prod, h_row, "Nome Prodotto", border=1, align='C')
-        for c_id, dati_c in clienti_ordinati:
+        for dati_c in clienti_ordinati:
             nome = dati_c['nome']
             display_nome = (nome[:10] + '.') if len(nome) > 10 else nome
             pdf.cell(w_cli, h_row, display_nome, border=1, align='C')
@@ -521,9 +917,8 @@ def genera_anteprima():
 
         # CORPO TABELLA
         pdf.set_font("Helvetica", 'B' ,size=8)
-        totale_globale_cartoni = 0
 
-        for p_id, dati in sorted(prodotti_matrix.items(), key=lambda x: x[1]['nome']):
+        for i, dati in enumerate(matrice['prodotti']):
             pdf.set_font("Helvetica", 'B' ,size=8)
             pdf.cell(w_cod_prod, h_row, dati['codice'], border=1, align='C')
             pdf.set_font("Helvetica",size=8)
@@ -531,31 +926,21 @@ def genera_anteprima():
             pdf.cell(w_nom_prod, h_row, nome_p, border=1, align='L')
             pdf.set_font("Helvetica", 'B' ,size=8)
             
-            totale_riga = 0
-            for c_id in ids_clienti_ordinati:
-                qta = dati['qta_clienti'].get(c_id, '') 
+            for qta in matrice['quantita'][i].tolist():
                 display_qta = str(qta) if qta else '-'
-                if qta: totale_riga += int(qta)
-                
-                if qta: pdf.set_font("Helvetica", 'B', 8)
                 pdf.cell(w_cli, h_row, display_qta, border=1, align='C')
-                if qta: pdf.set_font("Helvetica", 'B', size=8)
             
-            pdf.set_font("Helvetica", 'B', 8)
-            pdf.cell(w_tot, h_row, str(totale_riga), border=1, align='C', new_x="LMARGIN", new_y="NEXT")
-            pdf.set_font("Helvetica", 'B', size=8)
-            totale_globale_cartoni += totale_riga
+            pdf.cell(w_tot, h_row, str(matrice['totali_prodotti'][i]), border=1, align='C', new_x="LMARGIN", new_y="NEXT")
 
         # RIGA TOTALI FINALI
         pdf.set_font("Helvetica", 'B', 8)
         pdf.cell(w_cod_prod, h_row, "", border=1)
         pdf.cell(w_nom_prod, h_row, "TOTALI", border=1, align='C')
         
-        for c_id in ids_clienti_ordinati:
-            somma_colonna = totali_per_cliente[c_id]
+        for somma_colonna in matrice['totali_clienti'].tolist():
             pdf.cell(w_cli, h_row, str(somma_colonna), border=1, align='C')
             
-        pdf.cell(w_tot, h_row, str(totale_globale_cartoni), border=1, align='C', new_x="LMARGIN", new_y="NEXT")
+        pdf.cell(w_tot, h_row, str(matrice['totale']), border=1, align='C', new_x="LMARGIN", new_y="NEXT")
 
         # --- DISEGNO CORNICE ESTERNA SPESSA ---
         y_fine_tabella = pdf.get_y()
@@ -576,18 +961,19 @@ def genera_anteprima():
             # 5 = altezza di ogni riga
             pdf.multi_cell(0, 5, pulisci_testo(note_generali), border=0, align='L')
 
-        # Salvataggio su file temp
+        # Salvataggio in memoria (niente file temporanei)
 
         # Aggiungiamo l'orario al nome file (Es. 10-30)
         orario = datetime.now().strftime('%H-%M')
 
         # Nome: preview_ordini_29-11-2025_orario_10-30.pdf
         nome_file = f"preview_ordini_{data_per_filename}_orario_{orario}.pdf"
-        percorso_pdf = os.path.join(percorso_temp, nome_file)
-        pdf.output(percorso_pdf)
-        return jsonify({"status": "OK", "filename": nome_file})
+        ordine = {'data': bozza.data_consegna, 'note': bozza.note, 'righe': righe, 'bozza_id': bozza.id}
+        token = salva_anteprima_pdf(nome_file, bytes(pdf.output()), ordine)
+        return jsonify({"status": "OK", "filename": nome_file, "token": token})
 
     except Exception as e:
+        db.session.rollback()
         print(f"ERRORE PDF: {e}")
         import traceback
         traceback.print_exc()
@@ -596,20 +982,82 @@ def genera_anteprima():
 
 @app.route('/mostra_preview')
 def mostra_preview():
-    nome_file = request.args.get('file', 'preview_ordini.pdf')
-    return render_template('preview.html', filename=nome_file)
+    token = request.args.get('token', '')
+    anteprima = leggi_anteprima_pdf(token)
+    if anteprima is None:
+        flash("Anteprima scaduta: rigenera il PDF dell'ordine.", 'error')
+        return redirect(url_for('crea_ordine'))
+    return render_template('preview.html', filename=anteprima['nome_file'], token=token)
+
+@app.route('/anteprima_pdf/<token>')
+def anteprima_pdf(token):
+    # Serve il PDF direttamente dalla RAM
+    anteprima = leggi_anteprima_pdf(token)
+    if anteprima is None:
+        return "Anteprima scaduta", 404
+    return send_file(io.BytesIO(anteprima['pdf']), mimetype='application/pdf',
+                     download_name=anteprima['nome_file'], max_age=0)
 
 # ==============================================================================
 # 8. INVIO DEFINITIVO E SALVATAGGIO DB
 # ==============================================================================
 
+def salva_ordine(dati_ordine, ora_creazione):
+    """
+    Scrive l'ordine, le sue righe, il riepilogo vendite e gli ultimi acquisti nella transazione corrente
+    (il commit lo fa chi chiama). Per le righe: UNA query per i prezzi di tutti i
+    prodotti e UN inserimento "in blocco", anche con migliaia di righe.
+    Restituisce (ordine, righe_riepilogo [(cliente_id, prodotto_id, quantita, prezzo)]).
+    """
+    data_obj = datetime.strptime(dati_ordine.get('data'), '%Y-%m-%d').date()
+
+    nuovo_ordine = Ordine(
+        data_consegna=data_obj,
+        note=dati_ordine.get('note'),
+        stato='inviato',
+        ora_creazione=ora_creazione
+    )
+    db.session.add(nuovo_ordine)
+    db.session.flush() # Otteniamo l'ID
+
+    righe = dati_ordine.get('righe', [])
+
+    # --- RECUPERO PREZZI ATTUALI (tutti insieme) ---
+    id_prodotti = {int(riga['prodotto_id']) for riga in righe}
+    prezzi = dict(db.session.query(Prodotto.id, Prodotto.prezzo).filter(Prodotto.id.in_(id_prodotti)).all()) if id_prodotti else {}
+
+    righe_riepilogo = []
+    for riga in righe:
+        prodotto_id = int(riga['prodotto_id'])
+        prezzo_unit = prezzi.get(prodotto_id) or 0 # Prezzo al momento dell'ordine (centesimi)
+        righe_riepilogo.append((int(riga['cliente_id']), prodotto_id, int(riga['quantita']), prezzo_unit))
+
+    if righe_riepilogo:
+        db.session.execute(DettaglioOrdine.__table__.insert(), [
+            {'ordine_id': nuovo_ordine.id, 'cliente_id': c_id, 'prodotto_id': p_id, 'quantita': qta, 'prezzo_storico': prezzo}
+            for c_id, p_id, qta, prezzo in righe_riepilogo
+        ])
+
+    aggiorna_riepilogo_vendite(nuovo_ordine, righe_riepilogo, segno=1)
+    aggiungi_ultimi_acquisti(nuovo_ordine, righe_riepilogo)
+    return nuovo_ordine, righe_riepilogo
+
 @app.route('/invia_definitivo', methods=['POST'])
 def invia_definitivo():
     try:
         # 1. Recupero Dati
         dati_req = request.get_json()
-        nome_file_preview = dati_req.get('filename')
-        dati_ordine = session.get('dati_ordine_temp')
+        token = dati_req.get('token')
+        anteprima = leggi_anteprima_pdf(token)
+
+        if anteprima is None:
+            return jsonify({
+                "status": "KO",
+                "errore": "Anteprima scaduta (il programma è stato riavviato?). Torna indietro e rigenera il PDF."
+            }), 400
+        nome_file_preview = anteprima['nome_file']
+        # I dati dell'ordine sono quelli fotografati insieme al PDF (vedi genera_anteprima)
+        dati_ordine = anteprima.get('ordine')
 
         # --- CONTROLLO DI SICUREZZA ---
         # Se la sessione è scaduta o vuota, ci fermiamo SUBITO.
@@ -627,101 +1075,76 @@ def invia_definitivo():
         orario_sporco = parti_nome[-1] 
         orario_pulito = orario_sporco.replace('.pdf', '') # "10-30"
 
-        # 2. Salvataggio nel Database (Siamo sicuri che i dati sono in sessione)
+        # Nomi del PDF: archivio locale con l'orario (unico), email solo con la data
+        # Es: ordini_15-12-2025_orario_10-30.pdf  /  ordini_15-12-2025.pdf
+        nome_file_archivio = nome_file_preview.replace('preview_ordini', 'ordini')
+        data_pulita = nome_file_preview.split('_')[2] # Prende la parte della data (es. 15-12-2025)
+        nome_file_email = f"ordini_{data_pulita}.pdf"
+
+        if not EMAIL_DESTINATARIO:
+            return jsonify({
+                "status": "KO",
+                "errore": "EMAIL_DESTINATARIO non impostato nel file .env: ordine NON salvato."
+            }), 500
+
+        # 2. Salvataggio nel Database: ordine, bozza eliminata ed email in CODA nella
+        # STESSA transazione. O c'è tutto o niente: un ordine salvato senza la sua email
+        # (e rifatto dall'utente dopo l'errore) diventerebbe un doppione.
         try:
-            data_obj = datetime.strptime(dati_ordine.get('data'), '%Y-%m-%d').date()
-            
-            nuovo_ordine = Ordine(
-                data_consegna=data_obj,
-                note=dati_ordine.get('note'),
-                stato='inviato',
-                ora_creazione=orario_pulito
+            nuovo_ordine, righe_riepilogo = salva_ordine(dati_ordine, orario_pulito)
+
+            # La bozza non serve più
+            elimina_bozza(dati_ordine.get('bozza_id'))
+
+            # L'email la invia il postino in background (con nuovi tentativi se fallisce).
+            # Alleghiamo lo stesso PDF archiviato, ma chiamato 'nome_file_email' (senza orario)
+            accoda_email(
+                destinatario=EMAIL_DESTINATARIO,
+                oggetto=f"Consegne del {data_pulita}",
+                corpo="",
+                nome_allegato=nome_file_email,
+                allegato=anteprima['pdf']
             )
-            db.session.add(nuovo_ordine)
-            db.session.flush() # Otteniamo l'ID
-            
-            for riga in dati_ordine.get('righe', []):
-                # --- RECUPERO PREZZO ATTUALE ---
-                prod_db = Prodotto.query.get(riga['prodotto_id'])
-                prezzo_unit = prod_db.prezzo if prod_db else 0.0
-                
-                dettaglio = DettaglioOrdine(
-                    ordine_id=nuovo_ordine.id,
-                    cliente_id=int(riga['cliente_id']),
-                    prodotto_id=int(riga['prodotto_id']),
-                    quantita=int(riga['quantita']),
-                    prezzo_storico=prezzo_unit # Prezzo al momento dell'ordine
-                )
-                db.session.add(dettaglio)
-            
             db.session.commit()
-            print("--- ORDINE SALVATO NEL DATABASE ---")
-            
-            # Puliamo la sessione SOLO DOPO aver salvato
-            session.pop('dati_ordine_temp', None)
-            
         except Exception as e_db:
             db.session.rollback()
             app.logger.error(f"ERRORE SALVATAGGIO DB: {e_db}")
             print(f"ERRORE SALVATAGGIO DB: {e_db}")
-            # Se fallisce il DB, ci fermiamo? O inviamo lo stesso?
-            # Meglio fermarsi per coerenza dati.
-            return jsonify({"status": "KO", "errore": f"Errore Salvataggio DB: {str(e_db)}"}), 500
-        
-        # 3. Gestione File PDF (Spostamento in Archivio)
-        cartella_preview = os.path.join(app.root_path, 'static', 'temp')
-        path_preview = os.path.join(cartella_preview, nome_file_preview)
-        
-        # A. NOME PER L'ARCHIVIO LOCALE (Manteniamo l'orario per unicità)
-        # Es: ordini_15-12-2025_orario_10-30.pdf
-        nome_file_archivio = nome_file_preview.replace('preview_ordini', 'ordini')
-        
-        # B. NOME PER L'EMAIL (Pulito, solo data)
-        # Es: ordini_15-12-2025.pdf
-        # Ricaviamo la data pulita dall'oggetto ordine o dal nome file
-        data_pulita = nome_file_preview.split('_')[2] # Prende la parte della data (es. 15-12-2025)
-        nome_file_email = f"ordini_{data_pulita}.pdf"
-        
-        # 3. SALVATAGGIO LOCALE
-        cartella_archivio = os.path.join(app.root_path, 'ARCHIVIO_PDF') 
-        if not os.path.exists(cartella_archivio):
-            os.makedirs(cartella_archivio)
-            
-        path_archivio = os.path.join(cartella_archivio, nome_file_archivio)
-        shutil.copy(path_preview, path_archivio)
-        print(f"File archiviato in: {path_archivio}")
-
-        # 4. Invio Email
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_MITTENTE
-        msg['To'] = EMAIL_DESTINATARIO
-        msg['Subject'] = f"Consegne del {data_pulita}"
-
-        body = ""
-        msg.attach(MIMEText(body, 'plain'))
-
-        # Allegato PDF
-        with open(path_archivio, "rb") as attachment:
-            part = MIMEBase("application", "octet-stream")
-            part.set_payload(attachment.read())
-        
-        encoders.encode_base64(part)
+            return jsonify({"status": "KO", "errore": f"Errore Salvataggio DB: {str(e_db)} (ordine NON salvato)"}), 500
 
-        # Alleghiamo il contenuto fisico di 'path_archivio' (che ha l'orario)
-        # Ma diciamo alla mail di chiamarlo 'nome_file_email' (senza orario)
-        part.add_header("Content-Disposition", f"attachment; filename= {nome_file_email}")
-        msg.attach(part)
+        # Da qui l'ordine È salvato: l'anteprima si toglie subito, così un secondo
+        # click su "Invia" non può salvarlo di nuovo
+        elimina_anteprima_pdf(token)
+        print("--- ORDINE SALVATO NEL DATABASE ---")
+        invalida_suggerimenti(r[0] for r in righe_riepilogo)
+        avvia_postino(app)
 
-        # INVIO MAIL CON SMTP
-        server = smtplib.SMTP_SSL('smtp.mail.yahoo.com', 465)
-        server.login(EMAIL_MITTENTE, EMAIL_PASSWORD)
-        server.send_message(msg)
-        server.quit()
+        # Puliamo la sessione SOLO DOPO aver salvato
+        if session.get('bozza_id') == dati_ordine.get('bozza_id'):
+            session.pop('bozza_id', None)
+
+        # 3. SALVATAGGIO LOCALE del PDF: se fallisce l'ordine e l'email restano,
+        # lo diciamo senza un errore (che inviterebbe a rifare l'ordine)
+        try:
+            cartella_archivio = os.path.join(app.root_path, 'ARCHIVIO_PDF')
+            os.makedirs(cartella_archivio, exist_ok=True)
+            path_archivio = os.path.join(cartella_archivio, nome_file_archivio)
+            with open(path_archivio, "wb") as file_archivio:
+                file_archivio.write(anteprima['pdf'])
+            print(f"File archiviato in: {path_archivio}")
+        except Exception as e_file:
+            app.logger.error(f"Errore ARCHIVIO PDF (ordine {nuovo_ordine.id} già salvato): {e_file}")
+            return jsonify({
+                "status": "OK",
+                "messaggio": "Ordine salvato! L'email partirà in automatico.",
+                "avviso": f"Il PDF NON è stato archiviato nel PC ({e_file}): l'ordine è salvato, non rifarlo.",
+                "id_ordine": nuovo_ordine.id
+            })
 
         return jsonify({
             "status": "OK", 
-            "messaggio": "Email inviata e file archiviato!",
-            "id_ordine": nuovo_ordine.id if 'nuovo_ordine' in locals() else 0
+            "messaggio": "Ordine salvato e file archiviato! L'email partirà in automatico.",
+            "id_ordine": nuovo_ordine.id
         })
 
     except Exception as e:
@@ -733,10 +1156,18 @@ def invia_definitivo():
 # 9. UTILITIES E STORICO
 # ==============================================================================
 
+# Il server di produzione (avvia_server) registra qui come fermarsi "con calma":
+# finisce le richieste in corso e chiude il database, niente segnali al processo
+funzione_spegnimento = None
+
 def spegnimento_ritardato():
-    time.sleep(1)
+    time.sleep(1) # Lasciamo arrivare la risposta al browser
     print("--- SPEGNIMENTO ---")
-    os.kill(os.getpid(), signal.SIGINT)
+    if funzione_spegnimento is not None:
+        funzione_spegnimento()
+    else:
+        # Server di sviluppo (py app.py --debug): non ha un modo per fermarsi da dentro
+        os.kill(os.getpid(), signal.SIGINT)
 
 @app.route('/spegni', methods=['GET'])
 def spegni_server():
@@ -763,9 +1194,16 @@ def backup_dati():
         nome_file = f"backup_{datetime.now().strftime('%Y-%m-%d_%H-%M')}.db"
         dest_path = os.path.join(backup_dir, nome_file)
 
-        # 4. Copia fisica del file
-        import shutil
-        shutil.copy2(db_path, dest_path)
+        # 4. Copia con l'API di backup di SQLite: in modalità WAL le ultime modifiche
+        # possono essere ancora nel file -wal, una copia del solo .db le perderebbe
+        import sqlite3
+        sorgente = apri_connessione(db_path)
+        destinazione = sqlite3.connect(dest_path)
+        try:
+            sorgente.backup(destinazione)
+        finally:
+            destinazione.close()
+            sorgente.close()
 
         # 5. Risponde al Frontend con successo
         return jsonify({
@@ -783,50 +1221,153 @@ def backup_dati():
 def storico():
     try:
         tutti_clienti = Cliente.query.filter_by(attivo=True).all()
-        tutti_ordini = Ordine.query.order_by(Ordine.data_consegna.desc()).all()
-        return render_template('storico.html', clienti=tutti_clienti, ordini=tutti_ordini)
+        # Gli ordini NON vengono più caricati qui: la tabella del registro
+        # li chiede a pagine tramite /api/storico/ordini
+        return render_template('storico.html', clienti=tutti_clienti)
     except Exception as e:
         app.logger.error(f"Errore caricamento STORICO: {e}")
         return f"Errore caricamento storico: {e}", 500
 
+def intervallo_da_testo_data(testo):
+    """
+    Trasforma quello che l'utente scrive nel filtro data in un intervallo (inizio, fine).
+    Accetta: '22/12/2025', '12/2025', '2025'. Se non riconosce il formato restituisce None.
+    """
+    testo = (testo or '').strip()
+    # L'anno deve essere scritto per intero, altrimenti '12' diventerebbe l'anno 0012
+    if len(testo.split('/')[-1]) != 4:
+        return None
+    for formato, durata in (('%d/%m/%Y', 'giorno'), ('%m/%Y', 'mese'), ('%Y', 'anno')):
+        try:
+            inizio = datetime.strptime(testo, formato).date()
+        except ValueError:
+            continue
+        if durata == 'giorno':
+            return inizio, inizio
+        if durata == 'mese':
+            mese_dopo = (inizio.replace(day=28) + timedelta(days=4)).replace(day=1)
+            return inizio, mese_dopo - timedelta(days=1)
+        return inizio, inizio.replace(month=12, day=31)
+    return None
+
+@app.route('/api/storico/ordini')
+def api_storico_ordini():
+    """
+    Registro Ordini lato server (protocollo DataTables 'serverSide').
+    Parametri letti: draw, start, length, search[value], order[0][dir],
+    columns[0][search][value] (filtro data testuale) e, opzionali,
+    data_da / data_a in formato YYYY-MM-DD.
+    """
+    try:
+        draw = request.args.get('draw', 0, type=int)
+        start = max(request.args.get('start', 0, type=int), 0)
+        length = request.args.get('length', 25, type=int)
+        testo_note = request.args.get('search[value]', '').strip()
+        testo_data = request.args.get('columns[0][search][value]', '').strip()
+        direzione = request.args.get('order[0][dir]', 'desc')
+
+        query = Ordine.query
+        totale = query.count()
+        data_da = request.args.get('data_da')
+        data_a = request.args.get('data_a')
+
+        # --- FILTRI ---
+        if testo_note:
+            query = query.filter(Ordine.note.ilike(f"%{testo_note}%"))
+
+        if testo_data:
+            intervallo = intervallo_da_testo_data(testo_data)
+            if intervallo:
+                query = query.filter(Ordine.data_consegna.between(*intervallo))
+            else:
+                # Formato parziale (es. '22/12'): stessa ricerca "contiene" del vecchio filtro
+                query = query.filter(func.strftime('%d/%m/%Y', Ordine.data_consegna).like(f"%{testo_data}%"))
+
+        try:
+            if data_da:
+                query = query.filter(Ordine.data_consegna >= datetime.strptime(data_da, '%Y-%m-%d').date())
+            if data_a:
+                query = query.filter(Ordine.data_consegna <= datetime.strptime(data_a, '%Y-%m-%d').date())
+        except ValueError:
+            return jsonify({'draw': draw, 'error': 'Date non valide (formato atteso YYYY-MM-DD)'}), 400
+
+        # Il secondo COUNT serve solo se c'è almeno un filtro attivo
+        filtrati = query.count() if (testo_note or testo_data or data_da or data_a) else totale
+
+        # --- ORDINAMENTO E PAGINA ---
+        if direzione == 'asc':
+            query = query.order_by(Ordine.data_consegna.asc(), Ordine.ora_creazione.asc(), Ordine.id.asc())
+        else:
+            query = query.order_by(Ordine.data_consegna.desc(), Ordine.ora_creazione.desc(), Ordine.id.desc())
+
+        query = query.offset(start)
+        if length != -1:
+            query = query.limit(max(length, 1))
+
+        righe = []
+        for o in query.all():
+            righe.append({
+                'id': o.id,
+                'data': o.data_consegna.strftime('%d/%m/%Y'),
+                'ora': o.ora_creazione.replace('-', ':') if o.ora_creazione else '00:00',
+                'note': o.note or ''
+            })
+
+        return jsonify({
+            'draw': draw,
+            'recordsTotal': totale,
+            'recordsFiltered': filtrati,
+            'data': righe
+        })
+
+    except Exception as e:
+        app.logger.error(f"Errore API REGISTRO ORDINI: {e}")
+        return jsonify({'draw': request.args.get('draw', 0, type=int), 'error': str(e)}), 500
+
+def query_storico_cliente(cliente_id):
+    """
+    Per ogni prodotto comprato dal cliente: totale pezzi, ultima data e prezzo
+    dell'ultimo acquisto, tutto in UNA query (funzioni finestra di SQLite).
+    """
+    righe_cliente = db.session.query(
+        DettaglioOrdine.prodotto_id.label('prodotto_id'),
+        DettaglioOrdine.prezzo_storico.label('prezzo'),
+        Ordine.data_consegna.label('data_consegna'),
+        func.sum(DettaglioOrdine.quantita).over(
+            partition_by=DettaglioOrdine.prodotto_id
+        ).label('totale_pezzi'),
+        # Posizione 1 = la riga più recente di quel prodotto (a parità di data, la prima inserita)
+        func.row_number().over(
+            partition_by=DettaglioOrdine.prodotto_id,
+            order_by=(Ordine.data_consegna.desc(), DettaglioOrdine.ordine_id, DettaglioOrdine.id)
+        ).label('posizione')
+    ).join(Ordine, DettaglioOrdine.ordine_id == Ordine.id)\
+     .filter(DettaglioOrdine.cliente_id == cliente_id)\
+     .subquery()
+
+    return db.session.query(
+        Prodotto.codice,
+        Prodotto.nome,
+        righe_cliente.c.totale_pezzi,
+        righe_cliente.c.data_consegna.label('ultima_volta'),
+        righe_cliente.c.prezzo.label('ultimo_prezzo')
+    ).join(righe_cliente, righe_cliente.c.prodotto_id == Prodotto.id)\
+     .filter(righe_cliente.c.posizione == 1)\
+     .order_by(desc(righe_cliente.c.totale_pezzi), desc(Prodotto.id))
+
 @app.route('/api/storico_cliente/<int:cliente_id>')
 def api_storico_cliente(cliente_id):
     try:
-        risultati = db.session.query(
-            # Aggiungiamo Prodotto.id all'inizio per poter recuperare il prezzo specifico dopo
-            Prodotto.id,
-            Prodotto.codice,
-            Prodotto.nome,
-            func.sum(DettaglioOrdine.quantita).label('totale_pezzi'),
-            func.max(Ordine.data_consegna).label('ultima_volta')
-        ).join(Prodotto, DettaglioOrdine.prodotto_id == Prodotto.id)\
-         .join(Ordine, DettaglioOrdine.ordine_id == Ordine.id)\
-         .filter(DettaglioOrdine.cliente_id == cliente_id)\
-         .group_by(Prodotto.id)\
-         .order_by(desc('totale_pezzi'))\
-         .all()
+        risultati = query_storico_cliente(cliente_id).all()
 
         data = []
         for r in risultati:
-            # RECUPERO PREZZO: Cerchiamo il prezzo esatto di quel prodotto in quella data
-            ultimo_prezzo = 0.0
-            if r.ultima_volta:
-                det = (DettaglioOrdine.query
-                       .join(Ordine)
-                       .filter(
-                           DettaglioOrdine.cliente_id == cliente_id,
-                           DettaglioOrdine.prodotto_id == r.id,
-                           Ordine.data_consegna == r.ultima_volta
-                       ).first())
-                if det:
-                    ultimo_prezzo = det.prezzo_storico
-
             data.append({
                 'codice': r.codice,
                 'nome': r.nome,
                 'totale': r.totale_pezzi,
                 'ultima_data': r.ultima_volta.strftime('%d/%m/%Y') if r.ultima_volta else '-',
-                'ultimo_prezzo': ultimo_prezzo
+                'ultimo_prezzo': in_euro(r.ultimo_prezzo)
             })
         return jsonify(data)
 
@@ -834,25 +1375,108 @@ def api_storico_cliente(cliente_id):
         app.logger.error(f"Errore API STORICO CLIENTE: {e}")
         return jsonify([]), 500
 
+# ------------------------------------------------------------------------------
+# "CHI HA COMPRATO COSA" (ricerca prodotti FTS5 + tabella ultimo_acquisto)
+# ------------------------------------------------------------------------------
+# Es. "Chi è che mi ha ordinato i Krapfen l'ultima volta?":
+#   /api/cerca_prodotti?q=krap          -> prodotti che iniziano così (nome, codice, ingredienti)
+#   /api/chi_ha_comprato/<prodotto_id>  -> clienti, dal più recente
+# Nessuna delle due legge il dettaglio ordini.
+
+LIMITE_RICERCA_PRODOTTI = 20
+
+def testo_ricerca_fts(testo):
+    """'krap crema' -> '"krap"* "crema"*' (ogni parola come inizio di parola, tutte obbligatorie)."""
+    parole = re.findall(r'[^\W_]+', testo or '')
+    return ' '.join(f'"{parola}"*' for parola in parole)
+
+def cerca_prodotti(testo, limite=LIMITE_RICERCA_PRODOTTI):
+    ricerca = testo_ricerca_fts(testo)
+    if not ricerca:
+        return []
+    # Prima i prodotti attivi, poi per pertinenza (bm25)
+    return db.session.execute(text("""
+        SELECT p.id, p.codice, p.nome, p.attivo
+        FROM prodotto_fts
+        JOIN prodotto p ON p.id = prodotto_fts.rowid
+        WHERE prodotto_fts MATCH :ricerca
+        ORDER BY p.attivo DESC, prodotto_fts.rank
+        LIMIT :limite
+    """), {'ricerca': ricerca, 'limite': limite}).all()
+
+@app.route('/api/cerca_prodotti')
+def api_cerca_prodotti():
+    try:
+        limite = min(request.args.get('limite', LIMITE_RICERCA_PRODOTTI, type=int), 100)
+        risultati = cerca_prodotti(request.args.get('q', ''), limite)
+        return jsonify([
+            {'id': r.id, 'codice': r.codice, 'nome': r.nome, 'attivo': bool(r.attivo)}
+            for r in risultati
+        ])
+    except Exception as e:
+        app.logger.error(f"Errore API CERCA PRODOTTI: {e}")
+        return jsonify([]), 500
+
+def query_chi_ha_comprato(prodotto_id):
+    # Indice (prodotto_id, ultima_data): i clienti arrivano già in ordine di data
+    return db.session.query(
+        Cliente.id, Cliente.codice, Cliente.nome,
+        UltimoAcquisto.ultima_data, UltimoAcquisto.ultima_quantita, UltimoAcquisto.quantita_totale
+    ).join(Cliente, Cliente.id == UltimoAcquisto.cliente_id)\
+     .filter(UltimoAcquisto.prodotto_id == prodotto_id)\
+     .order_by(UltimoAcquisto.ultima_data.desc(), Cliente.nome)
+
+@app.route('/api/chi_ha_comprato/<int:prodotto_id>')
+def api_chi_ha_comprato(prodotto_id):
+    try:
+        data = []
+        for r in query_chi_ha_comprato(prodotto_id).all():
+            data.append({
+                'cliente_id': r.id,
+                'codice': r.codice,
+                'nome': r.nome,
+                'ultima_data': r.ultima_data.strftime('%d/%m/%Y'),
+                'ultima_quantita': r.ultima_quantita,
+                'totale': r.quantita_totale
+            })
+        return jsonify(data)
+
+    except Exception as e:
+        app.logger.error(f"Errore API CHI HA COMPRATO: {e}")
+        return jsonify([]), 500
+
+def carica_ordine_completo(ordine_id):
+    """
+    Carica l'ordine con TUTTE le righe, i clienti e i prodotti collegati.
+    Bastano 2 query (ordine + righe con JOIN su cliente/prodotto), invece di
+    fare Prodotto.query.get() e Cliente.query.get() per ogni riga.
+    """
+    return Ordine.query.options(
+        selectinload(Ordine.righe).options(
+            joinedload(DettaglioOrdine.cliente),
+            joinedload(DettaglioOrdine.prodotto)
+        )
+    ).filter(Ordine.id == ordine_id).first_or_404()
+
 @app.route('/api/dettaglio_ordine/<int:ordine_id>')
 def api_dettaglio_ordine(ordine_id):
     try:
-        ordine = Ordine.query.get_or_404(ordine_id)
-        dettagli = DettaglioOrdine.query.filter_by(ordine_id=ordine_id).all()
+        ordine = carica_ordine_completo(ordine_id)
+        dettagli = ordine.righe
         
-        totale_ordine = 0.0
+        totale_ordine = 0  # Centesimi
         totale_cartoni = 0        # <--- Contatore Cartoni
         clienti_unici = set()     # <--- Set per contare i clienti senza duplicati
         
         lista_righe = []
         for d in dettagli:
-            prod = Prodotto.query.get(d.prodotto_id)
-            cli = Cliente.query.get(d.cliente_id)
+            prod = d.prodotto
+            cli = d.cliente
             
-            # Usiamo il prezzo storico salvato nella riga (o 0.0 se mancante)
-            prezzo_reale = d.prezzo_storico if d.prezzo_storico is not None else 0.0
+            # Usiamo il prezzo storico salvato nella riga (centesimi, 0 se mancante)
+            prezzo_reale = d.prezzo_storico or 0
             
-            # Calcolo totale riga
+            # Calcolo totale riga (in centesimi: la somma resta esatta)
             tot_riga = d.quantita * prezzo_reale
             totale_ordine += tot_riga
             
@@ -866,15 +1490,15 @@ def api_dettaglio_ordine(ordine_id):
                 'prodotto': prod.nome if prod else "Prodotto Cancellato",
                 'codice': prod.codice if prod else "-",
                 'quantita': d.quantita,
-                'prezzo_unit': prezzo_reale, # <--- Ora manda il prezzo storico corretto
-                'prezzo_tot': tot_riga 
+                'prezzo_unit': in_euro(prezzo_reale), # <--- Ora manda il prezzo storico corretto
+                'prezzo_tot': in_euro(tot_riga)
             })
             
         response = {
             'info': {
                 'data': ordine.data_consegna.strftime('%d/%m/%Y'),
                 'note': ordine.note if ordine.note else "Nessuna nota",
-                'totale_generale': totale_ordine,
+                'totale_generale': in_euro(totale_ordine),
                 'num_cartoni': totale_cartoni,        # <--- Aggiunto
                 'num_clienti': len(clienti_unici)     # <--- Aggiunto
             },
@@ -888,81 +1512,126 @@ def api_dettaglio_ordine(ordine_id):
 
 @app.route('/modifica_ordine/<int:ordine_id>')
 def modifica_ordine_page(ordine_id):
-    ordine = Ordine.query.get_or_404(ordine_id)
-    
-    # 1. Carichiamo PRODOTTI e CLIENTI per le select di aggiunta/modifica
-    prodotti = Prodotto.query.filter_by(attivo=True).order_by(Prodotto.nome).all()
-    clienti_tutti = Cliente.query.filter_by(attivo=True).order_by(Cliente.nome).all()
+    ordine = carica_ordine_completo(ordine_id)
     
+    # 1. Le select di aggiunta/modifica cercano clienti e prodotti su /api/catalogo/...
     # 2. Prepariamo i dettagli attuali
     dettagli_list = []
     
     # Qui usiamo ordine.righe che è una lista di oggetti DettaglioOrdine
     for d in ordine.righe:
-        prod = Prodotto.query.get(d.prodotto_id)
-        cli = Cliente.query.get(d.cliente_id)
+        prod = d.prodotto
+        cli = d.cliente
         
         dettagli_list.append({
             'cliente_id': d.cliente_id,
             'cliente_nome': cli.nome if cli else "Cliente Cancellato",
             'prod_id': d.prodotto_id,
             'prod_nome': prod.nome if prod else "Prodotto Cancellato",
+            # Testi come nelle select (senza l'elenco completo la pagina non li ha)
+            'cliente_testo': testo_opzione(cli) if cli else "Cliente Cancellato",
+            'prod_testo': testo_opzione(prod) if prod else "Prodotto Cancellato",
+            # Riga modificabile solo se cliente e prodotto sono ancora attivi
+            'modificabile': bool(cli and cli.attivo and prod and prod.attivo),
             'qta': d.quantita,
-            'prezzo': d.prezzo_storico if d.prezzo_storico is not None else 0.00
+            'prezzo': in_euro(d.prezzo_storico)
         })
 
     return render_template('modifica_ordine.html', 
                            ordine=ordine, 
-                           prodotti=prodotti, 
-                           clienti_tutti=clienti_tutti, # <--- Passiamo anche i clienti
                            dettagli_iniziali=dettagli_list)
 
+def confronta_righe_ordine(esistenti, nuove_righe):
+    """
+    Differenza minima tra le righe salvate e quelle mandate dalla pagina, per (cliente, prodotto).
+    esistenti: righe DettaglioOrdine (id, cliente_id, prodotto_id, quantita, prezzo_storico).
+    nuove_righe: [(cliente_id, prodotto_id, quantita, prezzo)].
+    Se la stessa coppia compare più volte (es. ordini importati) le righe si abbinano
+    nell'ordine in cui arrivano: quelle in più si aggiungono o si tolgono.
+    Restituisce (da_inserire [(c, p, q, prezzo)], da_aggiornare [(id, q, prezzo)], da_eliminare [id],
+                 righe_tolte_riepilogo, righe_nuove_riepilogo).
+    """
+    per_chiave = {}
+    for riga in esistenti:
+        per_chiave.setdefault((riga.cliente_id, riga.prodotto_id), []).append(riga)
+
+    da_inserire, da_aggiornare = [], []
+    tolte_riepilogo, nuove_riepilogo = [], []
+    for c_id, p_id, qta, prezzo in nuove_righe:
+        vecchie = per_chiave.get((c_id, p_id))
+        if not vecchie:
+            da_inserire.append((c_id, p_id, qta, prezzo))
+            nuove_riepilogo.append((c_id, p_id, qta, prezzo))
+            continue
+        vecchia = vecchie.pop(0)
+        prezzo_vecchio = vecchia.prezzo_storico or 0
+        if vecchia.quantita != qta or prezzo_vecchio != prezzo:
+            da_aggiornare.append((vecchia.id, qta, prezzo))
+            tolte_riepilogo.append((c_id, p_id, vecchia.quantita, prezzo_vecchio))
+            nuove_riepilogo.append((c_id, p_id, qta, prezzo))
+
+    # Quelle rimaste senza abbinamento sono state tolte dalla pagina
+    da_eliminare = []
+    for vecchie in per_chiave.values():
+        for vecchia in vecchie:
+            da_eliminare.append(vecchia.id)
+            tolte_riepilogo.append((vecchia.cliente_id, vecchia.prodotto_id, vecchia.quantita, vecchia.prezzo_storico))
+
+    return da_inserire, da_aggiornare, da_eliminare, tolte_riepilogo, nuove_riepilogo
+
 @app.route('/api/salva_modifica_ordine', methods=['POST'])
 def salva_modifica_ordine():
+    """
+    Salva le modifiche a un ordine dello storico.
+    La pagina manda TUTTE le righe (ognuna col suo cliente, l'ordine è giornaliero e
+    multi-cliente): qui si scrivono solo quelle davvero cambiate (inserimenti,
+    aggiornamenti, eliminazioni) e il riepilogo vendite solo per quelle.
+    """
     try:
         data = request.json
         ordine_id = data.get('ordine_id')
-        nuove_righe = data.get('righe') # Lista di {prod_id, qta, prezzo}
+        # riga = {'cliente_id': 1, 'prod_id': 5, 'qta': 10, 'prezzo': 5.50}  (euro -> centesimi)
+        nuove_righe = [(int(r['cliente_id']), int(r['prod_id']), int(r['qta']), a_centesimi(r['prezzo']))
+                       for r in data.get('righe') or []]
 
         ordine = Ordine.query.get_or_404(ordine_id)
 
-        # 1. Cancelliamo TUTTI i vecchi dettagli di questo ordine
-        # (È il metodo più sicuro per gestire rimozioni e modifiche insieme)
-        DettaglioOrdine.query.filter_by(ordine_id=ordine_id).delete()
-
-        # 2. Inseriamo le nuove righe
-        # Nota: Dobbiamo recuperare il cliente_id per ogni riga.
-        # In questo modello semplificato, assumiamo che l'ordine abbia un cliente principale?
-        # ASPETTA: Nel tuo modello l'ordine è giornaliero e ogni riga ha il SUO cliente.
-        # QUINDI: Nella modifica dobbiamo sapere per ogni riga chi è il cliente.
-        # SE LA MODIFICA È "Togliere un prodotto a Mario", dobbiamo sapere che era di Mario.
-        
-        # FIX: Per semplificare la UI, assumo che tu stia modificando un ordine
-        # ma NON stiamo cambiando i clienti delle righe esistenti, solo qta e prezzo.
-        # PERÒ se aggiungi un prodotto nuovo, a chi lo assegniamo?
-        # SOLUZIONE: Nel template ti farò vedere anche il Cliente di ogni riga.
-        pass
-
-        # RIVEDIAMO LA LOGICA DI SALVATAGGIO PER IL TUO MODELLO (Ordine Giornaliero Multi-Cliente)
-        # Se modifichi una riga, devi rimandare al server anche il 'cliente_id'.
-        
-        for riga in nuove_righe:
-            # riga = {'cliente_id': 1, 'prod_id': 5, 'qta': 10, 'prezzo': 5.50}
-            nuovo_det = DettaglioOrdine(
-                ordine_id=ordine_id,
-                cliente_id=riga['cliente_id'],
-                prodotto_id=riga['prod_id'],
-                quantita=riga['qta'],
-                prezzo_storico=riga['prezzo']
+        esistenti = db.session.query(
+            DettaglioOrdine.id, DettaglioOrdine.cliente_id, DettaglioOrdine.prodotto_id,
+            DettaglioOrdine.quantita, DettaglioOrdine.prezzo_storico
+        ).filter_by(ordine_id=ordine.id).order_by(DettaglioOrdine.id).all()
+
+        da_inserire, da_aggiornare, da_eliminare, tolte_riepilogo, nuove_riepilogo = \
+            confronta_righe_ordine(esistenti, nuove_righe)
+
+        tabella = DettaglioOrdine.__table__
+        if da_eliminare:
+            db.session.execute(tabella.delete().where(tabella.c.id.in_(da_eliminare)))
+        if da_aggiornare:
+            db.session.execute(
+                tabella.update().where(tabella.c.id == bindparam('b_id'))
+                .values(quantita=bindparam('b_quantita'), prezzo_storico=bindparam('b_prezzo')),
+                [{'b_id': d_id, 'b_quantita': qta, 'b_prezzo': prezzo} for d_id, qta, prezzo in da_aggiornare]
             )
-            db.session.add(nuovo_det)
+        if da_inserire:
+            db.session.execute(tabella.insert(), [
+                {'ordine_id': ordine.id, 'cliente_id': c_id, 'prodotto_id': p_id, 'quantita': qta, 'prezzo_storico': prezzo}
+                for c_id, p_id, qta, prezzo in da_inserire
+            ])
+
+        # Riepilogo: si tolgono le versioni vecchie delle righe cambiate e si aggiungono le nuove
+        aggiorna_riepilogo_vendite(ordine, tolte_riepilogo, segno=-1)
+        aggiorna_riepilogo_vendite(ordine, nuove_riepilogo, segno=1)
+        ricalcola_ultimi_acquisti((r[0], r[1]) for r in tolte_riepilogo + nuove_riepilogo)
 
         # Aggiorniamo le note se modificate
         if 'note' in data:
             ordine.note = data['note']
 
         db.session.commit()
-        return jsonify({'success': True})
+        invalida_suggerimenti([r[0] for r in tolte_riepilogo] + [r[0] for r in nuove_riepilogo])
+        return jsonify({'success': True, 'inserite': len(da_inserire),
+                        'aggiornate': len(da_aggiornare), 'eliminate': len(da_eliminare)})
 
     except Exception as e:
         db.session.rollback()
@@ -974,13 +1643,24 @@ def elimina_ordine(ordine_id):
     try:
         ordine = Ordine.query.get_or_404(ordine_id)
         
-        # 1. Cancella prima tutti i dettagli (i prodotti dentro l'ordine)
+        # 1. Togliamo le righe dal riepilogo vendite e poi le cancelliamo
+        vecchie_righe = db.session.query(
+            DettaglioOrdine.cliente_id, DettaglioOrdine.prodotto_id,
+            DettaglioOrdine.quantita, DettaglioOrdine.prezzo_storico
+        ).filter_by(ordine_id=ordine.id).all()
+        aggiorna_riepilogo_vendite(ordine, vecchie_righe, segno=-1)
+
+        # 2. Cancella tutti i dettagli (i prodotti dentro l'ordine)
         DettaglioOrdine.query.filter_by(ordine_id=ordine.id).delete()
         
-        # 2. Cancella l'ordine principale
+        # 3. Cancella l'ordine principale
         db.session.delete(ordine)
+
+        # 4. "Chi ha comprato cosa": per queste coppie l'ultimo acquisto ora è un altro ordine (o nessuno)
+        ricalcola_ultimi_acquisti((r.cliente_id, r.prodotto_id) for r in vecchie_righe)
         
         db.session.commit()
+        invalida_suggerimenti(r.cliente_id for r in vecchie_righe)
         return jsonify({'success': True})
         
     except Exception as e:
@@ -988,35 +1668,150 @@ def elimina_ordine(ordine_id):
         app.logger.error(f"Errore eliminazione ordine {ordine_id}: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# ------------------------------------------------------------------------------
+# RIEPILOGO VENDITE PRECALCOLATO (Mese x Cliente x Prodotto)
+# ------------------------------------------------------------------------------
+
+def aggiorna_riepilogo_vendite(ordine, righe, segno=1):
+    """
+    Aggiorna il riepilogo in modo INCREMENTALE (nella stessa transazione dell'ordine).
+    righe: lista di tuple (cliente_id, prodotto_id, quantita, prezzo).
+    segno: +1 quando le righe entrano nell'ordine, -1 quando escono.
+    """
+    if ordine.stato == 'cancellato':
+        return
+
+    mese = ordine.data_consegna.strftime('%Y-%m')
+
+    # Sommiamo prima in memoria (lo stesso prodotto può comparire più volte)
+    delta = {}
+    for cliente_id, prodotto_id, quantita, prezzo in righe:
+        chiave = (int(cliente_id), int(prodotto_id))
+        qta = int(quantita) * segno
+        vecchio_qta, vecchio_fatt = delta.get(chiave, (0, 0))
+        delta[chiave] = (vecchio_qta + qta, vecchio_fatt + qta * (prezzo or 0))  # Centesimi interi
+
+    if not delta:
+        return
+
+    # Un solo statement (sempre uguale, compilato una volta) eseguito per tutte le
+    # combinazioni: un VALUES con migliaia di righe costerebbe più da compilare che da scrivere
+    stmt = sqlite_insert(RiepilogoVendite.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['mese', 'cliente_id', 'prodotto_id'],
+        set_={
+            'quantita': RiepilogoVendite.quantita + stmt.excluded.quantita,
+            'fatturato': RiepilogoVendite.fatturato + stmt.excluded.fatturato
+        }
+    )
+    db.session.execute(stmt, [
+        {'mese': mese, 'cliente_id': c_id, 'prodotto_id': p_id, 'quantita': qta, 'fatturato': fatt}
+        for (c_id, p_id), (qta, fatt) in delta.items()
+    ])
+
+    # Le combinazioni rimaste a zero (es. ordine eliminato) non devono comparire nei grafici
+    if segno < 0:
+        RiepilogoVendite.query.filter(
+            RiepilogoVendite.mese == mese,
+            RiepilogoVendite.quantita == 0,
+            RiepilogoVendite.fatturato == 0
+        ).delete(synchronize_session=False)
+
+def ricostruisci_riepilogo_vendite():
+    """Ricalcola da zero il riepilogo (e gli ultimi acquisti) partendo da tutte le righe di dettaglio."""
+    for sql in SQL_RICOSTRUZIONE_RIEPILOGO + SQL_RICOSTRUZIONE_ULTIMO_ACQUISTO:
+        db.session.execute(text(sql))
+    db.session.commit()
+
+@app.cli.command('ricostruisci-riepilogo')
+def comando_ricostruisci_riepilogo():
+    """Uso: flask --app app ricostruisci-riepilogo"""
+    aggiorna_schema_database()
+    ricostruisci_riepilogo_vendite()
+    print(f"Riepilogo vendite ricostruito: {RiepilogoVendite.query.count()} righe.")
+    print(f"Ultimi acquisti ricostruiti: {UltimoAcquisto.query.count()} righe.")
+
+# ------------------------------------------------------------------------------
+# ULTIMO ACQUISTO PER (PRODOTTO, CLIENTE) - "chi ha comprato cosa"
+# ------------------------------------------------------------------------------
+# Un ordine NUOVO è sempre il più recente a parità di data: basta un upsert.
+# Modifiche ed eliminazioni possono "scoprire" un ordine più vecchio: per quelle
+# coppie si ricalcola la riga dal dettaglio (poche righe per coppia, via indice).
+
+def aggiungi_ultimi_acquisti(ordine, righe):
+    """righe: lista di tuple (cliente_id, prodotto_id, quantita, prezzo) di un ordine appena creato."""
+    if ordine.stato == 'cancellato':
+        return
+
+    quantita = {}
+    for cliente_id, prodotto_id, qta, _prezzo in righe:
+        chiave = (int(cliente_id), int(prodotto_id))
+        quantita[chiave] = quantita.get(chiave, 0) + int(qta)
+    if not quantita:
+        return
+
+    stmt = sqlite_insert(UltimoAcquisto.__table__)
+    piu_recente = stmt.excluded.ultima_data >= UltimoAcquisto.ultima_data
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['prodotto_id', 'cliente_id'],
+        set_={
+            'ultima_quantita': case((piu_recente, stmt.excluded.ultima_quantita), else_=UltimoAcquisto.ultima_quantita),
+            'ultima_data': case((piu_recente, stmt.excluded.ultima_data), else_=UltimoAcquisto.ultima_data),
+            'quantita_totale': UltimoAcquisto.quantita_totale + stmt.excluded.quantita_totale,
+        }
+    )
+    db.session.execute(stmt, [
+        {'prodotto_id': p_id, 'cliente_id': c_id, 'ultima_data': ordine.data_consegna,
+         'ultima_quantita': qta, 'quantita_totale': qta}
+        for (c_id, p_id), qta in quantita.items()
+    ])
+
+def ricalcola_ultimi_acquisti(coppie):
+    """Ricalcola dal dettaglio le righe delle coppie (cliente_id, prodotto_id), nella transazione corrente."""
+    parametri = sorted({(int(c_id), int(p_id)) for c_id, p_id in coppie})
+    if not parametri:
+        return
+    db.session.flush() # Le modifiche al dettaglio devono essere già nel DB
+    connessione = db.session.connection()
+    for sql in SQL_RICOSTRUZIONE_ULTIMO_ACQUISTO_COPPIA:
+        connessione.exec_driver_sql(sql, parametri)
+
+def query_clienti_dormienti():
+    # Ultima data d'ordine per ogni cliente attivo (None = mai ordinato)
+    return db.session.query(
+        Cliente.nome,
+        Cliente.id,
+        func.max(Ordine.data_consegna).label('ultima_data')
+    ).outerjoin(DettaglioOrdine, Cliente.id == DettaglioOrdine.cliente_id)\
+     .outerjoin(Ordine, DettaglioOrdine.ordine_id == Ordine.id)\
+     .filter(Cliente.attivo == True)\
+     .group_by(Cliente.id)
+
 @app.route('/api/statistiche')
 def api_statistiche():
     try:
+        # Top e andamento leggono SOLO dal riepilogo precalcolato
         top_prodotti = db.session.query(
             Prodotto.nome,
-            func.sum(DettaglioOrdine.quantita).label('totale')
-        ).join(DettaglioOrdine).group_by(Prodotto.id).order_by(desc('totale')).limit(5).all()
+            func.sum(RiepilogoVendite.quantita).label('totale')
+        ).join(RiepilogoVendite, RiepilogoVendite.prodotto_id == Prodotto.id)\
+         .group_by(Prodotto.id).order_by(desc('totale')).limit(5).all()
 
         top_clienti = db.session.query(
             Cliente.nome,
-            func.sum(DettaglioOrdine.quantita).label('totale')
-        ).join(DettaglioOrdine).group_by(Cliente.id).order_by(desc('totale')).limit(5).all()
+            func.sum(RiepilogoVendite.quantita).label('totale')
+        ).join(RiepilogoVendite, RiepilogoVendite.cliente_id == Cliente.id)\
+         .group_by(Cliente.id).order_by(desc('totale')).limit(5).all()
 
         vendite_mensili = db.session.query(
-            func.strftime('%Y-%m', Ordine.data_consegna).label('mese'),
-            func.sum(DettaglioOrdine.quantita).label('totale')
-        ).join(DettaglioOrdine).group_by('mese').order_by('mese').all()
+            RiepilogoVendite.mese,
+            func.sum(RiepilogoVendite.quantita).label('totale')
+        ).group_by(RiepilogoVendite.mese).order_by(RiepilogoVendite.mese).all()
 
         oggi = datetime.now().date()
         soglia_dormienti = oggi - timedelta(days=30)
 
-        query_dormienti = db.session.query(
-            Cliente.nome,
-            Cliente.id,
-            func.max(Ordine.data_consegna).label('ultima_data')
-        ).outerjoin(DettaglioOrdine, Cliente.id == DettaglioOrdine.cliente_id)\
-         .outerjoin(Ordine, DettaglioOrdine.ordine_id == Ordine.id)\
-         .filter(Cliente.attivo == True)\
-         .group_by(Cliente.id).all()
+        query_dormienti = query_clienti_dormienti().all()
 
         lista_dormienti = []
         for c_nome, c_id, ultima_data in query_dormienti:
@@ -1044,13 +1839,12 @@ def statistiche_economiche():
     try:
         # 1. FATTURATO STORICO COMPLETO MENSILE (Tutti gli anni)
         # Raggruppiamo per "Anno-Mese" (es. "2025-11", "2025-12", "2026-01")
+        # (Il riepilogo esclude già gli ordini con stato 'cancellato')
         fatturato_storico = db.session.query(
-            func.strftime('%Y-%m', Ordine.data_consegna).label('anno_mese'),
-            func.sum(DettaglioOrdine.quantita * DettaglioOrdine.prezzo_storico).label('totale')
-        ).join(Ordine)\
-         .filter(Ordine.stato != 'cancellato')\
-         .group_by('anno_mese')\
-         .order_by('anno_mese')\
+            RiepilogoVendite.mese.label('anno_mese'),
+            func.sum(RiepilogoVendite.fatturato).label('totale')
+        ).group_by(RiepilogoVendite.mese)\
+         .order_by(RiepilogoVendite.mese)\
          .all()
 
         # Prepariamo due liste dinamiche: Labels (Assi X) e Valori (Assi Y)
@@ -1064,15 +1858,13 @@ def statistiche_economiche():
             label_leggibile = f"{parti[1]}/{parti[0]}"
             
             mesi_labels.append(label_leggibile)
-            mesi_values.append(r.totale)
+            mesi_values.append(in_euro(r.totale))
 
         # 2. TOP 10 CLIENTI PER FATTURATO
         top_clienti = db.session.query(
             Cliente.nome,
-            func.sum(DettaglioOrdine.quantita * DettaglioOrdine.prezzo_storico).label('totale')
-        ).join(DettaglioOrdine, DettaglioOrdine.cliente_id == Cliente.id)\
-         .join(Ordine, DettaglioOrdine.ordine_id == Ordine.id)\
-         .filter(Ordine.stato != 'cancellato')\
+            func.sum(RiepilogoVendite.fatturato).label('totale')
+        ).join(RiepilogoVendite, RiepilogoVendite.cliente_id == Cliente.id)\
          .group_by(Cliente.id)\
          .order_by(desc('totale'))\
          .limit(10)\
@@ -1081,10 +1873,8 @@ def statistiche_economiche():
         # 3. TOP 10 PRODOTTI PER FATTURATO
         top_prodotti = db.session.query(
             Prodotto.nome,
-            func.sum(DettaglioOrdine.quantita * DettaglioOrdine.prezzo_storico).label('totale')
-        ).join(DettaglioOrdine, DettaglioOrdine.prodotto_id == Prodotto.id)\
-         .join(Ordine, DettaglioOrdine.ordine_id == Ordine.id)\
-         .filter(Ordine.stato != 'cancellato')\
+            func.sum(RiepilogoVendite.fatturato).label('totale')
+        ).join(RiepilogoVendite, RiepilogoVendite.prodotto_id == Prodotto.id)\
          .group_by(Prodotto.id)\
          .order_by(desc('totale'))\
          .limit(10)\
@@ -1095,11 +1885,11 @@ def statistiche_economiche():
             'mesi_values': mesi_values,   # <--- Nuova lista valori
             'top_clienti': {
                 'labels': [r.nome for r in top_clienti], 
-                'values': [r.totale for r in top_clienti]
+                'values': [in_euro(r.totale) for r in top_clienti]
             },
             'top_prodotti': {
                 'labels': [r.nome for r in top_prodotti], 
-                'values': [r.totale for r in top_prodotti]
+                'values': [in_euro(r.totale) for r in top_prodotti]
             }
         })
 
@@ -1107,207 +1897,107 @@ def statistiche_economiche():
         app.logger.error(f"Errore Statistiche Economiche: {e}")
         return jsonify({'error': str(e)}), 500
 
+# ------------------------------------------------------------------------------
+# FATTURATO RIPREZZATO CON UN LISTINO (storia prezzi in prezzo_listino)
+# ------------------------------------------------------------------------------
+# "Quanto avrei incassato se avessi venduto ai prezzi del listino X?"
+# Una sola query: ogni riga del periodo si unisce alla versione di listino in
+# vigore alla data scelta (o, senza data, a quella in vigore il giorno dell'ordine).
+#   /api/statistiche/listino?dal=2025-01-01&al=2025-12-31&listino=2026-01-15
+
+SQL_FATTURATO_A_LISTINO = """
+    SELECT strftime('%Y-%m', o.data_consegna) AS mese,
+           SUM(d.quantita * COALESCE(d.prezzo_storico, 0)) AS fatturato,
+           SUM(d.quantita * COALESCE(pl.prezzo, 0)) AS a_listino
+    FROM dettaglio_ordine d
+    JOIN ordine o ON o.id = d.ordine_id
+    LEFT JOIN prezzo_listino pl ON pl.prodotto_id = d.prodotto_id
+         AND pl.valido_dal <= COALESCE(:listino, o.data_consegna)
+         AND (pl.valido_al IS NULL OR pl.valido_al > COALESCE(:listino, o.data_consegna))
+    WHERE COALESCE(o.stato, '') != 'cancellato' AND o.data_consegna BETWEEN :dal AND :al
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+def query_fatturato_a_listino(dal, al, listino=None):
+    """Per mese: fatturato reale (prezzi delle righe) e fatturato ai prezzi del listino. Date 'YYYY-MM-DD'."""
+    return db.session.execute(text(SQL_FATTURATO_A_LISTINO), {'dal': dal, 'al': al, 'listino': listino}).all()
+
+@app.route('/api/statistiche/listino')
+def api_fatturato_a_listino():
+    try:
+        date_richieste = {}
+        for nome, predefinita in [('dal', '2000-01-01'), ('al', '9999-12-31'), ('listino', None)]:
+            valore = request.args.get(nome) or predefinita
+            if valore is not None:
+                try:
+                    datetime.strptime(valore, '%Y-%m-%d')
+                except ValueError:
+                    return jsonify({'status': 'KO', 'errore': f"Data '{nome}' non valida (formato AAAA-MM-GG)"}), 400
+            date_richieste[nome] = valore
+
+        # Importi in centesimi: totali sommati interi, convertiti in euro solo nel JSON
+        righe = query_fatturato_a_listino(**date_richieste)
+        mesi = [{
+            'mese': r.mese,
+            'fatturato': in_euro(r.fatturato),
+            'a_listino': in_euro(r.a_listino),
+            'differenza': in_euro((r.a_listino or 0) - (r.fatturato or 0))
+        } for r in righe]
+
+        return jsonify({
+            'status': 'OK',
+            'listino': date_richieste['listino'] or 'in vigore alla data di ogni ordine',
+            'mesi': mesi,
+            'totale_fatturato': in_euro(sum(r.fatturato or 0 for r in righe)),
+            'totale_a_listino': in_euro(sum(r.a_listino or 0 for r in righe))
+        })
+    except Exception as e:
+        app.logger.error(f"Errore API FATTURATO A LISTINO: {e}")
+        return jsonify({'status': 'KO', 'errore': str(e)}), 500
+
 # ==============================================================================
 # 10. SCARICA FOGLIO EXCEL DA DETTAGLI ORDINE PASSATI
 # ==============================================================================
 
+def matrice_da_dettagli(dettagli):
+    """Matrice Prodotti x Clienti (come nel PDF) a partire dalle righe salvate nel DB."""
+    clienti_header = {}
+    prodotti_header = {}
+    for d in dettagli:
+        if d.cliente_id not in clienti_header:
+            clienti_header[d.cliente_id] = {
+                'nome': d.cliente.nome if d.cliente else "Cancellato",
+                'codice': d.cliente.codice if d.cliente else "N/D"
+            }
+        if d.prodotto_id not in prodotti_header:
+            prodotti_header[d.prodotto_id] = {
+                'nome': d.prodotto.nome if d.prodotto else "Cancellato",
+                'codice': d.prodotto.codice if d.prodotto else "N/D"
+            }
+
+    return costruisci_matrice(
+        [d.cliente_id for d in dettagli],
+        [d.prodotto_id for d in dettagli],
+        [d.quantita for d in dettagli],
+        clienti_header,
+        prodotti_header
+    )
+
 @app.route('/scarica_ordine_excel/<int:ordine_id>')
 def scarica_ordine_excel(ordine_id):
     try:
         # 1. Recuperiamo i dati
-        ordine = Ordine.query.get_or_404(ordine_id)
-        dettagli = DettaglioOrdine.query.filter_by(ordine_id=ordine_id).all()
-
-        # 2. Trasformazione Dati (Identica al PDF)
-        clienti_header = {} 
-        prodotti_matrix = {} 
-        totali_per_cliente = {} 
-
-        for d in dettagli:
-            c_id = str(d.cliente_id)
-            p_id = str(d.prodotto_id)
-            qta = d.quantita
-            
-            # Info Cliente
-            cli = Cliente.query.get(d.cliente_id)
-            c_nome = cli.nome if cli else "Cancellato"
-            c_cod = cli.codice if cli else "N/D"
-
-            if c_id not in clienti_header:
-                clienti_header[c_id] = {'nome': c_nome, 'codice': c_cod}
-                totali_per_cliente[c_id] = 0
-            
-            totali_per_cliente[c_id] += qta
-
-            # Info Prodotto
-            prod = Prodotto.query.get(d.prodotto_id)
-            p_nome = prod.nome if prod else "Cancellato"
-            p_cod = prod.codice if prod else "N/D"
-
-            if p_id not in prodotti_matrix:
-                prodotti_matrix[p_id] = {
-                    'nome': p_nome,
-                    'codice': p_cod,
-                    'qta_clienti': {}
-                }
-            prodotti_matrix[p_id]['qta_clienti'][c_id] = qta
-
-        # Ordinamento Clienti e Prodotti
-        clienti_ordinati = sorted(clienti_header.items(), key=lambda x: x[1]['nome'])
-        ids_clienti_ordinati = [x[0] for x in clienti_ordinati]
-        
-        prodotti_ordinati = sorted(prodotti_matrix.items(), key=lambda x: x[1]['nome'])
-
-        # 3. CREAZIONE EXCEL (OpenPyXL)
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Riepilogo Ordine"
-
-        # --- STILI ---
-        bold_font = Font(bold=True)
-        center_align = Alignment(horizontal='center', vertical='center')
-        left_align = Alignment(horizontal='left', vertical='center')
-        right_align = Alignment(horizontal='right', vertical='center')
-        thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-        thick_border = Border(left=Side(style='medium'), right=Side(style='medium'), top=Side(style='medium'), bottom=Side(style='medium'))
-
-        # --- INTESTAZIONE DOCUMENTO ---
-        ws['A1'] = "Agente 15 ALOISI GIANCARLO"
-        ws['A1'].font = Font(bold=True, size=14)
-        
-        data_str = ordine.data_consegna.strftime('%d/%m/%Y')
-        ws['A3'] = f"Riepilogo del {data_str}"
-        ws['A3'].font = Font(bold=True)
-        ws['A4'] = f"Numero ordini: {len(clienti_header)}"
-        ws['A4'].font = Font(bold=True)
-
-        row_idx = 6 # Iniziamo a disegnare la tabella dalla riga 6
-
-        # --- INTESTAZIONE TABELLA (RIGA 1: Codici Cliente) ---
-        # Col A: Cod. Prod, Col B: Nome Prod
-        ws.cell(row=row_idx, column=2).value = "Cod. Cliente"
-        ws.cell(row=row_idx, column=2).font = bold_font
-        ws.cell(row=row_idx, column=2).alignment = center_align
-        ws.cell(row=row_idx, column=2).border = thin_border
-
-        col_idx = 3 # I clienti partono dalla colonna C (3)
-        for c_id, dati_c in clienti_ordinati:
-            c = ws.cell(row=row_idx, column=col_idx, value=dati_c['codice'])
-            c.font = bold_font
-            c.alignment = center_align
-            c.border = thin_border
-            col_idx += 1
-        
-        # Colonna TOTALE (in alto a destra)
-        c_tot_h = ws.cell(row=row_idx, column=col_idx, value="TOT")
-        c_tot_h.font = bold_font
-        c_tot_h.alignment = center_align
-        c_tot_h.border = thin_border
-        
-        row_idx += 1
-
-        # --- INTESTAZIONE TABELLA (RIGA 2: Nomi) ---
-        ws.cell(row=row_idx, column=1, value="Cod. Prod.").font = bold_font
-        ws.cell(row=row_idx, column=1).border = thin_border
-        ws.cell(row=row_idx, column=1).alignment = center_align
-
-        ws.cell(row=row_idx, column=2, value="Nome Prodotto").font = bold_font
-        ws.cell(row=row_idx, column=2).border = thin_border
-        ws.cell(row=row_idx, column=2).alignment = center_align
-        
-        col_idx = 3
-        for c_id, dati_c in clienti_ordinati:
-            c = ws.cell(row=row_idx, column=col_idx, value=dati_c['nome'])
-            c.alignment = center_align
-            c.border = thin_border
-            c.font = bold_font
-            col_idx += 1
-        
-        # Cella vuota sotto TOT
-        ws.cell(row=row_idx, column=col_idx).border = thin_border
-        
-        row_idx += 1
-
-        # --- CORPO TABELLA ---
-        totale_globale = 0
+        ordine = carica_ordine_completo(ordine_id)
 
-        for p_id, dati in prodotti_ordinati:
-            # Codice Prodotto
-            c1 = ws.cell(row=row_idx, column=1, value=dati['codice'])
-            c1.font = bold_font
-            c1.alignment = center_align
-            c1.border = thin_border
+        # 2. Trasformazione Dati (Stessa matrice del PDF)
+        matrice = matrice_da_dettagli(ordine.righe)
 
-            # Nome Prodotto
-            c2 = ws.cell(row=row_idx, column=2, value=dati['nome'])
-            #c2.font = bold_font
-            c2.border = thin_border
-
-            totale_riga = 0
-            col_idx = 3
-            
-            for c_id in ids_clienti_ordinati:
-                qta = dati['qta_clienti'].get(c_id, 0)
-                valore_cella = qta if qta > 0 else "-"
-                
-                c = ws.cell(row=row_idx, column=col_idx, value=valore_cella)
-                c.alignment = center_align
-                c.border = thin_border
-                if qta > 0:
-                    c.font = bold_font
-                    totale_riga += qta
-                
-                col_idx += 1
-            
-            # Totale Riga
-            c_tot = ws.cell(row=row_idx, column=col_idx, value=totale_riga)
-            c_tot.font = bold_font
-            c_tot.alignment = center_align
-            c_tot.border = thin_border
-            
-            totale_globale += totale_riga
-            row_idx += 1
+        # 3. CREAZIONE EXCEL (OpenPyXL in sola scrittura, vedi excel_ordini.py)
+        wb = crea_workbook()
+        scrivi_foglio_ordine(wb, "Riepilogo Ordine", ordine.data_consegna.strftime('%d/%m/%Y'), matrice, ordine.note)
 
-        # --- RIGA TOTALI FINALI ---
-        ws.cell(row=row_idx, column=1).border = thin_border # Vuoto sotto codice
-        
-        c_label_tot = ws.cell(row=row_idx, column=2, value="TOTALI")
-        c_label_tot.font = bold_font
-        c_label_tot.alignment = center_align
-        c_label_tot.border = thin_border
-
-        col_idx = 3
-        for c_id in ids_clienti_ordinati:
-            somma = totali_per_cliente.get(c_id, 0)
-            c = ws.cell(row=row_idx, column=col_idx, value=somma)
-            c.font = bold_font
-            c.alignment = center_align
-            c.border = thin_border
-            col_idx += 1
-        
-        c_grand_tot = ws.cell(row=row_idx, column=col_idx, value=totale_globale)
-        c_grand_tot.font = bold_font
-        c_grand_tot.alignment = center_align
-        c_grand_tot.border = thin_border
-
-        # --- NOTE ---
-        if ordine.note:
-            row_idx += 2
-            ws.cell(row=row_idx, column=1, value=f"Note Aggiuntive: {ordine.note}")
-            #ws.cell(row=row_idx, column=1).font = Font(italic=True)
-
-        # --- FORMATTAZIONE LARGHEZZE COLONNE ---
-        ws.column_dimensions['A'].width = 10
-        ws.column_dimensions['B'].width = 40
-        for i in range(3, col_idx + 1):
-            ws.column_dimensions[get_column_letter(i)].width = 12
-
-        # 4. Salvataggio in Memoria
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
-        
-        # 5. SALVATAGGIO SU DISCO
+        # 4. SALVATAGGIO SU DISCO
         cartella_excel = os.path.join(app.root_path, 'ARCHIVIO_EXCEL')
         if not os.path.exists(cartella_excel):
             os.makedirs(cartella_excel)
@@ -1321,7 +2011,7 @@ def scarica_ordine_excel(ordine_id):
         nome_file = f"ordini_{data_str}_orario_{orario_str}.xlsx"
         
         path_completo = os.path.join(cartella_excel, nome_file)
-        wb.save(path_completo) # Salva fisicamente nel progetto
+        wb.save(path_completo) # Salva fisicamente nel progetto (un workbook write-only si salva UNA volta sola)
 
         # Rispondiamo con un JSON per dire "Tutto ok"
         return jsonify({"status": "OK", "path": path_completo, "filename": nome_file})
@@ -1330,10 +2020,184 @@ def scarica_ordine_excel(ordine_id):
         app.logger.error(f"Errore creazione Excel: {e}")
         return jsonify({"status": "KO", "errore": str(e)}), 500
 
+@app.route('/scarica_excel_periodo')
+def scarica_excel_periodo():
+    """
+    Excel unico con un foglio per ogni giorno di consegna (per la quadratura di fine mese con la sede).
+    Parametri: da / a in formato YYYY-MM-DD, oppure 'periodo' scritto come nel filtro
+    del Registro Ordini (es. '12/2025' = tutto il mese, '2025' = tutto l'anno).
+    """
+    try:
+        periodo = request.args.get('periodo', '').strip()
+        if periodo:
+            intervallo = intervallo_da_testo_data(periodo)
+            if not intervallo:
+                return jsonify({"status": "KO", "errore": "Periodo non valido (es. 12/2025 oppure 2025)"}), 400
+            data_da, data_a = intervallo
+        else:
+            try:
+                data_da = datetime.strptime(request.args.get('da', ''), '%Y-%m-%d').date()
+                data_a = datetime.strptime(request.args.get('a', ''), '%Y-%m-%d').date()
+            except ValueError:
+                return jsonify({"status": "KO", "errore": "Date non valide (formato atteso YYYY-MM-DD)"}), 400
+
+        if data_da > data_a:
+            return jsonify({"status": "KO", "errore": "La data iniziale è successiva a quella finale"}), 400
+
+        # Tutti gli ordini del periodo con righe, clienti e prodotti (poche query, nessun N+1)
+        ordini = Ordine.query.options(
+            selectinload(Ordine.righe).options(
+                joinedload(DettaglioOrdine.cliente),
+                joinedload(DettaglioOrdine.prodotto)
+            )
+        ).filter(
+            Ordine.data_consegna.between(data_da, data_a),
+            func.coalesce(Ordine.stato, '') != 'cancellato'
+        ).order_by(Ordine.data_consegna, Ordine.ora_creazione, Ordine.id).all()
+
+        if not ordini:
+            return jsonify({"status": "KO", "errore": "Nessun ordine nel periodo selezionato"}), 404
+
+        # Raggruppiamo per giorno di consegna (gli ordini arrivano già ordinati per data)
+        giorni = OrderedDict()
+        for o in ordini:
+            giorni.setdefault(o.data_consegna, []).append(o)
+
+        wb = crea_workbook()
+        for giorno, ordini_giorno in giorni.items():
+            righe = [d for o in ordini_giorno for d in o.righe]
+            if not righe:
+                continue
+            note = " | ".join(o.note for o in ordini_giorno if o.note)
+            scrivi_foglio_ordine(wb, giorno.strftime('%d-%m-%Y'), giorno.strftime('%d/%m/%Y'), matrice_da_dettagli(righe), note)
+
+        if not wb.worksheets:
+            return jsonify({"status": "KO", "errore": "Nessuna riga d'ordine nel periodo selezionato"}), 404
+
+        # Il workbook write-only scrive le righe su file temporaneo mentre le aggiungiamo:
+        # salviamo su un altro file temporaneo e lo spediamo a pezzi (niente copia intera in RAM)
+        file_excel = tempfile.TemporaryFile()
+        wb.save(file_excel)
+        file_excel.seek(0)
+
+        nome_file = f"ordini_dal_{data_da.strftime('%d-%m-%Y')}_al_{data_a.strftime('%d-%m-%Y')}.xlsx"
+        return send_file(
+            file_excel,
+            as_attachment=True,
+            download_name=nome_file,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+
+    except Exception as e:
+        app.logger.error(f"Errore Excel periodo: {e}")
+        return jsonify({"status": "KO", "errore": str(e)}), 500
+
 # ==============================================================================
-# 11. AVVIO E FINE FILE
+# 11. MIGRAZIONI E COMANDI DI CONTROLLO
 # ==============================================================================
-if __name__ == '__main__':
+
+def aggiorna_schema_database():
+    """Crea le tabelle mancanti e applica le migrazioni (indici, ecc.) al DB esistente."""
+    db.create_all()
+    conn = db.engine.raw_connection()
+    try:
+        applicate = applica_migrazioni(conn.driver_connection)
+    finally:
+        conn.close()
+    for numero, descrizione in applicate:
+        print(f"--- MIGRAZIONE {numero} APPLICATA: {descrizione} ---")
+    return applicate
+
+@app.cli.command('migra')
+def comando_migra():
+    """Uso: flask --app app migra"""
+    applicate = aggiorna_schema_database()
+    if not applicate:
+        print("Il database è già aggiornato.")
+    with db.engine.connect() as conn:
+        print(f"Versione database: {versione_database(conn.connection.driver_connection)}")
+
+# Comandi di controllo (verifica-indici, benchmark-ordine, benchmark-storico, verifica-query): stanno in verifiche.py
+registra_verifiche(app)
+
+# ==============================================================================
+# 12. AVVIO E FINE FILE
+# ==============================================================================
+# py app.py                          -> server di produzione (waitress, più richieste insieme)
+# py app.py --threads 8 --porta 5000 -> idem, scegliendo thread e porta
+# flask --app app serve              -> idem, dal comando flask
+# py app.py --debug                  -> server di sviluppo Flask (debugger, ricarica il codice)
+
+_app_pronta = False
+
+def crea_app():
+    """
+    Prepara l'app per servire le richieste (una volta sola) e la restituisce:
+    migrazioni, riepilogo vendite, suggerimenti in memoria (le impostazioni SQLite
+    si applicano già a ogni connessione, vedi sopra db.init_app).
+    Le rotte restano definite qui sopra: questa è la funzione da dare al server WSGI.
+    """
+    global _app_pronta
+    if _app_pronta:
+        return app
     with app.app_context():
-        db.create_all()
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+        aggiorna_schema_database()
+        # Primo avvio dopo l'aggiornamento: il riepilogo è vuoto ma gli ordini ci sono
+        if not RiepilogoVendite.query.first() and DettaglioOrdine.query.first():
+            ricostruisci_riepilogo_vendite()
+        # Suggerimenti prodotti di tutti i clienti già pronti in memoria
+        carica_tutti_suggerimenti()
+    _app_pronta = True
+    return app
+
+def avvia_server(host='0.0.0.0', porta=5000, threads=8):
+    """Server di produzione waitress (solo Python, multi-thread). Torna quando si spegne."""
+    global funzione_spegnimento
+    from waitress import create_server
+
+    crea_app()
+    server = create_server(app, host=host, port=porta, threads=threads)
+
+    # /spegni chiude il server: run() qui sotto torna e si chiude il resto
+    funzione_spegnimento = server.close
+
+    # Email rimaste in coda dall'ultima volta: le invia subito il postino
+    avvia_postino(app)
+    print(f"--- GESTIONALE IN ASCOLTO SU http://{host}:{porta} ({threads} thread) ---")
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        ferma_postino()
+        with app.app_context():
+            db.engine.dispose()
+        print("--- SERVER FERMATO ---")
+
+@app.cli.command('serve')
+@click.option('--host', default='0.0.0.0', show_default=True)
+@click.option('--porta', default=5000, show_default=True)
+@click.option('--threads', default=8, show_default=True, help="Richieste servite in parallelo")
+def comando_serve(host, porta, threads):
+    """Uso: flask --app app serve --threads 8"""
+    avvia_server(host, porta, threads)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Avvia il gestionale.")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--porta', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=8, help="Richieste servite in parallelo (default: 8)")
+    parser.add_argument('--debug', action='store_true', help="Server di sviluppo Flask con debugger e ricarica del codice")
+    argomenti = parser.parse_args()
+
+    if not argomenti.debug:
+        avvia_server(argomenti.host, argomenti.porta, argomenti.threads)
+    else:
+        crea_app()
+        # Con debug=True questo blocco gira anche nel processo che ricarica il codice:
+        # il postino va avviato solo nel processo che risponde davvero alle richieste
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            avvia_postino(app)
+        app.run(debug=True, host=argomenti.host, port=argomenti.porta)
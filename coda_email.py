@@ -0,0 +1,178 @@
+import smtplib
+import threading
+from datetime import datetime, timedelta
+
+# Importazioni per la gestione delle Email (MIME)
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.base import MIMEBase
+from email import encoders
+
+from models import db, EmailInUscita
+
+# ==============================================================================
+# CODA EMAIL (OUTBOX) CON INVIO IN BACKGROUND
+# ==============================================================================
+# La rotta che conferma l'ordine NON parla più con il server di posta:
+# salva l'email nella tabella 'email_in_uscita' e torna subito alla pagina.
+# Un thread "postino" legge la coda, invia usando UNA sola connessione SMTP
+# per più messaggi consecutivi e, se qualcosa va storto, riprova più tardi
+# aspettando ogni volta il doppio (30s, 1m, 2m, 4m...).
+
+MAX_TENTATIVI = 8
+ATTESA_BASE_SECONDI = 30
+ATTESA_MASSIMA_SECONDI = 3600
+
+def accoda_email(destinatario, oggetto, corpo="", nome_allegato=None, allegato=None):
+    """
+    Aggiunge un'email alla coda (nella sessione corrente: la salva il commit del chiamante).
+    allegato: contenuto del file in bytes.
+    """
+    adesso = datetime.now()
+    email = EmailInUscita(
+        destinatario=destinatario,
+        oggetto=oggetto,
+        corpo=corpo,
+        nome_allegato=nome_allegato,
+        allegato=allegato,
+        stato='in_attesa',
+        tentativi=0,
+        prossimo_tentativo=adesso,
+        creata_il=adesso
+    )
+    db.session.add(email)
+    return email
+
+def costruisci_messaggio(email, mittente):
+    msg = MIMEMultipart()
+    msg['From'] = mittente
+    msg['To'] = email.destinatario
+    msg['Subject'] = email.oggetto
+    msg.attach(MIMEText(email.corpo or "", 'plain'))
+
+    if email.allegato:
+        part = MIMEBase("application", "octet-stream")
+        part.set_payload(email.allegato)
+        encoders.encode_base64(part)
+        part.add_header("Content-Disposition", f"attachment; filename= {email.nome_allegato}")
+        msg.attach(part)
+
+    return msg
+
+def attesa_prima_di_riprovare(tentativi):
+    """Backoff esponenziale: 30s, 60s, 120s... fino a un massimo di 1 ora."""
+    return timedelta(seconds=min(ATTESA_BASE_SECONDI * (2 ** (tentativi - 1)), ATTESA_MASSIMA_SECONDI))
+
+class PostinoEmail(threading.Thread):
+    """Thread che svuota la coda delle email. Uno solo per processo (vedi avvia_postino)."""
+
+    def __init__(self, app):
+        super().__init__(name="PostinoEmail", daemon=True)
+        self.app = app
+        self.sveglia = threading.Event()
+        self.fermati = threading.Event()
+        self.server = None
+
+    # --- CONNESSIONE SMTP (riutilizzata tra messaggi consecutivi) ---
+
+    def connetti(self):
+        if self.server is not None:
+            return self.server
+
+        config = self.app.config
+        if config.get('SMTP_SSL', True):
+            server = smtplib.SMTP_SSL(config['SMTP_HOST'], config['SMTP_PORT'], timeout=30)
+        else:
+            server = smtplib.SMTP(config['SMTP_HOST'], config['SMTP_PORT'], timeout=30)
+        if config.get('EMAIL_PASSWORD'):
+            server.login(config['EMAIL_MITTENTE'], config['EMAIL_PASSWORD'])
+        self.server = server
+        return server
+
+    def disconnetti(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            pass
+        self.server = None
+
+    # --- CICLO PRINCIPALE ---
+
+    def run(self):
+        while not self.fermati.is_set():
+            try:
+                with self.app.app_context():
+                    attesa = self.svuota_coda()
+            except Exception as e:
+                self.app.logger.error(f"Errore POSTINO EMAIL: {e}")
+                attesa = ATTESA_BASE_SECONDI
+
+            # Coda vuota (o solo email da riprovare più tardi): chiudiamo la connessione e dormiamo
+            self.disconnetti()
+            self.sveglia.wait(timeout=attesa)
+            self.sveglia.clear()
+
+    def svuota_coda(self):
+        """Invia tutte le email pronte. Restituisce quanti secondi aspettare prima del prossimo giro."""
+        while not self.fermati.is_set():
+            adesso = datetime.now()
+            email = EmailInUscita.query.filter(
+                EmailInUscita.stato == 'in_attesa',
+                EmailInUscita.prossimo_tentativo <= adesso
+            ).order_by(EmailInUscita.id).first()
+
+            if email is None:
+                break
+
+            try:
+                server = self.connetti()
+                server.send_message(costruisci_messaggio(email, self.app.config['EMAIL_MITTENTE']))
+                email.stato = 'inviata'
+                email.inviata_il = datetime.now()
+                email.allegato = None # Il PDF resta comunque in ARCHIVIO_PDF
+                email.ultimo_errore = None
+                print(f"--- EMAIL INVIATA: {email.oggetto} ---")
+            except Exception as e:
+                # Connessione probabilmente rovinata: la prossima email ne aprirà una nuova
+                self.disconnetti()
+                email.tentativi += 1
+                email.ultimo_errore = str(e)
+                if email.tentativi >= MAX_TENTATIVI:
+                    email.stato = 'fallita'
+                    self.app.logger.error(f"EMAIL NON INVIATA dopo {email.tentativi} tentativi ({email.oggetto}): {e}")
+                else:
+                    email.prossimo_tentativo = datetime.now() + attesa_prima_di_riprovare(email.tentativi)
+                    print(f"ERRORE INVIO EMAIL (tentativo {email.tentativi}): {e}")
+
+            db.session.commit()
+
+        # Quanto manca alla prossima email da riprovare?
+        prossima = db.session.query(db.func.min(EmailInUscita.prossimo_tentativo))\
+            .filter(EmailInUscita.stato == 'in_attesa').scalar()
+        db.session.remove()
+        if prossima is None:
+            return None # Nessuna email in coda: dormiamo finché qualcuno ci sveglia
+        return max((prossima - datetime.now()).total_seconds(), 0)
+
+    def ferma(self):
+        self.fermati.set()
+        self.sveglia.set()
+
+_postino = None
+_lock_postino = threading.Lock()
+
+def avvia_postino(app):
+    """Avvia il thread postino (una volta sola) e lo sveglia se stava dormendo."""
+    global _postino
+    with _lock_postino:
+        if _postino is None or not _postino.is_alive():
+            _postino = PostinoEmail(app)
+            _postino.start()
+        _postino.sveglia.set()
+    return _postino
+
+def ferma_postino():
+    if _postino is not None:
+        _postino.ferma()
@@ -0,0 +1,165 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+# ==============================================================================
+# IMPOSTAZIONI COMUNI DELLE CONNESSIONI SQLITE
+# ==============================================================================
+# L'app (tramite SQLAlchemy) e gli script di importazione aprono lo stesso file.
+# Con le impostazioni di default di SQLite (journal "rollback") chi legge blocca
+# chi scrive e viceversa: la pagina statistiche ferma il salvataggio di un ordine.
+# Qui l'elenco UNICO delle impostazioni, applicato a ogni connessione aperta:
+#   journal_mode WAL    -> letture e scrittura vanno avanti insieme
+#   synchronous NORMAL  -> con WAL è sicuro e fa molti meno fsync
+#   busy_timeout        -> se il DB è occupato si aspetta invece di "database is locked"
+#   mmap_size           -> il file viene letto mappato in memoria (meno copie)
+#   cache_size          -> cache delle pagine più grande (il default è 2 MB)
+#
+# Uso:
+#   conn = apri_connessione(db_path)                      (script)
+#   event.listen(db.engine, 'connect', imposta_connessione) (app)
+#
+# Benchmark:  py connessione_db.py --benchmark
+
+PRAGMA_CONNESSIONE = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",  # 256 MB
+    "PRAGMA cache_size = -32000",     # 32 MB (negativo = in KB)
+]
+
+# In più per gli import (una connessione sola, tante righe): cache da 64 MB
+PRAGMA_IMPORT = PRAGMA_CONNESSIONE + [
+    "PRAGMA cache_size = -64000",
+]
+
+def imposta_connessione(conn_dbapi, _record=None, pragma=PRAGMA_CONNESSIONE):
+    """Applica le impostazioni a una connessione sqlite3 (firma valida anche per event.listen)."""
+    cursor = conn_dbapi.cursor()
+    for istruzione in pragma:
+        cursor.execute(istruzione)
+    cursor.close()
+
+def apri_connessione(db_path, pragma=PRAGMA_CONNESSIONE):
+    """
+    Connessione sqlite3 in autocommit (le transazioni si aprono con BEGIN/COMMIT)
+    con le impostazioni comuni già applicate.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    imposta_connessione(conn, pragma=pragma)
+    return conn
+
+# ==============================================================================
+# BENCHMARK (letture e scritture insieme, prima e dopo)
+# ==============================================================================
+# Su un DB sintetico: alcuni thread fanno la query "statistiche" (somme per cliente),
+# uno salva un ordine da 20 righe ogni 20 ms e misura quanto ci mette.
+# Si confrontano le impostazioni di default di SQLite con quelle sopra.
+
+def crea_db_prova(percorso, num_righe):
+    random.seed(0)
+    conn = sqlite3.connect(percorso, isolation_level=None)
+    conn.execute("CREATE TABLE vendita (id INTEGER PRIMARY KEY, cliente_id INTEGER, prodotto_id INTEGER, quantita INTEGER, data VARCHAR(10))")
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO vendita (cliente_id, prodotto_id, quantita, data) VALUES (?, ?, ?, ?)",
+        ((random.randrange(400), random.randrange(3000), random.randrange(1, 10), f"2025-{random.randrange(1, 13):02d}-01") for _ in range(num_righe)),
+    )
+    conn.execute("COMMIT")
+    conn.close()
+
+def prova_concorrenza(percorso, pragma, num_lettori, durata):
+    letture, tempi_scrittura, bloccate = [0], [], [0]
+    lock = threading.Lock()
+    fine = time.perf_counter() + durata
+
+    def apri():
+        if pragma is None:
+            # Come prima: connessione di default (journal rollback, attesa 5s di sqlite3)
+            return sqlite3.connect(percorso, isolation_level=None)
+        return apri_connessione(percorso, pragma)
+
+    def lettore():
+        conn = apri()
+        fatte = 0
+        while time.perf_counter() < fine:
+            try:
+                conn.execute("SELECT cliente_id, SUM(quantita) FROM vendita WHERE data >= '2025-06-01' GROUP BY cliente_id").fetchall()
+                fatte += 1
+            except sqlite3.OperationalError:
+                with lock: bloccate[0] += 1
+        conn.close()
+        with lock: letture[0] += fatte
+
+    def scrittore():
+        # Un ordine da 20 righe ogni 20 ms, come un utente che salva: conta quanto aspetta
+        conn = apri()
+        while time.perf_counter() < fine:
+            inizio = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "INSERT INTO vendita (cliente_id, prodotto_id, quantita, data) VALUES (?, ?, ?, '2025-12-01')",
+                    [(random.randrange(400), random.randrange(3000), 1) for _ in range(20)],
+                )
+                conn.execute("COMMIT")
+                tempi_scrittura.append(time.perf_counter() - inizio)
+            except sqlite3.OperationalError:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                with lock: bloccate[0] += 1
+            time.sleep(0.02)
+        conn.close()
+
+    threads = [threading.Thread(target=lettore) for _ in range(num_lettori)] + [threading.Thread(target=scrittore)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    tempi_scrittura.sort()
+    return {
+        'letture': letture[0] / durata,
+        'scritture': len(tempi_scrittura) / durata,
+        'p95': tempi_scrittura[int(len(tempi_scrittura) * 0.95)] * 1000 if tempi_scrittura else 0,
+        'massimo': tempi_scrittura[-1] * 1000 if tempi_scrittura else 0,
+        'bloccate': bloccate[0],
+    }
+
+def benchmark(num_righe, num_lettori, durata):
+    with tempfile.TemporaryDirectory() as cartella:
+        risultati = {}
+        for nome, pragma in [('default', None), ('WAL + pragma', PRAGMA_CONNESSIONE)]:
+            percorso = os.path.join(cartella, f"prova_{len(risultati)}.db")
+            crea_db_prova(percorso, num_righe)
+            print(f"⏳ {nome}...")
+            risultati[nome] = prova_concorrenza(percorso, pragma, num_lettori, durata)
+
+    print("\n" + "="*72)
+    print(f"📊 BENCHMARK LETTURE/SCRITTURE INSIEME ({num_righe:,} righe, {num_lettori} lettori + 1 scrittore, {durata:g}s)")
+    print("="*72)
+    print(f"{'':14} | {'letture/s':>9} | {'ordini/s':>8} | {'salvataggio p95':>15} | {'massimo':>9} | {'errori':>6}")
+    for nome, r in risultati.items():
+        print(f"{nome:14} | {r['letture']:>9.1f} | {r['scritture']:>8.1f} | {r['p95']:>12.1f} ms | {r['massimo']:>6.1f} ms | {r['bloccate']:>6}")
+    print("="*72)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Impostazioni comuni delle connessioni SQLite.")
+    parser.add_argument('--benchmark', action='store_true', help="Letture e scritture insieme: default contro WAL")
+    parser.add_argument('--righe', type=int, default=200000, help="Righe del DB di prova (default: 200000)")
+    parser.add_argument('--lettori', type=int, default=4, help="Thread che leggono (default: 4)")
+    parser.add_argument('--durata', type=float, default=5, help="Secondi per prova (default: 5)")
+    argomenti = parser.parse_args()
+
+    if argomenti.benchmark:
+        benchmark(argomenti.righe, argomenti.lettori, argomenti.durata)
+    else:
+        parser.print_help()
+        sys.exit(1)
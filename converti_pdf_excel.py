@@ -2,10 +2,22 @@ import pdfplumber
 import pandas as pd
 import re
 import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from pdfminer.pdftypes import resolve1
+
+from lettore_excel import calcola_hash_file
 
 # --- CONFIGURAZIONE ---
 NOME_FILE_PDF = 'Listino articoli al 14102025.pdf'
 NOME_FILE_EXCEL = 'listino_convertito.xlsx'
+# Risultati già estratti, un file per pagina (si può cancellare quando si vuole)
+CARTELLA_CACHE = 'cache_listino'
 
 def pulisci_testo(testo):
     """Rimuove a capo e spazi extra"""
@@ -23,68 +35,202 @@ def pulisci_prezzo(testo):
     except:
         return 0.0
 
-def converti_pdf():
-    if not os.path.exists(NOME_FILE_PDF):
-        print(f"❌ Errore: Non trovo il file '{NOME_FILE_PDF}'")
+# ==============================================================================
+# ESTRAZIONE DI UNA PAGINA
+# ==============================================================================
+
+def estrai_pagina(pagina):
+    """Estrae gli articoli (lista di dizionari) da una pagina pdfplumber."""
+    articoli = []
+
+    # Estrae la tabella
+    table = pagina.extract_table()
+
+    if table:
+        for riga in table:
+            # Saltiamo l'intestazione se la troviamo (controllando se c'è scritto "Cd AR")
+            # Nota: pdfplumber a volte spacca le righe, controlliamo che la riga abbia dati sensati
+            if not riga or not riga[0] or "Cd AR" in str(riga[0]):
+                continue
+
+            # Mapping colonne basato sul tuo PDF:
+            # 0: Codice (Cd AR)
+            # 1: Descrizione
+            # 2: Prezzo Listino (LSArticolo Prezzo)
+            # 3: Pezzi per cartone? (NR PZ)
+            # 4: Prezzo Unitario?
+            # ...
+
+            # Prendiamo solo quello che ci serve
+            codice = pulisci_testo(riga[0])
+            descrizione = pulisci_testo(riga[1])
+            prezzo_listino = pulisci_prezzo(riga[2])
+
+            # Colonna 3 sembra essere "Pezzi per Cartone" o simili
+            # Colonna 4 sembra il prezzo unitario scontato o netto
+            # Salviamo tutto per sicurezza
+
+            if codice: # Se c'è un codice, è una riga valida
+                articoli.append({
+                    'Codice': codice,
+                    'Descrizione': descrizione,
+                    'Prezzo_Listino': prezzo_listino,
+                    # Aggiungo colonne extra grezze se servono controlli
+                    'Colonna_Extra_1': pulisci_testo(riga[3]) if len(riga) > 3 else "",
+                    'Colonna_Extra_2': pulisci_testo(riga[4]) if len(riga) > 4 else ""
+                })
+
+    return articoli
+
+def estrai_gruppo_pagine(percorso_pdf, numeri_pagina):
+    """
+    Lavoro di UN processo: apre il PDF per conto suo (gli oggetti pdfplumber non si
+    possono passare tra processi) ed estrae le pagine indicate (numeri da 0).
+    Restituisce [(numero pagina, articoli), ...].
+    """
+    risultati = []
+    with pdfplumber.open(percorso_pdf) as pdf:
+        for numero in numeri_pagina:
+            risultati.append((numero, estrai_pagina(pdf.pages[numero])))
+    return risultati
+
+def dividi_in_gruppi(numeri_pagina, num_gruppi):
+    """Divide le pagine in gruppi di pagine consecutive, di grandezza simile."""
+    num_gruppi = max(1, min(num_gruppi, len(numeri_pagina)))
+    dimensione, resto = divmod(len(numeri_pagina), num_gruppi)
+    gruppi, inizio = [], 0
+    for i in range(num_gruppi):
+        fine = inizio + dimensione + (1 if i < resto else 0)
+        gruppi.append(numeri_pagina[inizio:fine])
+        inizio = fine
+    return gruppi
+
+# ==============================================================================
+# CACHE PER PAGINA
+# ==============================================================================
+# La chiave è (hash del file, numero pagina). Se il file cambia (es. listino
+# corretto in una sola pagina) si guarda anche l'impronta del CONTENUTO della
+# pagina: le pagine rimaste uguali vengono riprese dalla cache, le altre rifatte.
+
+def impronta_pagina(pagina):
+    """SHA-256 dei comandi di disegno della pagina (testo, linee) più le sue dimensioni."""
+    sha = hashlib.sha256(repr(pagina.bbox).encode())
+    contenuti = pagina.page_obj.contents or []
+    for stream in contenuti:
+        sha.update(resolve1(stream).get_data())
+    return sha.hexdigest()
+
+def percorso_cache(nome):
+    return os.path.join(CARTELLA_CACHE, f"{nome}.json")
+
+def leggi_cache(nome):
+    try:
+        with open(percorso_cache(nome), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def scrivi_cache(nome, dati):
+    os.makedirs(CARTELLA_CACHE, exist_ok=True)
+    with open(percorso_cache(nome), 'w', encoding='utf-8') as f:
+        json.dump(dati, f, ensure_ascii=False)
+
+# ==============================================================================
+# CONVERSIONE
+# ==============================================================================
+
+def converti_pdf(percorso_pdf=NOME_FILE_PDF, percorso_excel=NOME_FILE_EXCEL, workers=None, usa_cache=True):
+    if not os.path.exists(percorso_pdf):
+        print(f"❌ Errore: Non trovo il file '{percorso_pdf}'")
         return
 
-    print(f"📄 Apertura file: {NOME_FILE_PDF}...")
-    
-    dati_estratti = []
-    
-    with pdfplumber.open(NOME_FILE_PDF) as pdf:
+    inizio = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    print(f"📄 Apertura file: {percorso_pdf}...")
+
+    # --- 1. Cosa c'è già in cache? ---
+    hash_file = calcola_hash_file(percorso_pdf)
+    pagine = {}          # numero pagina -> articoli
+    impronte = {}        # numero pagina -> impronta contenuto (solo pagine da estrarre)
+    with pdfplumber.open(percorso_pdf) as pdf:
         tot_pagine = len(pdf.pages)
         print(f"   Trovate {tot_pagine} pagine.")
 
-        for i, pagina in enumerate(pdf.pages):
-            print(f"   Elaborazione pagina {i+1}/{tot_pagine}...", end='\r')
-            
-            # Estrae la tabella
-            table = pagina.extract_table()
-            
-            if table:
-                for riga in table:
-                    # Saltiamo l'intestazione se la troviamo (controllando se c'è scritto "Cd AR")
-                    # Nota: pdfplumber a volte spacca le righe, controlliamo che la riga abbia dati sensati
-                    if not riga or not riga[0] or "Cd AR" in str(riga[0]):
-                        continue
-                    
-                    # Mapping colonne basato sul tuo PDF:
-                    # 0: Codice (Cd AR)
-                    # 1: Descrizione
-                    # 2: Prezzo Listino (LSArticolo Prezzo)
-                    # 3: Pezzi per cartone? (NR PZ)
-                    # 4: Prezzo Unitario?
-                    # ...
-                    
-                    # Prendiamo solo quello che ci serve
-                    codice = pulisci_testo(riga[0])
-                    descrizione = pulisci_testo(riga[1])
-                    prezzo_listino = pulisci_prezzo(riga[2])
-                    
-                    # Colonna 3 sembra essere "Pezzi per Cartone" o simili
-                    # Colonna 4 sembra il prezzo unitario scontato o netto
-                    # Salviamo tutto per sicurezza
-                    
-                    if codice: # Se c'è un codice, è una riga valida
-                        dati_estratti.append({
-                            'Codice': codice,
-                            'Descrizione': descrizione,
-                            'Prezzo_Listino': prezzo_listino,
-                            # Aggiungo colonne extra grezze se servono controlli
-                            'Colonna_Extra_1': pulisci_testo(riga[3]) if len(riga) > 3 else "",
-                            'Colonna_Extra_2': pulisci_testo(riga[4]) if len(riga) > 4 else ""
-                        })
-
-    print(f"\n✅ Estrazione completata. Trovati {len(dati_estratti)} articoli.")
-    
+        for numero, pagina in enumerate(pdf.pages):
+            if not usa_cache:
+                impronte[numero] = None
+                continue
+            dati = leggi_cache(f"{hash_file}_{numero}")
+            if dati is None:
+                impronte[numero] = impronta_pagina(pagina)
+                dati = leggi_cache(f"pagina_{impronte[numero]}")
+            if dati is not None:
+                pagine[numero] = dati
+                impronte.pop(numero, None)
+
+    da_estrarre = sorted(impronte.keys())
+    fine_controllo = time.perf_counter()
+    print(f"   Pagine già pronte in cache: {len(pagine)}, da estrarre: {len(da_estrarre)}")
+
+    # --- 2. Estrazione in parallelo (ogni processo un gruppo di pagine consecutive) ---
+    if da_estrarre:
+        gruppi = dividi_in_gruppi(da_estrarre, workers)
+        print(f"⚙️  Estrazione con {len(gruppi)} processi...")
+        fatte = 0
+        if len(gruppi) == 1:
+            risultati = [estrai_gruppo_pagine(percorso_pdf, gruppi[0])]
+        else:
+            with ProcessPoolExecutor(max_workers=len(gruppi)) as executor:
+                risultati = executor.map(estrai_gruppo_pagine, [percorso_pdf] * len(gruppi), gruppi)
+
+        for risultato_gruppo in risultati:
+            for numero, articoli in risultato_gruppo:
+                pagine[numero] = articoli
+                if usa_cache:
+                    scrivi_cache(f"{hash_file}_{numero}", articoli)
+                    scrivi_cache(f"pagina_{impronte[numero]}", articoli)
+            fatte += len(risultato_gruppo)
+            print(f"   Elaborate {fatte}/{len(da_estrarre)} pagine...", end='\r')
+        print()
+
+    fine_estrazione = time.perf_counter()
+
+    # --- 3. Unione in ordine di pagina ---
+    dati_estratti = [articolo for numero in range(tot_pagine) for articolo in pagine.get(numero, [])]
+    print(f"✅ Estrazione completata. Trovati {len(dati_estratti)} articoli.")
+
     # Creiamo il DataFrame e salviamo in Excel
     df = pd.DataFrame(dati_estratti)
-    
-    print(f"💾 Salvataggio in {NOME_FILE_EXCEL}...")
-    df.to_excel(NOME_FILE_EXCEL, index=False)
-    
+
+    print(f"💾 Salvataggio in {percorso_excel}...")
+    df.to_excel(percorso_excel, index=False)
+    fine = time.perf_counter()
+
+    # --- RIEPILOGO TEMPI ---
+    print("\n" + "="*40)
+    print("⏱️  TEMPI")
+    print("="*40)
+    print(f"Controllo cache:   {fine_controllo - inizio:6.2f}s")
+    print(f"Estrazione:        {fine_estrazione - fine_controllo:6.2f}s ({len(da_estrarre)} pagine, {workers} workers)")
+    if da_estrarre:
+        print(f"                   {(fine_estrazione - fine_controllo) / len(da_estrarre):6.2f}s a pagina")
+    print(f"Salvataggio Excel: {fine - fine_estrazione:6.2f}s")
+    print(f"Totale:            {fine - inizio:6.2f}s")
+    print("="*40)
+
     print("🏆 Fatto! Apri il file Excel e controllalo.")
 
 if __name__ == "__main__":
-    converti_pdf()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Converte il listino PDF in Excel.")
+    parser.add_argument('--pdf', default=NOME_FILE_PDF, help=f"File PDF del listino (default: {NOME_FILE_PDF})")
+    parser.add_argument('--excel', default=NOME_FILE_EXCEL, help=f"File Excel da creare (default: {NOME_FILE_EXCEL})")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Numero di processi per l'estrazione (default: numero di CPU)")
+    parser.add_argument('--senza-cache', action='store_true', help="Rifà tutte le pagine ignorando la cache")
+    argomenti = parser.parse_args()
+
+    if argomenti.workers is not None and argomenti.workers < 1:
+        print("❌ --workers deve essere almeno 1")
+        sys.exit(1)
+
+    converti_pdf(argomenti.pdf, argomenti.excel, argomenti.workers, not argomenti.senza_cache)
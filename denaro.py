@@ -0,0 +1,45 @@
+# ==============================================================================
+# IMPORTI IN CENTESIMI
+# ==============================================================================
+# Nel database prezzi e fatturati sono CENTESIMI INTERI (migrazione 7):
+#   prodotto.prezzo, prezzo_listino.prezzo, dettaglio_ordine.prezzo_storico,
+#   riepilogo_vendite.fatturato
+# Le somme in SQL (quantità x prezzo su centinaia di migliaia di righe) sono così
+# esatte, senza gli arrotondamenti dei float.
+# Gli euro esistono solo "ai bordi": form, JSON per le pagine, file Excel.
+#
+# Uso:
+#   a_centesimi("9,60")  -> 960        (form, file importati)
+#   in_euro(960)         -> 9.6        (JSON, template: {{ p.prezzo|euro }})
+#
+# Arrotondamento UNICO ovunque: mezzo centesimo per eccesso (0,125 -> 13) sul valore
+# decimale scritto, non sul float (1,005 * 100 = 100,4999...). La migrazione 7 fa lo
+# stesso con ROUND(ROUND(x, 2) * 100): se le regole divergessero, un import
+# vedrebbe "cambiato" un prezzo uguale e scriverebbe una versione di listino inutile.
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+CENTESIMO = Decimal('0.01')
+
+def a_centesimi(euro):
+    """
+    Euro (numero o testo, anche con la virgola) -> centesimi interi.
+    Vuoto/None = 0. Un testo non numerico solleva ValueError.
+    """
+    if euro is None or euro == '':
+        return 0
+    testo = euro.strip().replace(',', '.') if isinstance(euro, str) else str(euro)
+    try:
+        return int(Decimal(testo).quantize(CENTESIMO, ROUND_HALF_UP) * 100)
+    except InvalidOperation:
+        raise ValueError(f"Importo non valido: {euro!r}")
+
+def in_euro(centesimi):
+    """Centesimi -> euro (float) per JSON e pagine. None = 0."""
+    return (centesimi or 0) / 100
+
+def serie_in_centesimi(serie):
+    """Come a_centesimi() su una colonna pandas di euro (import): convertiti solo i valori distinti."""
+    euro = serie.astype(float)
+    centesimi = {valore: a_centesimi(valore) for valore in euro.unique()}
+    return euro.map(centesimi).astype('int64')
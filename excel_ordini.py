@@ -0,0 +1,101 @@
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import NamedStyle, Font, Alignment, Border, Side, DEFAULT_FONT
+from openpyxl.utils import get_column_letter
+
+# ==============================================================================
+# EXPORT EXCEL DEGLI ORDINI (Modalità "write-only" di OpenPyXL)
+# ==============================================================================
+# Le righe vengono scritte una dopo l'altra direttamente nel file, senza tenere
+# in memoria tutto il foglio: la RAM resta costante anche con fogli grandi.
+# Gli stili sono "NamedStyle" registrati una volta nel workbook e condivisi da
+# tutte le celle (invece di creare Font/Border/Alignment per ogni cella).
+
+INTESTAZIONE_DOCUMENTO = "Agente 15 ALOISI GIANCARLO"
+
+def crea_workbook():
+    """Workbook in sola scrittura con gli stili condivisi già registrati."""
+    wb = Workbook(write_only=True)
+
+    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+    center_align = Alignment(horizontal='center', vertical='center')
+
+    wb.add_named_style(NamedStyle(name='titolo', font=Font(bold=True, size=14)))
+    wb.add_named_style(NamedStyle(name='grassetto', font=Font(bold=True)))
+    # Intestazioni, codici, totali e quantità presenti
+    wb.add_named_style(NamedStyle(name='cella_grassetto', font=Font(bold=True), alignment=center_align, border=thin_border))
+    # Quantità vuote ("-")
+    # (Senza un font esplicito lo stile perderebbe il Calibri 11 standard di Excel)
+    wb.add_named_style(NamedStyle(name='cella_centrata', font=DEFAULT_FONT, alignment=center_align, border=thin_border))
+    # Nome prodotto e celle vuote della griglia
+    wb.add_named_style(NamedStyle(name='cella_bordo', font=DEFAULT_FONT, border=thin_border))
+    return wb
+
+def cella(ws, valore, stile):
+    c = WriteOnlyCell(ws, value=valore)
+    c.style = stile
+    return c
+
+def titolo_foglio(testo):
+    """Excel non accetta alcuni caratteri nel nome del foglio e lo vuole di max 31 caratteri."""
+    for carattere in '[]:*?/\\':
+        testo = testo.replace(carattere, '-')
+    return testo[:31]
+
+def scrivi_foglio_ordine(wb, titolo, data_str, matrice, note=None):
+    """
+    Aggiunge al workbook un foglio con il riepilogo (stessa tabella del PDF).
+    matrice: risultato di costruisci_matrice() (matrice_ordine.py).
+    """
+    ws = wb.create_sheet(titolo_foglio(titolo))
+    clienti_ordinati = matrice['clienti']
+    col_tot = 3 + len(clienti_ordinati) # I clienti partono dalla colonna C (3)
+
+    # --- FORMATTAZIONE LARGHEZZE COLONNE (in write-only va fatta PRIMA di scrivere) ---
+    ws.column_dimensions['A'].width = 10
+    ws.column_dimensions['B'].width = 40
+    for i in range(3, col_tot + 1):
+        ws.column_dimensions[get_column_letter(i)].width = 12
+
+    # --- INTESTAZIONE DOCUMENTO ---
+    ws.append([cella(ws, INTESTAZIONE_DOCUMENTO, 'titolo')])
+    ws.append([])
+    ws.append([cella(ws, f"Riepilogo del {data_str}", 'grassetto')])
+    ws.append([cella(ws, f"Numero ordini: {len(clienti_ordinati)}", 'grassetto')])
+    ws.append([]) # La tabella inizia dalla riga 6
+
+    # --- INTESTAZIONE TABELLA (RIGA 1: Codici Cliente) ---
+    riga = [None, cella(ws, "Cod. Cliente", 'cella_grassetto')]
+    riga += [cella(ws, c['codice'], 'cella_grassetto') for c in clienti_ordinati]
+    riga.append(cella(ws, "TOT", 'cella_grassetto'))
+    ws.append(riga)
+
+    # --- INTESTAZIONE TABELLA (RIGA 2: Nomi) ---
+    riga = [cella(ws, "Cod. Prod.", 'cella_grassetto'), cella(ws, "Nome Prodotto", 'cella_grassetto')]
+    riga += [cella(ws, c['nome'], 'cella_grassetto') for c in clienti_ordinati]
+    riga.append(cella(ws, None, 'cella_bordo')) # Cella vuota sotto TOT
+    ws.append(riga)
+
+    # --- CORPO TABELLA ---
+    for i, dati in enumerate(matrice['prodotti']):
+        riga = [cella(ws, dati['codice'], 'cella_grassetto'), cella(ws, dati['nome'], 'cella_bordo')]
+        for qta in matrice['quantita'][i].tolist():
+            if qta > 0:
+                riga.append(cella(ws, qta, 'cella_grassetto'))
+            else:
+                riga.append(cella(ws, "-", 'cella_centrata'))
+        riga.append(cella(ws, int(matrice['totali_prodotti'][i]), 'cella_grassetto'))
+        ws.append(riga)
+
+    # --- RIGA TOTALI FINALI ---
+    riga = [cella(ws, None, 'cella_bordo'), cella(ws, "TOTALI", 'cella_grassetto')]
+    riga += [cella(ws, somma, 'cella_grassetto') for somma in matrice['totali_clienti'].tolist()]
+    riga.append(cella(ws, matrice['totale'], 'cella_grassetto'))
+    ws.append(riga)
+
+    # --- NOTE ---
+    if note:
+        ws.append([])
+        ws.append([f"Note Aggiuntive: {note}"])
+
+    return ws
@@ -0,0 +1,455 @@
+import pandas as pd
+import os
+import sys
+import time
+import argparse
+
+from migrazioni import applica_migrazioni
+from connessione_db import apri_connessione, PRAGMA_IMPORT
+from lettore_excel import leggi_record, pulisci_codice, calcola_hash_file, SCHEMA_LISTINO
+from denaro import a_centesimi, in_euro
+from importa_excel_reale import (
+    leggi_righe, separa_clienti_mancanti,
+    confronta_prodotti, scrivi_prodotti, scrivi_prezzi, confronta_righe, scrivi_righe, registra_file,
+    stampa_clienti_mancanti,
+)
+
+# ==============================================================================
+# IMPORTAZIONE UNICA: LETTURA -> CONFRONTO COL DB -> SCRITTURA
+# ==============================================================================
+# Un solo comando per tutti i file che entrano nel gestionale:
+#   vendite      -> export vendite della sede (tab_ag_15_cli_art_2025.xlsx)
+#   listino      -> listino convertito dal PDF (listino_convertito.xlsx)
+#   anagrafiche  -> prodotti e clienti iniziali (listino.ods)
+#
+# 1. LETTURA:   il file viene letto e pulito UNA volta; il risultato viene salvato
+#               in CARTELLA_CACHE con il nome legato all'hash del file.
+# 2. CONFRONTO: sempre rifatto sul DB attuale (il DB può cambiare tra una prova e l'altra).
+# 3. SCRITTURA: solo con --commit, in UNA transazione.
+#
+# Uso tipico:
+#   py importa.py listino               (prova: report delle differenze, nessuna modifica)
+#   py importa.py listino --commit      (scrive; la lettura viene ripresa dalla cache)
+
+# --- CONFIGURAZIONE ---
+DB_NAME = 'gestionale.db'
+CARTELLA_CACHE = 'cache_import'
+# Da aumentare se cambia la pulizia dei dati: le letture vecchie in cache non valgono più
+VERSIONE_CACHE = 1
+
+FILE_PREDEFINITI = {
+    'vendite': 'tab_ag_15_cli_art_2025.xlsx',
+    'listino': 'listino_convertito.xlsx',
+    'anagrafiche': 'listino.ods',
+}
+
+def get_db_path():
+    if os.path.exists(DB_NAME): return DB_NAME
+    elif os.path.exists(os.path.join('instance', DB_NAME)): return os.path.join('instance', DB_NAME)
+    else: return None
+
+# ==============================================================================
+# 1. LETTURA (con cache su disco)
+# ==============================================================================
+
+def leggi_vendite(percorso):
+    letto = leggi_righe(percorso)
+    if letto is None:
+        return None
+    righe, righe_file = letto
+    return {'righe': righe.reset_index(drop=True), 'righe_file': righe_file}
+
+def leggi_listino(percorso):
+    print(f"📂 Lettura file listino: {percorso}...")
+    try:
+        record = [r for blocco in leggi_record(percorso, SCHEMA_LISTINO) for r in blocco]
+    except Exception as e:
+        print(f"❌ Errore lettura Excel: {e}")
+        return None
+
+    righe = pd.DataFrame(record, columns=['codice', 'nome', 'prezzo'])
+    return {'righe': righe[righe['codice'].notna() & (righe['codice'] != '')].reset_index(drop=True),
+            'righe_file': len(record)}
+
+def pulisci_nome(valore):
+    if pd.isna(valore): return None
+    return str(valore).replace('*', '').strip()
+
+def leggi_anagrafiche(percorso):
+    """Fogli 'Prodotti' e 'Clienti' (senza intestazione: colonna A codice, colonna B nome)."""
+    print(f"📂 Apro il file: {percorso}")
+    fogli = {}
+    righe_file = 0
+    for foglio in ('Prodotti', 'Clienti'):
+        try:
+            df = pd.read_excel(percorso, engine='odf', sheet_name=foglio, header=None)
+        except ValueError:
+            print(f"⚠️ Foglio '{foglio}' non trovato.")
+            continue
+        except Exception as e:
+            print(f"❌ Errore lettura {foglio}: {e}")
+            return None
+
+        if df.shape[1] < 2:
+            df = df.reindex(columns=[0, 1])
+        fogli[foglio] = pd.DataFrame({
+            'riga': df.index + 1, # Numero riga nel foglio (parte da 1)
+            'codice': [pulisci_codice(v) for v in df[0]],
+            'nome': [pulisci_nome(v) for v in df[1]],
+            'originale': [f"'{c}' - '{n}'" for c, n in zip(df[0], df[1])],
+        })
+        righe_file += len(df)
+    return {'fogli': fogli, 'righe_file': righe_file}
+
+LETTORI = {
+    'vendite': leggi_vendite,
+    'listino': leggi_listino,
+    'anagrafiche': leggi_anagrafiche,
+}
+
+def percorso_cache(tipo, hash_file):
+    return os.path.join(CARTELLA_CACHE, f"{tipo}_{hash_file}_v{VERSIONE_CACHE}.pkl")
+
+def leggi_file(tipo, percorso, usa_cache=True):
+    """
+    Restituisce (dati letti, hash del file) oppure (None, None).
+    Se lo stesso file (stesso hash) è già stato letto, i dati vengono ripresi dalla cache.
+    """
+    hash_file = calcola_hash_file(percorso)
+    cache = percorso_cache(tipo, hash_file)
+
+    if usa_cache and os.path.exists(cache):
+        try:
+            dati = pd.read_pickle(cache)
+            print(f"♻️  Lettura di {percorso} ripresa dalla cache (file invariato).")
+            return dati, hash_file
+        except Exception:
+            pass # Cache rovinata: si rilegge il file
+
+    dati = LETTORI[tipo](percorso)
+    if dati is None:
+        return None, None
+
+    if usa_cache:
+        os.makedirs(CARTELLA_CACHE, exist_ok=True)
+        pd.to_pickle(dati, cache)
+    return dati, hash_file
+
+# ==============================================================================
+# 2. CONFRONTO COL DATABASE (nessuna scrittura)
+# ==============================================================================
+
+def confronta_vendite(cursor, dati):
+    righe = dati['righe']
+
+    # Clienti: NON vengono creati, le loro righe vengono saltate
+    clienti_file = dict(zip(righe['cli_cod'], righe['cli_nome']))
+    clienti_db = dict(cursor.execute("SELECT codice, nome FROM cliente").fetchall())
+    map_clienti = dict(cursor.execute("SELECT codice, id FROM cliente").fetchall())
+    righe_ok, clienti_mancanti, righe_saltate = separa_clienti_mancanti(righe, map_clienti)
+
+    # Prodotti (solo delle righe che verranno importate)
+    prodotti_nuovi, prezzi_cambiati, _ = confronta_prodotti(cursor, righe_ok)
+    nomi_db = dict(cursor.execute("SELECT codice, nome FROM prodotto").fetchall())
+    nomi_file = righe_ok.groupby('prod_cod', sort=False)['prod_nome'].first()
+    conflitti_prodotti = [(cod, nomi_db[cod], nome) for cod, nome in nomi_file.items()
+                          if cod in nomi_db and nomi_db[cod].strip().lower() != nome.strip().lower()]
+
+    return {
+        'righe_file': dati['righe_file'],
+        'righe_valide': len(righe),
+        'clienti_file': clienti_file,
+        'clienti_db': clienti_db,
+        'clienti_mancanti': clienti_mancanti,
+        'righe_saltate': righe_saltate,
+        'conflitti_clienti': [(cod, clienti_db[cod], nome) for cod, nome in clienti_file.items()
+                              if cod in clienti_db and clienti_db[cod] != nome],
+        'map_clienti': map_clienti,
+        'righe_ok': righe_ok,
+        'prodotti_nuovi': prodotti_nuovi,
+        'prezzi_cambiati': prezzi_cambiati,
+        'conflitti_prodotti': conflitti_prodotti,
+        'giorni': righe['data'].nunique(),
+        'fatturato': float((righe['qta'] * righe['prezzo']).sum()),
+        'righe': confronta_righe(cursor, righe_ok) if not righe_ok.empty else None,
+    }
+
+def confronta_listino(cursor, dati):
+    righe = dati['righe']
+    # Per ogni codice: nome della prima riga, prezzo dell'ultima (codici ripetuti nel listino)
+    per_codice = righe.groupby('codice', sort=False).agg(nome=('nome', 'first'), prezzo=('prezzo', 'last'))
+    db_prodotti = {codice: (id_prod, nome, prezzo)
+                   for id_prod, codice, nome, prezzo in cursor.execute("SELECT id, codice, nome, prezzo FROM prodotto")}
+
+    nuovi, aggiornati, conflitti_nome = [], [], []
+    presenti = 0
+    for codice, nome, prezzo in zip(per_codice.index, per_codice['nome'], per_codice['prezzo'].tolist()):
+        prezzo = a_centesimi(prezzo)  # Nel DB centesimi (migrazione 7)
+        if codice not in db_prodotti:
+            nuovi.append((codice, nome, prezzo))
+            continue
+        presenti += 1
+        id_prod, nome_db, prezzo_db = db_prodotti[codice]
+        if prezzo_db != prezzo:
+            aggiornati.append((prezzo, id_prod))
+        if nome_db.strip().lower() != nome.strip().lower():
+            conflitti_nome.append((codice, nome_db, nome))
+
+    return {
+        'righe_file': dati['righe_file'],
+        'presenti': presenti,
+        'nuovi': nuovi,
+        'aggiornati': aggiornati,
+        'conflitti_nome': conflitti_nome,
+    }
+
+def confronta_anagrafiche(cursor, dati):
+    """Per ogni foglio: righe da inserire, doppioni (già nel DB o ripetuti nel file) e righe scartate."""
+    tabelle = {'Prodotti': 'prodotto', 'Clienti': 'cliente'}
+    risultato = {'righe_file': dati['righe_file'], 'fogli': {}}
+
+    for foglio, righe in dati['fogli'].items():
+        gia_presenti = set(r[0] for r in cursor.execute(f"SELECT codice FROM {tabelle[foglio]}"))
+        nuovi, doppioni, scartate = [], [], []
+        for riga, codice, nome, originale in zip(righe['riga'], righe['codice'], righe['nome'], righe['originale']):
+            if not codice or not nome:
+                scartate.append((riga, originale))
+            elif codice in gia_presenti:
+                doppioni.append((riga, codice, nome))
+            else:
+                nuovi.append((codice, nome))
+                gia_presenti.add(codice)
+        risultato['fogli'][foglio] = {'totale': len(righe), 'nuovi': nuovi, 'doppioni': doppioni, 'scartate': scartate}
+    return risultato
+
+# ==============================================================================
+# 3. SCRITTURA (dentro la transazione aperta da esegui())
+# ==============================================================================
+
+def applica_vendite(cursor, confronto, hash_file, percorso):
+    if confronto['righe'] is None:
+        return {}
+    map_prodotti, _, _ = scrivi_prodotti(cursor, confronto['righe_ok'])
+    ordini_creati, righe_inserite = scrivi_righe(cursor, confronto['righe'], confronto['map_clienti'], map_prodotti)
+    registra_file(cursor, hash_file, percorso, len(confronto['righe_ok']))
+    return {'ordini_creati': ordini_creati, 'righe_inserite': righe_inserite}
+
+def applica_listino(cursor, confronto, hash_file, percorso):
+    cursor.executemany("""
+        INSERT INTO prodotto (codice, nome, prezzo, ingredienti, attivo)
+        VALUES (?, ?, ?, '', 1)
+    """, confronto['nuovi'])
+    # Prezzi cambiati: nuove versioni di listino (la storia resta in prezzo_listino)
+    scrivi_prezzi(cursor, confronto['aggiornati'])
+    return {}
+
+def applica_anagrafiche(cursor, confronto, hash_file, percorso):
+    fogli = confronto['fogli']
+    if 'Prodotti' in fogli:
+        cursor.executemany("""
+            INSERT OR IGNORE INTO prodotto (codice, nome, ingredienti, prezzo, attivo)
+            VALUES (?, ?, '', 0, 1)
+        """, fogli['Prodotti']['nuovi'])
+    if 'Clienti' in fogli:
+        cursor.executemany("""
+            INSERT OR IGNORE INTO cliente (codice, nome, note, attivo)
+            VALUES (?, ?, '', 1)
+        """, fogli['Clienti']['nuovi'])
+    return {}
+
+# ==============================================================================
+# REPORT
+# ==============================================================================
+
+def stampa_vendite(confronto, commit):
+    print("\n" + "="*50)
+    print("📊 REPORT VENDITE vs DATABASE")
+    print("="*50)
+    print(f"📄 Righe nel file: {confronto['righe_file']} (ignorate senza codici/data: {confronto['righe_file'] - confronto['righe_valide']})")
+
+    clienti_file, clienti_db = confronto['clienti_file'], confronto['clienti_db']
+    print(f"\n👥 CLIENTI:")
+    print(f"   - Totali nel file: {len(clienti_file)}")
+    print(f"   - NON nel DB (le loro righe vengono saltate): {len(confronto['clienti_mancanti'])}")
+    print("\n   --- ELENCO COMPLETO CLIENTI NEL FILE ---")
+    for cod, nome in sorted(clienti_file.items(), key=lambda item: item[1]):
+        stato = "🆕 (Nuovo)" if cod not in clienti_db else "✅ (Già presente)"
+        print(f"   • [{cod}] {nome} {stato}")
+    print("   ---------------------------------------")
+    if confronto['conflitti_clienti']:
+        print(f"\n⚠️  NOMI DIVERSI ({len(confronto['conflitti_clienti'])} casi):")
+        for c in confronto['conflitti_clienti']:
+            print(f"   • {c[0]}: DB='{c[1]}' <--> FILE='{c[2]}'")
+
+    print(f"\n📦 PRODOTTI:")
+    print(f"   - NUOVI: {len(confronto['prodotti_nuovi'])}")
+    print(f"   - Prezzi che cambiano: {len(confronto['prezzi_cambiati'])}")
+    if confronto['prodotti_nuovi']:
+        print("\n   --- ELENCO PRODOTTI NUOVI (Non nel DB) ---")
+        for p in sorted(confronto['prodotti_nuovi'], key=lambda p: p[1]):
+            print(f"   • [{p[0]}] {p[1]}")
+        print("   ------------------------------------------")
+    if confronto['conflitti_prodotti']:
+        print(f"\n⚠️  NOMI DIVERSI ({len(confronto['conflitti_prodotti'])} casi):")
+        print("   (Legenda: DB = Nome attuale nel tuo programma | FILE = Nome nel file Excel)")
+        for p in confronto['conflitti_prodotti']:
+            print(f"   • Cod. {p[0]}:")
+            print(f"     DB:   {p[1]}")
+            print(f"     FILE: {p[2]}")
+            print("     ---")
+
+    print(f"\n📄 RIGHE D'ORDINE:")
+    print(f"   - Giorni di lavoro nel file: {confronto['giorni']}")
+    print(f"   - Fatturato storico totale: € {confronto['fatturato']:,.2f}")
+    righe = confronto['righe']
+    if righe is not None:
+        invariate = len(righe['righe']) - len(righe['nuove']) - len(righe['adottate'])
+        print(f"   - Da inserire:              {len(righe['nuove'])}")
+        print(f"   - Da togliere (corrette):   {len(righe['sparite'])}")
+        print(f"   - Già presenti da collegare: {len(righe['adottate'])}")
+        print(f"   - Invariate:                {invariate}")
+    print("-" * 50)
+    stampa_clienti_mancanti(confronto['clienti_mancanti'], confronto['righe_saltate'])
+
+def stampa_listino(confronto, commit):
+    print("\n" + "="*50)
+    print("📊 REPORT LISTINO vs DATABASE")
+    print("="*50)
+    print(f"📄 Righe nel file Excel:          {confronto['righe_file']}")
+    print(f"✅ Prodotti GIÀ PRESENTI nel DB:   {confronto['presenti']}")
+    print(f"🆕 Prodotti NUOVI (non nel DB):    {len(confronto['nuovi'])}")
+    print(f"🔄 Prezzi che cambiano:            {len(confronto['aggiornati'])}")
+    print("-" * 50)
+
+    conflitti = confronto['conflitti_nome']
+    if conflitti:
+        print(f"⚠️  ATTENZIONE: {len(conflitti)} Prodotti hanno lo STESSO CODICE ma NOME DIVERSO.")
+        print("   (Ecco i primi 10 casi come esempio):")
+        for cod, nome_db, nome_excel in conflitti[:10]:
+            print(f"   • [{cod}]")
+            print(f"     DB:    {nome_db}")
+            print(f"     EXCEL: {nome_excel}")
+            print("     ---")
+        if len(conflitti) > 10:
+            print(f"   ...e altri {len(conflitti) - 10} casi.")
+    else:
+        print("✨ Nessun conflitto di nomi rilevato sui prodotti esistenti.")
+
+    if confronto['nuovi']:
+        print("-" * 50)
+        print(f"🆕 Esempi di prodotti {'aggiunti' if commit else 'che verrebbero aggiunti'} ({len(confronto['nuovi'])} tot):")
+        for cod, nome, prezzo in confronto['nuovi'][:5]:
+            print(f"   • [{cod}] {nome} (€ {in_euro(prezzo):.2f})")
+        if len(confronto['nuovi']) > 5:
+            print("   ...")
+
+def stampa_anagrafiche(confronto, commit):
+    for foglio, esito in confronto['fogli'].items():
+        print("\n" + "="*40)
+        print(f"--- {foglio.upper()} ---")
+        print("="*40)
+        for riga, originale in esito['scartate']:
+            print(f"❌ [RIGA {riga}] SCARTATA (Dati mancanti/vuoti)")
+            print(f"   Originale: {originale}")
+        for riga, codice, nome in esito['doppioni']:
+            print(f"⚠️ [RIGA {riga}] GIÀ PRESENTE (Saltato): {codice} - {nome}")
+        print("-" * 30)
+        print(f"{foglio.upper()} TOTALI: {esito['totale']}")
+        print(f"✅ {'Inseriti' if commit else 'Da inserire'}: {len(esito['nuovi'])}")
+        print(f"⚠️ Doppioni: {len(esito['doppioni'])}")
+        print(f"❌ Scartati: {len(esito['scartate'])}")
+
+PASSI = {
+    'vendite': (confronta_vendite, applica_vendite, stampa_vendite),
+    'listino': (confronta_listino, applica_listino, stampa_listino),
+    'anagrafiche': (confronta_anagrafiche, applica_anagrafiche, stampa_anagrafiche),
+}
+
+# ==============================================================================
+# ESECUZIONE
+# ==============================================================================
+
+def esegui(tipo, percorso=None, commit=False, forza=False, usa_cache=True):
+    """
+    Lettura -> confronto -> (solo con commit=True) scrittura.
+    Restituisce il confronto (dizionario del report) oppure None in caso di errore.
+    """
+    percorso = percorso or FILE_PREDEFINITI[tipo]
+    confronta, applica, stampa = PASSI[tipo]
+    inizio = time.perf_counter()
+
+    db_path = get_db_path()
+    if not db_path:
+        print("❌ ERRORE: Database non trovato. Avvia prima 'py app.py'.")
+        return None
+    if not os.path.exists(percorso):
+        print(f"❌ ERRORE: File {percorso} non trovato.")
+        return None
+
+    # --- 1. LETTURA ---
+    dati, hash_file = leggi_file(tipo, percorso, usa_cache)
+    if dati is None:
+        return None
+    fine_lettura = time.perf_counter()
+
+    conn = apri_connessione(db_path, PRAGMA_IMPORT) # WAL: l'app può continuare a leggere durante l'import
+    applica_migrazioni(conn) # Solo struttura (come all'avvio dell'app): servono le tabelle dell'import
+    cursor = conn.cursor()
+
+    if tipo == 'vendite':
+        gia_importato = cursor.execute("SELECT importato_il FROM importazione_file WHERE hash_file = ?", (hash_file,)).fetchone()
+        if gia_importato:
+            print(f"ℹ️  Questo file è già stato importato il {gia_importato[0]} (stesso contenuto).")
+            if commit and not forza:
+                print("   Nessuna modifica al database. Usa --forza per riapplicarlo comunque.")
+                conn.close()
+                return None
+
+    # --- 2. CONFRONTO (+ 3. SCRITTURA) ---
+    # Con --commit il confronto si fa DENTRO la transazione: nessuno può cambiare il DB
+    # tra il report e la scrittura.
+    try:
+        if commit:
+            cursor.execute("BEGIN IMMEDIATE")
+        confronto = confronta(cursor, dati)
+        fine_confronto = time.perf_counter()
+        stampa(confronto, commit)
+        if commit:
+            esito = applica(cursor, confronto, hash_file, percorso)
+            cursor.execute("COMMIT")
+    except Exception as e:
+        if commit:
+            cursor.execute("ROLLBACK")
+        print(f"❌ Errore, nessuna modifica salvata: {e}")
+        conn.close()
+        return None
+    conn.close()
+    fine = time.perf_counter()
+
+    print("="*50)
+    if commit:
+        if esito.get('righe_inserite') is not None:
+            print(f"📅 Ordini (Giorni) Creati: {esito['ordini_creati']}")
+            print(f"📝 Righe Inserite:         {esito['righe_inserite']}")
+        print("✅ Modifiche salvate nel database.")
+    else:
+        print("🏁 Prova terminata. Nessuna modifica applicata (usa --commit per scrivere).")
+    print(f"⏱️  Lettura {fine_lettura - inizio:.2f}s, confronto {fine_confronto - fine_lettura:.2f}s"
+          + (f", scrittura {fine - fine_confronto:.2f}s" if commit else ""))
+    print("="*50)
+    return confronto
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importa nel gestionale vendite, listino o anagrafiche (prima prova, poi --commit).")
+    parser.add_argument('tipo', choices=list(FILE_PREDEFINITI.keys()), help="Cosa importare")
+    parser.add_argument('--file', help="File da importare (default: " + ", ".join(f"{t}={f}" for t, f in FILE_PREDEFINITI.items()) + ")")
+    modo = parser.add_mutually_exclusive_group()
+    modo.add_argument('--dry-run', action='store_true', help="Solo report delle differenze col DB (è il default)")
+    modo.add_argument('--commit', action='store_true', help="Scrive le differenze nel DB")
+    parser.add_argument('--forza', action='store_true', help="Vendite: riapplica anche un file già importato")
+    parser.add_argument('--senza-cache', action='store_true', help="Rilegge il file ignorando la cache")
+    argomenti = parser.parse_args()
+
+    risultato = esegui(argomenti.tipo, argomenti.file, argomenti.commit, argomenti.forza, not argomenti.senza_cache)
+    if risultato is None:
+        sys.exit(1)
@@ -1,160 +1,325 @@
 import pandas as pd
-import sqlite3
+import numpy as np
 import os
+import sys
+import time
+import hashlib
+import argparse
 import datetime
 
+from models import (
+    SQL_RICOSTRUZIONE_RIEPILOGO, SQL_RICOSTRUZIONE_RIEPILOGO_MESE,
+    SQL_RICOSTRUZIONE_ULTIMO_ACQUISTO, SQL_RICOSTRUZIONE_ULTIMO_ACQUISTO_COPPIA,
+)
+from migrazioni import applica_migrazioni
+from connessione_db import apri_connessione, PRAGMA_IMPORT
+from lettore_excel import leggi_blocchi, pulisci_codice, data_iso, calcola_hash_file
+from denaro import serie_in_centesimi
+
 # --- CONFIGURAZIONE ---
 NOME_FILE = 'tab_ag_15_cli_art_2025.xlsx'
 FOGLIO_DA_LEGGERE = 'Scriptare'
+COLONNE_DA_LEGGERE = ['DataDoc', 'Cd_CF', 'CF_Descrizione', 'Cd_AR', 'DORig_Descrizione', 'Qta', 'PrezzoUnitarioV']
 DB_NAME = 'gestionale.db'
 
+# Gli ordini creati dall'import hanno questo orario (quelli fatti dall'app hanno l'ora vera)
+ORA_ORDINI_IMPORTATI = '00-00'
+
 def get_db_path():
     if os.path.exists(DB_NAME): return DB_NAME
     elif os.path.exists(os.path.join('instance', DB_NAME)): return os.path.join('instance', DB_NAME)
     else: return None
 
-def pulisci_codice(valore):
-    try:
-        if pd.isna(valore): return None
-        if isinstance(valore, float): valore = int(valore)
-        return str(valore).strip()
-    except:
-        return str(valore).strip()
+# ==============================================================================
+# NORMALIZZAZIONE "A COLONNE" (pandas)
+# ==============================================================================
+# Nel file gli stessi codici e le stesse date si ripetono migliaia di volte:
+# puliamo ogni valore DISTINTO una volta sola e poi lo "spalmiamo" su tutte le righe.
 
-def importa_dati():
-    db_path = get_db_path()
-    if not db_path:
-        print("❌ ERRORE: Database non trovato. Avvia prima 'py app.py'.")
-        return
+def normalizza_colonna(serie, funzione):
+    """Applica funzione() ai soli valori distinti della colonna. I vuoti diventano None."""
+    codici, valori_unici = pd.factorize(serie)
+    puliti = np.array([funzione(v) for v in valori_unici] + [None], dtype=object)
+    return puliti[codici] # codice -1 (vuoto) = ultima posizione = None
+
+def numeri_da_colonna(serie):
+    """Converte in numero accettando anche la virgola decimale ('9,60'). Valori non validi = 0."""
+    if serie.dtype == object:
+        serie = serie.astype(str).str.replace(',', '.', regex=False)
+    return pd.to_numeric(serie, errors='coerce').fillna(0)
 
-    print(f"📂 Apro il file: {NOME_FILE}...")
-    
+def normalizza_foglio(df):
+    """Restituisce un DataFrame con le colonne pulite: cli_cod, cli_nome, prod_cod, prod_nome, data, qta, prezzo."""
+    pulito = pd.DataFrame({
+        'cli_cod': normalizza_colonna(df['Cd_CF'], pulisci_codice),
+        'cli_nome': df['CF_Descrizione'].fillna('').astype(str).str.strip() if 'CF_Descrizione' in df else "",
+        'prod_cod': normalizza_colonna(df['Cd_AR'], pulisci_codice),
+        'prod_nome': df['DORig_Descrizione'].astype(str).str.strip(),
+        'data': normalizza_colonna(df['DataDoc'], data_iso),
+        'qta': numeri_da_colonna(df['Qta']).astype(np.int64),
+        'prezzo': numeri_da_colonna(df['PrezzoUnitarioV']).astype(float),
+    })
+
+    # Righe senza codici (o senza data) non si possono importare
+    validi = pulito['cli_cod'].notna() & pulito['prod_cod'].notna() & pulito['data'].notna()
+    validi &= (pulito['cli_cod'] != 'None') & (pulito['prod_cod'] != 'None')
+    return pulito[validi]
+
+def calcola_impronte(righe, centesimi):
+    """
+    Impronta di ogni riga: SHA-1 di DataDoc|Cd_CF|Cd_AR|Qta|Prezzo|n° ripetizione.
+    Il prezzo entra in CENTESIMI INTERI, come è salvato nel DB: la riga del file e la
+    stessa riga riletta dal DB (righe da adottare) danno così la stessa impronta anche
+    se nel file il prezzo ha più di due decimali.
+    Il numero di ripetizione distingue due righe IDENTICHE nel file (es. due fatture
+    uguali nello stesso giorno): la prima vale 0, la seconda 1, ecc.
+    righe: DataFrame con le colonne data, cli_cod, prod_cod, qta.
+    centesimi: colonna dei prezzi in centesimi (stesso indice di righe).
+    """
+    if righe.empty:
+        return []
+    chiave = (righe['data'].astype(str) + '|' + righe['cli_cod'].astype(str) + '|' + righe['prod_cod'].astype(str)
+              + '|' + righe['qta'].astype(str) + '|' + centesimi.astype(str))
+    return sha1_con_ripetizione(chiave)
+
+def calcola_impronte_euro(righe):
+    """
+    Impronte come erano calcolate prima dei centesimi (prezzo in euro, '{:.4f}').
+    Servono solo a riconoscere le righe importate con quella versione (vedi confronta_righe).
+    """
+    if righe.empty:
+        return []
+    chiave = (righe['data'].astype(str) + '|' + righe['cli_cod'].astype(str) + '|' + righe['prod_cod'].astype(str)
+              + '|' + righe['qta'].astype(str) + '|' + righe['prezzo'].map('{:.4f}'.format))
+    return sha1_con_ripetizione(chiave)
+
+def sha1_con_ripetizione(chiave):
+    """SHA-1 di ogni chiave + "|n° ripetizione" (0 la prima volta, 1 la seconda, ...)."""
+    ripetizione = chiave.groupby(chiave, sort=False).cumcount().astype(str)
+    return [hashlib.sha1(testo.encode('utf-8')).hexdigest() for testo in (chiave + '|' + ripetizione).tolist()]
+
+# ==============================================================================
+# PASSAGGI COMUNI (lettura, prodotti, riepilogo)
+# ==============================================================================
+
+def leggi_righe(nome_file):
+    """
+    Legge e pulisce il foglio a blocchi (vedi lettore_excel.py): in memoria restano
+    solo le colonne già pulite, mai il foglio intero.
+    Restituisce (righe pulite, numero righe del file) oppure None.
+    """
+    print(f"📂 Apro il file: {nome_file}...")
     try:
-        df = pd.read_excel(NOME_FILE, sheet_name=FOGLIO_DA_LEGGERE, engine='openpyxl')
+        puliti = []
+        righe_file = 0
+        for blocco in leggi_blocchi(nome_file, FOGLIO_DA_LEGGERE, COLONNE_DA_LEGGERE):
+            righe_file += len(blocco)
+            puliti.append(normalizza_foglio(pd.DataFrame(blocco, columns=COLONNE_DA_LEGGERE)))
     except Exception as e:
         print(f"❌ Errore lettura Excel: {e}")
+        return None
+
+    if not puliti:
+        return normalizza_foglio(pd.DataFrame(columns=COLONNE_DA_LEGGERE)), 0
+    return pd.concat(puliti, ignore_index=True), righe_file
+
+def separa_clienti_mancanti(righe, map_clienti):
+    """Toglie le righe di clienti che non sono nel DB. Restituisce (righe, codici mancanti, righe saltate)."""
+    cliente_presente = righe['cli_cod'].isin(map_clienti.keys())
+    clienti_mancanti_set = set(righe.loc[~cliente_presente, 'cli_cod'])
+    return righe[cliente_presente], clienti_mancanti_set, int((~cliente_presente).sum())
+
+def confronta_prodotti(cursor, righe):
+    """
+    Prodotti del file confrontati con il DB (una voce per codice).
+    Nome: quello della prima riga in cui compare. Prezzo: quello dell'ultima riga (il più recente).
+    Restituisce (nuovi [(codice, nome, "", prezzo, True)], aggiornati [(prezzo, id)], prodotti_db {codice: (id, prezzo)}),
+    prezzi in centesimi come nel DB.
+    """
+    prodotti_db = {codice: (id_prod, prezzo) for id_prod, codice, prezzo in cursor.execute("SELECT id, codice, prezzo FROM prodotto")}
+    per_prodotto = righe.groupby('prod_cod', sort=False).agg(prod_nome=('prod_nome', 'first'), prezzo=('prezzo', 'last'))
+    centesimi = serie_in_centesimi(per_prodotto['prezzo']).tolist()
+
+    nuovi = [(cod, nome, "", prezzo, True)
+             for cod, nome, prezzo in zip(per_prodotto.index, per_prodotto['prod_nome'], centesimi)
+             if cod not in prodotti_db]
+    aggiornati = [(prezzo, prodotti_db[cod][0])
+                  for cod, prezzo in zip(per_prodotto.index, centesimi)
+                  if cod in prodotti_db and prodotti_db[cod][1] != prezzo]
+    return nuovi, aggiornati, prodotti_db
+
+def scrivi_prezzi(cursor, aggiornati, dal=None):
+    """
+    Aggiunge una versione di listino per ogni prezzo cambiato, valida da 'dal' (default: oggi).
+    aggiornati: [(prezzo, id_prodotto)]. Il trigger della migrazione 6 chiude la versione
+    precedente e aggiorna prodotto.prezzo.
+    """
+    dal = dal or datetime.date.today().isoformat()
+    cursor.executemany("INSERT INTO prezzo_listino (prodotto_id, valido_dal, prezzo) VALUES (?, ?, ?)",
+                       [(id_prod, dal, prezzo) for prezzo, id_prod in aggiornati])
+
+def scrivi_prodotti(cursor, righe):
+    """
+    Crea i prodotti nuovi e registra i prezzi cambiati (una sola scrittura per codice).
+    Va chiamata dentro la transazione. Restituisce (mappa codice -> id, n° nuovi, n° aggiornati).
+    """
+    nuovi, aggiornati, prodotti_db = confronta_prodotti(cursor, righe)
+
+    cursor.executemany("INSERT INTO prodotto (codice, nome, ingredienti, prezzo, attivo) VALUES (?, ?, ?, ?, ?)", nuovi)
+    scrivi_prezzi(cursor, aggiornati)
+
+    if nuovi:
+        map_prodotti = dict(cursor.execute("SELECT codice, id FROM prodotto").fetchall())
+    else:
+        map_prodotti = {codice: dati[0] for codice, dati in prodotti_db.items()}
+    return map_prodotti, len(nuovi), len(aggiornati)
+
+def ricalcola_riepilogo(cursor, mesi=None):
+    """Ricalcola il riepilogo vendite (tutto, o solo i mesi indicati 'YYYY-MM')."""
+    # Solo se la tabella esiste già, altrimenti la crea e riempie l'app al primo avvio
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='riepilogo_vendite'")
+    if not cursor.fetchone():
         return
 
-    conn = sqlite3.connect(db_path)
+    print("📊 Ricalcolo riepilogo vendite per le statistiche...")
+    if mesi is None:
+        for sql in SQL_RICOSTRUZIONE_RIEPILOGO:
+            cursor.execute(sql)
+    else:
+        for mese in sorted(mesi):
+            cursor.execute(SQL_RICOSTRUZIONE_RIEPILOGO_MESE[0], (mese,))
+            cursor.execute(SQL_RICOSTRUZIONE_RIEPILOGO_MESE[1], (mese,))
+
+def ricalcola_ultimi_acquisti(cursor, coppie=None):
+    """Ricalcola l'indice 'chi ha comprato cosa' (tutto, o solo le coppie (cliente_id, prodotto_id))."""
+    if coppie is None:
+        for sql in SQL_RICOSTRUZIONE_ULTIMO_ACQUISTO:
+            cursor.execute(sql)
+    else:
+        parametri = sorted(coppie)
+        for sql in SQL_RICOSTRUZIONE_ULTIMO_ACQUISTO_COPPIA:
+            cursor.executemany(sql, parametri)
+
+def registra_file(cursor, hash_file, nome_file, righe):
+    # Ci segniamo il file: rilanciando lo script con lo stesso file non succede nulla
+    cursor.execute("""
+        INSERT INTO importazione_file (hash_file, nome_file, importato_il, righe) VALUES (?, ?, ?, ?)
+        ON CONFLICT(hash_file) DO UPDATE SET importato_il = excluded.importato_il, righe = excluded.righe
+    """, (hash_file, os.path.basename(nome_file), datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), righe))
+
+def apri_database(nome_file, forza):
+    """
+    Apre il DB (autocommit: le transazioni le apriamo noi con BEGIN/COMMIT) e controlla
+    se il file è già stato importato. Restituisce (conn, hash_file) oppure (None, None).
+    """
+    db_path = get_db_path()
+    if not db_path:
+        print("❌ ERRORE: Database non trovato. Avvia prima 'py app.py'.")
+        return None, None
+
+    conn = apri_connessione(db_path, PRAGMA_IMPORT) # WAL: l'app può continuare a leggere durante l'import
+    applica_migrazioni(conn) # Servono le tabelle importazione_file e riga_importata
+
+    # --- CONTROLLO FILE GIÀ IMPORTATO ---
+    hash_file = calcola_hash_file(nome_file)
+    gia_importato = conn.execute("SELECT importato_il FROM importazione_file WHERE hash_file = ?", (hash_file,)).fetchone()
+    if gia_importato and not forza:
+        print(f"⏭️  Il file {nome_file} è già stato importato il {gia_importato[0]} (stesso contenuto).")
+        print("   Nessuna modifica al database. Usa --forza per reimportarlo comunque.")
+        conn.close()
+        return None, None
+
+    return conn, hash_file
+
+def stampa_clienti_mancanti(clienti_mancanti_set, righe_saltate_per_cliente):
+    if len(clienti_mancanti_set) > 0:
+        print(f"⚠️ ATTENZIONE: Saltate {righe_saltate_per_cliente} righe totali.")
+        print(f"   Causa: {len(clienti_mancanti_set)} Clienti non trovati nel DB.")
+        print("   Codici Clienti Mancanti:")
+        print("   " + ", ".join(sorted(list(clienti_mancanti_set))))
+    else:
+        print("✅ Tutti i clienti del file erano presenti nel DB.")
+
+def stampa_tempi(inizio, fine_lettura, righe_file):
+    fine = time.perf_counter()
+    durata = fine - inizio
+    velocita = righe_file / durata if durata > 0 else 0
+    print("-" * 40)
+    print(f"⏱️  Tempo totale: {durata:.2f}s (lettura Excel {fine_lettura - inizio:.2f}s, elaborazione e scrittura {fine - fine_lettura:.2f}s)")
+    print(f"⚡ Velocità: {velocita:,.0f} righe/secondo")
+    print("="*40)
+
+# ==============================================================================
+# IMPORTAZIONE COMPLETA (un nuovo ordine per ogni data del file)
+# ==============================================================================
+
+def importa_dati(nome_file=NOME_FILE, forza=False):
+    inizio = time.perf_counter()
+    conn, hash_file = apri_database(nome_file, forza)
+    if conn is None:
+        return
     cursor = conn.cursor()
 
+    letto = leggi_righe(nome_file)
+    if letto is None:
+        conn.close()
+        return
+    righe, righe_file = letto
+    righe_scartate = righe_file - len(righe)
+    fine_lettura = time.perf_counter()
+
     print("🚀 Inizio Importazione (Raggruppamento per DATA)...")
     print("ℹ️  I Clienti NON verranno creati. Le righe di clienti mancanti verranno saltate.")
-    
-    # Contatori
-    cnt_prodotti_nuovi = 0
-    cnt_prodotti_aggiornati = 0
-    cnt_ordini_creati = 0      # Ora corrisponderà ai GIORNI di lavoro
-    cnt_righe_inserite = 0
-    
-    # Tracciamento errori
-    clienti_mancanti_set = set()
-    righe_saltate_per_cliente = 0
-
-    # Cache ID (Codice -> ID)
-    map_clienti = {}  
-    map_prodotti = {} 
-
-    # 1. Carico ID esistenti dal DB
-    cursor.execute("SELECT codice, id FROM cliente")
-    for r in cursor.fetchall(): map_clienti[r[0]] = r[1]
-
-    cursor.execute("SELECT codice, id FROM prodotto")
-    for r in cursor.fetchall(): map_prodotti[r[0]] = r[1]
-
-    # Struttura temporanea: Chiave = DATA (Stringa), Valore = Lista di righe (con info cliente)
-    ordini_giornalieri = {} 
-
-    # --- FASE 1: Scansione Righe ---
-    for index, row in df.iterrows():
-        try:
-            # Dati
-            cli_cod = pulisci_codice(row.get('Cd_CF'))
-            prod_cod = pulisci_codice(row.get('Cd_AR'))
-            prod_nome = str(row.get('DORig_Descrizione')).strip()
-            
-            # Data (Chiave fondamentale per raggruppare)
-            raw_data = row.get('DataDoc')
-            if isinstance(raw_data, datetime.datetime):
-                data_iso = raw_data.strftime('%Y-%m-%d')
-            else:
-                data_iso = str(raw_data).split(' ')[0].strip()
-
-            # Numeri
-            try: qta = int(row.get('Qta', 0))
-            except: qta = 0
-            
-            prezzo_raw = row.get('PrezzoUnitarioV', 0)
-            try:
-                if isinstance(prezzo_raw, str): prezzo = float(prezzo_raw.replace(',', '.'))
-                else: prezzo = float(prezzo_raw)
-            except: prezzo = 0.0
-
-            if not cli_cod or not prod_cod or cli_cod == 'None' or prod_cod == 'None':
-                continue
-
-            # --- CONTROLLO CLIENTE ---
-            if cli_cod not in map_clienti:
-                clienti_mancanti_set.add(cli_cod)
-                righe_saltate_per_cliente += 1
-                continue 
-
-            # --- GESTIONE PRODOTTO ---
-            if prod_cod not in map_prodotti:
-                # NUOVO: Lo creo
-                cursor.execute("INSERT INTO prodotto (codice, nome, ingredienti, prezzo, attivo) VALUES (?, ?, ?, ?, ?)", 
-                               (prod_cod, prod_nome, "", prezzo, True))
-                nuovo_id = cursor.lastrowid
-                map_prodotti[prod_cod] = nuovo_id
-                cnt_prodotti_nuovi += 1
-            else:
-                # ESISTENTE: Aggiorno SOLO il prezzo
-                cursor.execute("UPDATE prodotto SET prezzo = ? WHERE id = ?", (prezzo, map_prodotti[prod_cod]))
-                cnt_prodotti_aggiornati += 1
-
-            # --- PREPARAZIONE ORDINE (Raggruppo SOLO per Data) ---
-            if data_iso not in ordini_giornalieri:
-                ordini_giornalieri[data_iso] = []
-            
-            # Aggiungo la riga alla data, ma mi ricordo CHI è il cliente di QUESTA riga
-            ordini_giornalieri[data_iso].append({
-                'cli_id': map_clienti[cli_cod], # Fondamentale!
-                'prod_id': map_prodotti[prod_cod],
-                'qta': qta,
-                'prezzo_storico': prezzo
-            })
-
-        except Exception as e:
-            print(f"⚠️ Errore riga {index}: {e}")
-
-    conn.commit()
-    print(f"✅ Prodotti processati: {cnt_prodotti_nuovi} Nuovi, {cnt_prodotti_aggiornati} Prezzi aggiornati.")
-
-    # --- FASE 2: Creazione Ordini Giornalieri ---
-    print(f"📦 Creazione di {len(ordini_giornalieri)} Ordini Giornalieri...")
-    
-    # Ordino per data così nel DB sono sequenziali
-    for data_cons in sorted(ordini_giornalieri.keys()):
-        righe = ordini_giornalieri[data_cons]
-        
-        # 1. Creo UN SOLO Ordine per questa data
-        cursor.execute("""
-            INSERT INTO ordine (data_consegna, stato, note, ora_creazione) 
-            VALUES (?, ?, ?, ?)
-        """, (data_cons, 'inviato', '', '00-00'))
-        
-        ordine_id = cursor.lastrowid
-        cnt_ordini_creati += 1
-
-        # 2. Inserisco tutte le righe (ognuna col suo cliente)
-        for r in righe:
+
+    # --- FASE 1: Controllo Clienti ---
+    map_clienti = dict(cursor.execute("SELECT codice, id FROM cliente").fetchall())
+    righe, clienti_mancanti_set, righe_saltate_per_cliente = separa_clienti_mancanti(righe, map_clienti)
+
+    # --- PREPARAZIONE ORDINI (Raggruppo SOLO per Data, in ordine di data) ---
+    righe = righe.sort_values('data', kind='stable')
+    date_ordini = righe['data'].unique().tolist()
+
+    # --- FASE 2: Scrittura (UNA transazione: o entra tutto o niente) ---
+    try:
+        cursor.execute("BEGIN")
+
+        map_prodotti, cnt_prodotti_nuovi, cnt_prodotti_aggiornati = scrivi_prodotti(cursor, righe)
+
+        print(f"📦 Creazione di {len(date_ordini)} Ordini Giornalieri...")
+        map_ordini = {}
+        for data_cons in date_ordini:
+            # UN SOLO Ordine per ogni data
             cursor.execute("""
-                INSERT INTO dettaglio_ordine (ordine_id, cliente_id, prodotto_id, quantita, prezzo_storico)
-                VALUES (?, ?, ?, ?, ?)
-            """, (ordine_id, r['cli_id'], r['prod_id'], r['qta'], r['prezzo_storico']))
-            cnt_righe_inserite += 1
+                INSERT INTO ordine (data_consegna, stato, note, ora_creazione)
+                VALUES (?, ?, ?, ?)
+            """, (data_cons, 'inviato', '', ORA_ORDINI_IMPORTATI))
+            map_ordini[data_cons] = cursor.lastrowid
+
+        # Tutte le righe (ognuna col suo cliente) con una sola executemany
+        dettagli = zip(
+            righe['data'].map(map_ordini).tolist(),
+            righe['cli_cod'].map(map_clienti).tolist(),
+            righe['prod_cod'].map(map_prodotti).tolist(),
+            righe['qta'].tolist(),
+            serie_in_centesimi(righe['prezzo']).tolist()  # Nel DB centesimi (migrazione 7)
+        )
+        cursor.executemany("""
+            INSERT INTO dettaglio_ordine (ordine_id, cliente_id, prodotto_id, quantita, prezzo_storico)
+            VALUES (?, ?, ?, ?, ?)
+        """, dettagli)
+
+        # --- FASE 3: Ricalcolo Riepilogo Statistiche e "chi ha comprato cosa" ---
+        ricalcola_riepilogo(cursor)
+        ricalcola_ultimi_acquisti(cursor)
+
+        registra_file(cursor, hash_file, nome_file, len(righe))
+        cursor.execute("COMMIT")
+    except Exception as e:
+        cursor.execute("ROLLBACK")
+        print(f"❌ Errore durante la scrittura, nessuna modifica salvata: {e}")
+        conn.close()
+        return
 
-    conn.commit()
     conn.close()
 
     print("\n" + "="*40)
@@ -162,19 +327,247 @@ def importa_dati():
     print("="*40)
     print(f"📦 Prodotti Nuovi Creati:     {cnt_prodotti_nuovi}")
     print(f"💲 Prezzi Prodotti Aggiornati: {cnt_prodotti_aggiornati}")
-    print(f"📅 Ordini (Giorni) Creati:    {cnt_ordini_creati}")
-    print(f"📝 Righe Totali Inserite:     {cnt_righe_inserite}")
+    print(f"📅 Ordini (Giorni) Creati:    {len(date_ordini)}")
+    print(f"📝 Righe Totali Inserite:     {len(righe)}")
+    if righe_scartate:
+        print(f"🗑️  Righe senza codici/data:   {righe_scartate}")
     print("-" * 40)
-    
-    if len(clienti_mancanti_set) > 0:
-        print(f"⚠️ ATTENZIONE: Saltate {righe_saltate_per_cliente} righe totali.")
-        print(f"   Causa: {len(clienti_mancanti_set)} Clienti non trovati nel DB.")
-        print("   Codici Clienti Mancanti:")
-        print("   " + ", ".join(sorted(list(clienti_mancanti_set))))
-    else:
-        print("✅ Tutti i clienti del file erano presenti nel DB.")
-        
+    stampa_clienti_mancanti(clienti_mancanti_set, righe_saltate_per_cliente)
+    stampa_tempi(inizio, fine_lettura, righe_file)
+
+# ==============================================================================
+# IMPORTAZIONE INCREMENTALE (solo righe nuove o cambiate)
+# ==============================================================================
+# Il file della sede contiene SEMPRE tutto l'anno. Ogni riga ha un'impronta salvata
+# nella tabella 'riga_importata' insieme all'id della riga d'ordine creata, così:
+#   - impronta già nota            -> riga saltata
+#   - impronta nuova               -> riga aggiunta all'ordine importato di quel giorno
+#   - impronta sparita dal file    -> la sede l'ha corretta/tolta: la riga viene eliminata
+#     (solo per le date coperte dal file)
+# Una riga "cambiata" (es. quantità corretta) è quindi una rimozione + un'aggiunta.
+#
+# Primo giro su un DB già caricato con l'import completo: le righe esistenti negli
+# ordini importati (ora '00-00') vengono "adottate" (collegate alla loro impronta)
+# invece di essere reinserite, così non si crea nessun doppione.
+
+def righe_da_adottare(cursor, date):
+    """Righe degli ordini importati in quelle date che non hanno ancora un'impronta."""
+    if not date:
+        return pd.DataFrame(columns=['id', 'data', 'cli_cod', 'prod_cod', 'qta', 'centesimi'])
+
+    segnaposto = ",".join("?" * len(date))
+    return pd.read_sql_query(f"""
+        SELECT d.id, o.data_consegna AS data, c.codice AS cli_cod, p.codice AS prod_cod,
+               d.quantita AS qta, COALESCE(d.prezzo_storico, 0) AS centesimi
+        FROM dettaglio_ordine d
+        JOIN ordine o ON o.id = d.ordine_id
+        JOIN cliente c ON c.id = d.cliente_id
+        JOIN prodotto p ON p.id = d.prodotto_id
+        WHERE o.ora_creazione = ? AND o.data_consegna IN ({segnaposto})
+          AND NOT EXISTS (SELECT 1 FROM riga_importata r WHERE r.dettaglio_id = d.id)
+        ORDER BY d.id
+    """, cursor.connection, params=[ORA_ORDINI_IMPORTATI] + list(date))
+
+def confronta_righe(cursor, righe):
+    """
+    Confronta le impronte del file con quelle già importate (nessuna scrittura).
+    righe: righe pulite, già senza clienti mancanti e non vuote.
+    Restituisce un dizionario con:
+      'righe'     -> le righe ordinate per data con la colonna 'impronta'
+      'nuove'     -> righe da inserire
+      'sparite'   -> impronte da togliere (la sede le ha tolte o corrette)
+      'adottate'  -> [(impronta, data, id riga)] righe già nel DB da collegare
+      'rinominate' -> [(impronta, impronta in euro)] righe note con l'impronta vecchia
+      'data_min' / 'data_max' -> periodo coperto dal file
+    """
+    righe = righe.sort_values('data', kind='stable').copy()
+    righe['impronta'] = calcola_impronte(righe, serie_in_centesimi(righe['prezzo']))
+
+    data_min, data_max = righe['data'].min(), righe['data'].max()
+    gia_note = dict(cursor.execute(
+        "SELECT impronta, dettaglio_id FROM riga_importata WHERE data_doc BETWEEN ? AND ?", (data_min, data_max)
+    ).fetchall())
+    nota = righe['impronta'].isin(gia_note.keys())
+
+    # Compatibilità: le righe importate prima dei centesimi hanno l'impronta col prezzo
+    # in euro. Se la riga c'è ancora, l'impronta salvata viene solo aggiornata.
+    rinominate = []
+    if gia_note and not nota.all():
+        impronte_euro = pd.Series(calcola_impronte_euro(righe), index=righe.index)
+        vecchia = ~nota & impronte_euro.isin(gia_note.keys())
+        rinominate = list(zip(righe.loc[vecchia, 'impronta'], impronte_euro[vecchia]))
+        nota |= vecchia
+
+    nuove = righe[~nota]
+    sparite = set(gia_note.keys()) - set(righe['impronta'].tolist()) - set(euro for _, euro in rinominate)
+
+    # Righe già presenti nel DB ma senza impronta (vedi sopra)
+    adottate = []
+    if not nuove.empty:
+        esistenti = righe_da_adottare(cursor, nuove['data'].unique().tolist())
+        if not esistenti.empty:
+            esistenti['impronta'] = calcola_impronte(esistenti, esistenti['centesimi'])
+            id_per_impronta = dict(zip(esistenti['impronta'], esistenti['id'].tolist()))
+            da_adottare = nuove['impronta'].isin(id_per_impronta.keys())
+            adottate = [(imp, data, id_per_impronta[imp])
+                        for imp, data in zip(nuove.loc[da_adottare, 'impronta'], nuove.loc[da_adottare, 'data'])]
+            nuove = nuove[~da_adottare]
+
+    return {'righe': righe, 'nuove': nuove, 'sparite': sparite, 'adottate': adottate, 'rinominate': rinominate,
+            'data_min': data_min, 'data_max': data_max}
+
+def scrivi_righe(cursor, confronto, map_clienti, map_prodotti):
+    """
+    Applica il risultato di confronta_righe() (dentro la transazione) e ricalcola il
+    riepilogo dei soli mesi toccati e gli ultimi acquisti delle sole coppie
+    (cliente, prodotto) toccate. Restituisce (ordini creati, righe inserite).
+    """
+    nuove, sparite, adottate = confronto['nuove'], confronto['sparite'], confronto['adottate']
+    mesi_toccati = set(d[:7] for d in nuove['data'])
+    coppie_toccate = set()
+
+    cursor.executemany("INSERT INTO riga_importata (impronta, data_doc, dettaglio_id) VALUES (?, ?, ?)", adottate)
+    cursor.executemany("UPDATE riga_importata SET impronta = ? WHERE impronta = ?", confronto['rinominate'])
+
+    # Righe tolte o corrette dalla sede
+    if sparite:
+        elenco_sparite = [(imp,) for imp in sparite]
+        segnaposto = ','.join('?' * len(sparite))
+        for (data,) in cursor.execute(
+            f"SELECT DISTINCT data_doc FROM riga_importata WHERE impronta IN ({segnaposto})", list(sparite)
+        ).fetchall():
+            mesi_toccati.add(data[:7])
+        coppie_toccate.update(cursor.execute(f"""
+            SELECT DISTINCT d.cliente_id, d.prodotto_id FROM dettaglio_ordine d
+            JOIN riga_importata r ON r.dettaglio_id = d.id WHERE r.impronta IN ({segnaposto})
+        """, list(sparite)).fetchall())
+        cursor.executemany("""
+            DELETE FROM dettaglio_ordine WHERE id = (SELECT dettaglio_id FROM riga_importata WHERE impronta = ?)
+        """, elenco_sparite)
+        cursor.executemany("DELETE FROM riga_importata WHERE impronta = ?", elenco_sparite)
+
+    # Ordini importati già esistenti per le date delle righe nuove (uno per giorno)
+    date_nuove = nuove['data'].unique().tolist()
+    map_ordini = {}
+    if date_nuove:
+        segnaposto = ",".join("?" * len(date_nuove))
+        for data, ordine_id in cursor.execute(f"""
+            SELECT data_consegna, MIN(id) FROM ordine
+            WHERE ora_creazione = ? AND data_consegna IN ({segnaposto})
+            GROUP BY data_consegna
+        """, [ORA_ORDINI_IMPORTATI] + date_nuove).fetchall():
+            map_ordini[data] = ordine_id
+
+    cnt_ordini_creati = 0
+    for data_cons in date_nuove:
+        if data_cons not in map_ordini:
+            cursor.execute("""
+                INSERT INTO ordine (data_consegna, stato, note, ora_creazione)
+                VALUES (?, ?, ?, ?)
+            """, (data_cons, 'inviato', '', ORA_ORDINI_IMPORTATI))
+            map_ordini[data_cons] = cursor.lastrowid
+            cnt_ordini_creati += 1
+
+    # Righe nuove in blocco. Gli id creati servono per le impronte: dentro la transazione
+    # (BEGIN IMMEDIATE, nessun altro scrive) SQLite li assegna in sequenza dopo il massimo
+    # attuale, quindi si rileggono con una sola query nello stesso ordine dell'inserimento.
+    clienti_id = nuove['cli_cod'].map(map_clienti).tolist()
+    prodotti_id = nuove['prod_cod'].map(map_prodotti).tolist()
+    max_id_prima = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM dettaglio_ordine").fetchone()[0]
+    cursor.executemany("""
+        INSERT INTO dettaglio_ordine (ordine_id, cliente_id, prodotto_id, quantita, prezzo_storico)
+        VALUES (?, ?, ?, ?, ?)
+    """, zip(nuove['data'].map(map_ordini).tolist(), clienti_id, prodotti_id,
+             nuove['qta'].tolist(), serie_in_centesimi(nuove['prezzo']).tolist()))
+    id_nuovi = [r[0] for r in cursor.execute("SELECT id FROM dettaglio_ordine WHERE id > ? ORDER BY id", (max_id_prima,))]
+    impronte_nuove = list(zip(nuove['impronta'], nuove['data'], id_nuovi))
+    cursor.executemany("INSERT INTO riga_importata (impronta, data_doc, dettaglio_id) VALUES (?, ?, ?)", impronte_nuove)
+    coppie_toccate.update(zip(clienti_id, prodotti_id))
+
+    # Ordini importati (nel periodo del file) rimasti senza righe
+    cursor.execute("""
+        DELETE FROM ordine WHERE ora_creazione = ? AND data_consegna BETWEEN ? AND ?
+        AND NOT EXISTS (SELECT 1 FROM dettaglio_ordine d WHERE d.ordine_id = ordine.id)
+    """, (ORA_ORDINI_IMPORTATI, confronto['data_min'], confronto['data_max']))
+
+    # Riepilogo solo per i mesi toccati
+    if mesi_toccati:
+        ricalcola_riepilogo(cursor, mesi_toccati)
+    if coppie_toccate:
+        ricalcola_ultimi_acquisti(cursor, coppie_toccate)
+
+    return cnt_ordini_creati, len(impronte_nuove)
+
+def importa_incrementale(nome_file=NOME_FILE, forza=False):
+    inizio = time.perf_counter()
+    conn, hash_file = apri_database(nome_file, forza)
+    if conn is None:
+        return
+    cursor = conn.cursor()
+
+    letto = leggi_righe(nome_file)
+    if letto is None:
+        conn.close()
+        return
+    righe, righe_file = letto
+    fine_lettura = time.perf_counter()
+
+    print("🔁 Importazione INCREMENTALE (solo righe nuove o cambiate)...")
+    if righe.empty:
+        print("⚠️ Nessuna riga valida nel file: niente da importare.")
+        conn.close()
+        return
+
+    # Confronto e scrittura nella STESSA transazione (come importa.py --commit): con
+    # BEGIN IMMEDIATE nessuno può cambiare il DB tra il confronto e la scrittura.
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        map_clienti = dict(cursor.execute("SELECT codice, id FROM cliente").fetchall())
+        righe, clienti_mancanti_set, righe_saltate_per_cliente = separa_clienti_mancanti(righe, map_clienti)
+
+        # --- FASE 1: Confronto impronte file <-> DB ---
+        confronto = confronta_righe(cursor, righe)
+
+        # --- FASE 2: Scrittura ---
+        map_prodotti, cnt_prodotti_nuovi, cnt_prodotti_aggiornati = scrivi_prodotti(cursor, righe)
+        cnt_ordini_creati, cnt_righe_inserite = scrivi_righe(cursor, confronto, map_clienti, map_prodotti)
+        registra_file(cursor, hash_file, nome_file, len(righe))
+        cursor.execute("COMMIT")
+    except Exception as e:
+        cursor.execute("ROLLBACK")
+        print(f"❌ Errore durante la scrittura, nessuna modifica salvata: {e}")
+        conn.close()
+        return
+
+    conn.close()
+
+    print("\n" + "="*40)
+    print("🏆 IMPORTAZIONE INCREMENTALE COMPLETATA")
     print("="*40)
+    print(f"📦 Prodotti Nuovi Creati:     {cnt_prodotti_nuovi}")
+    print(f"💲 Prezzi Prodotti Aggiornati: {cnt_prodotti_aggiornati}")
+    print(f"📅 Ordini (Giorni) Creati:    {cnt_ordini_creati}")
+    print(f"📝 Righe Nuove Inserite:      {cnt_righe_inserite}")
+    print(f"🗑️  Righe Tolte/Corrette:      {len(confronto['sparite'])}")
+    print(f"🔗 Righe Già Presenti Collegate: {len(confronto['adottate'])}")
+    print(f"✔️  Righe Invariate:           {len(righe) - cnt_righe_inserite - len(confronto['adottate'])}")
+    print("-" * 40)
+    stampa_clienti_mancanti(clienti_mancanti_set, righe_saltate_per_cliente)
+    stampa_tempi(inizio, fine_lettura, righe_file)
 
 if __name__ == "__main__":
-    importa_dati()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Importa lo storico vendite dall'Excel della sede.")
+    parser.add_argument('--file', default=NOME_FILE, help=f"File Excel da importare (default: {NOME_FILE})")
+    parser.add_argument('--forza', action='store_true', help="Importa anche se lo stesso file è già stato importato")
+    parser.add_argument('--incrementale', action='store_true',
+                        help="Aggiunge solo le righe nuove o cambiate agli ordini già importati (consigliato per l'export mensile)")
+    argomenti = parser.parse_args()
+
+    if not os.path.exists(argomenti.file):
+        print(f"❌ ERRORE: File {argomenti.file} non trovato.")
+        sys.exit(1)
+
+    if argomenti.incrementale:
+        importa_incrementale(argomenti.file, argomenti.forza)
+    else:
+        importa_dati(argomenti.file, argomenti.forza)
@@ -0,0 +1,244 @@
+import os
+import sys
+import math
+import hashlib
+import time
+import datetime
+import argparse
+import tracemalloc
+
+from openpyxl import load_workbook
+
+# ==============================================================================
+# LETTORE EXCEL "IN STREAMING" PER GLI SCRIPT DI IMPORTAZIONE
+# ==============================================================================
+# pd.read_excel() carica TUTTO il foglio e costruisce un DataFrame completo prima
+# di poter elaborare una sola riga. Qui invece il file viene aperto in sola
+# lettura (openpyxl read_only) e le righe arrivano a blocchi di dimensione fissa:
+# in memoria c'è un blocco alla volta, non tutto il foglio. (Resta solo lo
+# "scheletro" XML che openpyxl si tiene per ogni riga letta, circa 80 byte a riga:
+# 500.000 righe -> ~45 MB invece di ~280 MB con pd.read_excel.)
+#
+# Due modi d'uso:
+#   leggi_blocchi(...)  -> blocchi di tuple con i valori GREZZI delle colonne scelte
+#                          (per chi poi li pulisce "a colonne" con pandas)
+#   leggi_record(...)   -> blocchi di dizionari già puliti secondo uno SCHEMA
+#
+# Benchmark:  py lettore_excel.py --benchmark 500000
+
+DIMENSIONE_BLOCCO = 5000
+
+# --- FUNZIONI DI PULIZIA (un valore di cella -> valore tipizzato) ---
+
+def vuoto(valore):
+    return valore is None or (isinstance(valore, float) and math.isnan(valore))
+
+def pulisci_codice(valore):
+    """Pulisce il codice da spazi e formati strani (es. 100.0 diventa 100)"""
+    try:
+        if vuoto(valore): return None
+        if isinstance(valore, float): valore = int(valore)
+        return str(valore).strip()
+    except:
+        return str(valore).strip()
+
+def testo(valore):
+    if vuoto(valore): return ""
+    return str(valore).strip()
+
+def intero(valore):
+    try: return int(valore)
+    except: return 0
+
+def decimale(valore):
+    """Accetta anche la virgola decimale ('9,60'). Valori non validi = 0.0"""
+    try:
+        if isinstance(valore, str): return float(valore.replace(',', '.'))
+        if vuoto(valore): return 0.0
+        return float(valore)
+    except:
+        return 0.0
+
+def data_iso(valore):
+    if vuoto(valore): return None
+    if isinstance(valore, datetime.datetime):
+        return valore.strftime('%Y-%m-%d')
+    return str(valore).split(' ')[0].strip()
+
+# --- SCHEMI DEI FILE (colonna Excel -> (nome campo, funzione di pulizia)) ---
+
+# Export vendite della sede (tab_ag_15_cli_art_2025.xlsx, foglio 'Scriptare')
+SCHEMA_VENDITE = {
+    'DataDoc': ('data', data_iso),
+    'Cd_CF': ('cli_cod', pulisci_codice),
+    'CF_Descrizione': ('cli_nome', testo),
+    'Cd_AR': ('prod_cod', pulisci_codice),
+    'DORig_Descrizione': ('prod_nome', testo),
+    'Qta': ('qta', intero),
+    'PrezzoUnitarioV': ('prezzo', decimale),
+}
+
+# Listino convertito dal PDF (listino_convertito.xlsx)
+SCHEMA_LISTINO = {
+    'Codice': ('codice', pulisci_codice),
+    'Nome Prodotto': ('nome', testo),
+    'Prezzo_Listino': ('prezzo', decimale),
+}
+
+# ==============================================================================
+# LETTURA
+# ==============================================================================
+
+def leggi_blocchi(percorso, foglio=None, colonne=None, dimensione_blocco=DIMENSIONE_BLOCCO):
+    """
+    Apre il file e controlla SUBITO l'intestazione (errori qui, non a metà lettura).
+    Restituisce un generatore di blocchi (liste) di tuple con i valori delle colonne
+    richieste, nell'ordine di 'colonne' (tutte se None). Le righe completamente vuote
+    vengono saltate.
+    """
+    wb = load_workbook(percorso, read_only=True, data_only=True)
+    try:
+        if foglio is None:
+            ws = wb.worksheets[0]
+        elif foglio in wb.sheetnames:
+            ws = wb[foglio]
+        else:
+            raise ValueError(f"Non trovo il foglio '{foglio}' (fogli presenti: {', '.join(wb.sheetnames)})")
+
+        righe = ws.iter_rows(values_only=True)
+        intestazione = [str(v).strip() if v is not None else "" for v in next(righe, ())]
+
+        if colonne is None:
+            colonne = [c for c in intestazione if c]
+        mancanti = [c for c in colonne if c not in intestazione]
+        if mancanti:
+            raise ValueError(f"Colonne mancanti nel foglio: {', '.join(mancanti)}")
+        posizioni = [intestazione.index(c) for c in colonne]
+    except Exception:
+        wb.close()
+        raise
+
+    def generatore():
+        try:
+            blocco = []
+            for riga in righe:
+                valori = tuple(riga[p] if p < len(riga) else None for p in posizioni)
+                if all(v is None for v in valori):
+                    continue
+                blocco.append(valori)
+                if len(blocco) >= dimensione_blocco:
+                    yield blocco
+                    blocco = []
+            if blocco:
+                yield blocco
+        finally:
+            wb.close()
+
+    return generatore()
+
+def leggi_record(percorso, schema, foglio=None, dimensione_blocco=DIMENSIONE_BLOCCO):
+    """
+    Come leggi_blocchi(), ma ogni riga diventa un dizionario {nome campo: valore pulito}
+    secondo lo schema (es. SCHEMA_VENDITE, SCHEMA_LISTINO).
+    """
+    colonne = list(schema.keys())
+    campi = [schema[c] for c in colonne]
+    blocchi = leggi_blocchi(percorso, foglio, colonne, dimensione_blocco)
+
+    def generatore():
+        for blocco in blocchi:
+            yield [{nome: funzione(valore) for (nome, funzione), valore in zip(campi, riga)} for riga in blocco]
+
+    return generatore()
+
+def calcola_hash_file(percorso):
+    """
+    SHA-256 del contenuto del file, letto a pezzi da 1 MB. Usato da importa*.py
+    (stesso file non importato due volte, cache) e da converti_pdf_excel.py (cache per pagina).
+    """
+    sha = hashlib.sha256()
+    with open(percorso, 'rb') as f:
+        for blocco in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(blocco)
+    return sha.hexdigest()
+
+# ==============================================================================
+# BENCHMARK (pd.read_excel contro lettura a blocchi)
+# ==============================================================================
+
+def crea_file_prova(percorso, num_righe):
+    """Foglio 'Scriptare' sintetico con le stesse colonne dell'export della sede."""
+    import random
+    from openpyxl import Workbook
+
+    random.seed(0)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Scriptare')
+    ws.append(list(SCHEMA_VENDITE.keys()))
+    inizio = datetime.datetime(2025, 1, 1)
+    for _ in range(num_righe):
+        ws.append([
+            inizio + datetime.timedelta(days=random.randrange(360)),
+            random.randrange(1, 400),
+            "CLIENTE DI PROVA",
+            random.randrange(1000, 300000),
+            "PRODOTTO DI PROVA 25g*    240pz",
+            random.randrange(1, 10),
+            random.randrange(100, 5000) / 100,
+        ])
+    wb.save(percorso)
+
+def misura(funzione):
+    """Esegue funzione() e restituisce (risultato, secondi, picco di memoria Python in MB)."""
+    tracemalloc.start()
+    inizio = time.perf_counter()
+    risultato = funzione()
+    durata = time.perf_counter() - inizio
+    picco = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    tracemalloc.stop()
+    return risultato, durata, picco
+
+def benchmark(num_righe, percorso=None):
+    import pandas as pd
+
+    percorso = percorso or f"prova_lettore_{num_righe}.xlsx"
+    if not os.path.exists(percorso):
+        print(f"🛠️  Creo il file di prova {percorso} ({num_righe:,} righe)...")
+        crea_file_prova(percorso, num_righe)
+
+    def con_pandas():
+        df = pd.read_excel(percorso, sheet_name='Scriptare', engine='openpyxl')
+        return len(df), float((df['Qta'] * df['PrezzoUnitarioV']).sum())
+
+    def a_blocchi():
+        righe, totale = 0, 0.0
+        for blocco in leggi_record(percorso, SCHEMA_VENDITE, foglio='Scriptare'):
+            righe += len(blocco)
+            totale += sum(r['qta'] * r['prezzo'] for r in blocco)
+        return righe, totale
+
+    print("⏳ pd.read_excel...")
+    (righe_pd, totale_pd), tempo_pd, memoria_pd = misura(con_pandas)
+    print("⏳ lettura a blocchi...")
+    (righe_bl, totale_bl), tempo_bl, memoria_bl = misura(a_blocchi)
+
+    print("\n" + "="*50)
+    print(f"📊 BENCHMARK LETTURA ({righe_pd:,} righe)")
+    print("="*50)
+    print(f"pd.read_excel:     {tempo_pd:7.1f}s   picco memoria {memoria_pd:8.1f} MB")
+    print(f"lettura a blocchi: {tempo_bl:7.1f}s   picco memoria {memoria_bl:8.1f} MB")
+    print(f"Stesso risultato: {'✅' if righe_pd == righe_bl and abs(totale_pd - totale_bl) < 0.01 else '❌'}")
+    print("(Memoria misurata con tracemalloc: solo gli oggetti Python, i tempi sono più lenti del normale)")
+    print("="*50)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lettore Excel a blocchi per gli script di importazione.")
+    parser.add_argument('--benchmark', type=int, metavar='RIGHE', help="Confronta pd.read_excel e lettura a blocchi su un file sintetico")
+    parser.add_argument('--file', help="File di prova da usare (viene creato se non esiste)")
+    argomenti = parser.parse_args()
+
+    if argomenti.benchmark:
+        benchmark(argomenti.benchmark, argomenti.file)
+    else:
+        parser.print_help()
+        sys.exit(1)
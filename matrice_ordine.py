@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# MATRICE ORDINE (Prodotti x Clienti)
+# ==============================================================================
+# Usata sia dal PDF di anteprima sia dall'Excel dello storico.
+# Prende le righe dell'ordine e restituisce una tabella "densa" (array NumPy)
+# con le quantità, gli assi già ordinati per nome e i totali già calcolati.
+
+def separa_nome_codice(testo):
+    """Trasforma "Nome (Cod. X)" in (nome, codice). Senza codice restituisce (testo, "N/D")."""
+    if ' (' in testo:
+        parti = testo.split(' (Cod. ')
+        nome = parti[0]
+        codice = parti[1].replace(')', '') if len(parti) > 1 else "N/D"
+        return nome, codice
+    return testo, "N/D"
+
+def asse_ordinato(ids, anagrafica):
+    """
+    ids: array di id (una voce per riga d'ordine).
+    Restituisce (posizione di ogni riga sull'asse, elenco {'id', 'nome', 'codice'} ordinato per nome).
+    A parità di nome vale l'ordine di prima comparsa (come il sorted() di Python).
+    """
+    codici_riga, ids_unici = pd.factorize(ids)
+    nomi = np.array([anagrafica[i]['nome'] for i in ids_unici], dtype=object)
+
+    ordine = np.argsort(nomi, kind='stable')
+    posizione = np.empty(len(ordine), dtype=np.int64)
+    posizione[ordine] = np.arange(len(ordine))
+
+    elenco = [{'id': ids_unici[k], 'nome': anagrafica[ids_unici[k]]['nome'], 'codice': anagrafica[ids_unici[k]]['codice']}
+              for k in ordine]
+    return posizione[codici_riga], elenco
+
+def costruisci_matrice(cliente_ids, prodotto_ids, quantita, clienti, prodotti):
+    """
+    cliente_ids, prodotto_ids, quantita: sequenze parallele, una voce per riga d'ordine.
+    clienti, prodotti: dizionari id -> {'nome', 'codice'} (basta una voce per id).
+    Se lo stesso prodotto compare più volte per lo stesso cliente, le quantità si sommano.
+
+    Restituisce un dizionario:
+      'clienti'          -> lista di {'id', 'nome', 'codice'} ordinata per nome (colonne)
+      'prodotti'         -> lista di {'id', 'nome', 'codice'} ordinata per nome (righe)
+      'quantita'         -> array NumPy [prodotti x clienti] (0 = niente)
+      'totali_prodotti'  -> totale di ogni riga (prodotto)
+      'totali_clienti'   -> totale di ogni colonna (cliente)
+      'totale'           -> totale generale
+    """
+    pos_cliente, elenco_clienti = asse_ordinato(np.array(cliente_ids, dtype=object), clienti)
+    pos_prodotto, elenco_prodotti = asse_ordinato(np.array(prodotto_ids, dtype=object), prodotti)
+    num_clienti, num_prodotti = len(elenco_clienti), len(elenco_prodotti)
+
+    # Ogni cella (prodotto, cliente) diventa un indice "piatto": bincount somma tutte le quantità in un colpo
+    celle = pos_prodotto * num_clienti + pos_cliente
+    qta_righe = np.asarray(quantita, dtype=np.int64)
+    matrice = np.bincount(celle, weights=qta_righe, minlength=num_prodotti * num_clienti)
+    matrice = matrice.astype(np.int64).reshape(num_prodotti, num_clienti)
+
+    totali_prodotti = matrice.sum(axis=1)
+    totali_clienti = matrice.sum(axis=0)
+
+    return {
+        'clienti': elenco_clienti,
+        'prodotti': elenco_prodotti,
+        'quantita': matrice,
+        'totali_prodotti': totali_prodotti,
+        'totali_clienti': totali_clienti,
+        'totale': int(totali_prodotti.sum())
+    }
@@ -0,0 +1,327 @@
+import os
+
+from connessione_db import apri_connessione
+
+# ==============================================================================
+# MIGRAZIONI DATABASE
+# ==============================================================================
+# db.create_all() crea le tabelle mancanti ma NON modifica quelle esistenti
+# (niente indici nuovi, niente colonne nuove). Qui teniamo l'elenco numerato
+# delle modifiche da applicare ai database già in uso.
+# Il numero dell'ultima migrazione applicata viene salvato dentro il file
+# stesso con PRAGMA user_version, quindi ogni migrazione gira UNA volta sola.
+#
+# Uso manuale:  py migrazioni.py
+# (L'app le applica comunque da sola all'avvio.)
+
+DB_NAME = 'gestionale.db'
+
+# Ogni migrazione: (numero, descrizione, lista di istruzioni SQL)
+# ATTENZIONE: non modificare mai una migrazione già rilasciata, aggiungerne una nuova in fondo.
+# Per questo l'SQL è scritto qui per esteso e non preso da models.py (che può cambiare).
+MIGRAZIONI = [
+    (1, "Indici su dettaglio_ordine e ordine", [
+        "CREATE INDEX IF NOT EXISTS ix_dettaglio_ordine_ordine_id ON dettaglio_ordine (ordine_id)",
+        "CREATE INDEX IF NOT EXISTS ix_dettaglio_ordine_prodotto_id ON dettaglio_ordine (prodotto_id)",
+        "CREATE INDEX IF NOT EXISTS ix_dettaglio_cliente_prodotto_ordine ON dettaglio_ordine (cliente_id, prodotto_id, ordine_id, quantita)",
+        "CREATE INDEX IF NOT EXISTS ix_ordine_data_consegna_stato ON ordine (data_consegna, stato)",
+        "ANALYZE",
+    ]),
+    (2, "Registro dei file importati (impronta del contenuto)", [
+        """CREATE TABLE IF NOT EXISTS importazione_file (
+            id INTEGER NOT NULL PRIMARY KEY,
+            hash_file VARCHAR(64) NOT NULL UNIQUE,
+            nome_file VARCHAR(255) NOT NULL,
+            importato_il DATETIME NOT NULL,
+            righe INTEGER NOT NULL
+        )""",
+    ]),
+    (3, "Impronte delle righe importate (import incrementale)", [
+        """CREATE TABLE IF NOT EXISTS riga_importata (
+            impronta VARCHAR(40) NOT NULL PRIMARY KEY,
+            data_doc VARCHAR(10) NOT NULL,
+            dettaglio_id INTEGER
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_riga_importata_data_doc ON riga_importata (data_doc)",
+    ]),
+    (4, "Ricerca prodotti (FTS5) e indice 'chi ha comprato cosa'", [
+        # Indice full-text sui campi di prodotto: il testo resta nella tabella prodotto
+        # (content=...), i trigger tengono l'indice allineato anche con gli import "raw"
+        """CREATE VIRTUAL TABLE IF NOT EXISTS prodotto_fts USING fts5(
+            nome, codice, ingredienti,
+            content='prodotto', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS prodotto_fts_inserimento AFTER INSERT ON prodotto BEGIN
+            INSERT INTO prodotto_fts (rowid, nome, codice, ingredienti) VALUES (new.id, new.nome, new.codice, new.ingredienti);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS prodotto_fts_eliminazione AFTER DELETE ON prodotto BEGIN
+            INSERT INTO prodotto_fts (prodotto_fts, rowid, nome, codice, ingredienti) VALUES ('delete', old.id, old.nome, old.codice, old.ingredienti);
+        END""",
+        # Solo se cambiano i campi indicizzati (gli aggiornamenti del listino toccano solo il prezzo)
+        """CREATE TRIGGER IF NOT EXISTS prodotto_fts_modifica AFTER UPDATE OF nome, codice, ingredienti ON prodotto BEGIN
+            INSERT INTO prodotto_fts (prodotto_fts, rowid, nome, codice, ingredienti) VALUES ('delete', old.id, old.nome, old.codice, old.ingredienti);
+            INSERT INTO prodotto_fts (rowid, nome, codice, ingredienti) VALUES (new.id, new.nome, new.codice, new.ingredienti);
+        END""",
+        "INSERT INTO prodotto_fts (prodotto_fts) VALUES ('rebuild')",
+        """CREATE TABLE IF NOT EXISTS ultimo_acquisto (
+            prodotto_id INTEGER NOT NULL,
+            cliente_id INTEGER NOT NULL,
+            ultima_data DATE NOT NULL,
+            ultima_quantita INTEGER NOT NULL,
+            quantita_totale INTEGER NOT NULL,
+            PRIMARY KEY (prodotto_id, cliente_id),
+            FOREIGN KEY(prodotto_id) REFERENCES prodotto (id),
+            FOREIGN KEY(cliente_id) REFERENCES cliente (id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_ultimo_acquisto_prodotto_data ON ultimo_acquisto (prodotto_id, ultima_data)",
+        # Riempimento iniziale (testo copiato da models.py com'era al rilascio: se la query
+        # dell'app cambia, questa migrazione resta quella già applicata agli altri DB)
+        "DELETE FROM ultimo_acquisto",
+        """INSERT INTO ultimo_acquisto (prodotto_id, cliente_id, ultima_data, ultima_quantita, quantita_totale)
+           SELECT prodotto_id, cliente_id, data_consegna, quantita, totale FROM (
+               SELECT d.prodotto_id, d.cliente_id, o.data_consegna, SUM(d.quantita) AS quantita,
+                      SUM(SUM(d.quantita)) OVER (PARTITION BY d.cliente_id, d.prodotto_id) AS totale,
+                      ROW_NUMBER() OVER (PARTITION BY d.cliente_id, d.prodotto_id
+                                         ORDER BY o.data_consegna DESC, o.id DESC) AS posizione
+               FROM dettaglio_ordine d
+               JOIN ordine o ON o.id = d.ordine_id
+               WHERE COALESCE(o.stato, '') != 'cancellato'
+               GROUP BY d.cliente_id, d.prodotto_id, o.id
+           ) WHERE posizione = 1""",
+    ]),
+    (5, "Versione del catalogo prodotti (copia nel browser aggiornata a differenze)", [
+        # Contatore unico che cresce a ogni modifica del catalogo; versione_eliminazione
+        # ricorda l'ultima cancellazione vera (le differenze non possono descriverla)
+        """CREATE TABLE IF NOT EXISTS catalogo_versione (
+            id INTEGER NOT NULL PRIMARY KEY CHECK (id = 1),
+            versione INTEGER NOT NULL,
+            versione_eliminazione INTEGER NOT NULL
+        )""",
+        "INSERT OR IGNORE INTO catalogo_versione (id, versione, versione_eliminazione) VALUES (1, 1, 0)",
+        # Versione dell'ultima modifica di ogni prodotto (fuori dal modello: la gestiscono i trigger)
+        "ALTER TABLE prodotto ADD COLUMN versione INTEGER NOT NULL DEFAULT 0",
+        "UPDATE prodotto SET versione = 1",
+        "CREATE INDEX IF NOT EXISTS ix_prodotto_versione ON prodotto (versione)",
+        # Trigger: funzionano per l'app, per gli import "raw" e per le modifiche a mano
+        """CREATE TRIGGER IF NOT EXISTS catalogo_inserimento AFTER INSERT ON prodotto BEGIN
+            UPDATE catalogo_versione SET versione = versione + 1;
+            UPDATE prodotto SET versione = (SELECT versione FROM catalogo_versione) WHERE id = new.id;
+        END""",
+        # Solo se un campo cambia davvero (un UPDATE con lo stesso prezzo non conta)
+        """CREATE TRIGGER IF NOT EXISTS catalogo_modifica AFTER UPDATE OF codice, nome, ingredienti, prezzo, attivo ON prodotto
+        WHEN old.codice IS NOT new.codice OR old.nome IS NOT new.nome OR old.ingredienti IS NOT new.ingredienti
+          OR old.prezzo IS NOT new.prezzo OR old.attivo IS NOT new.attivo BEGIN
+            UPDATE catalogo_versione SET versione = versione + 1;
+            UPDATE prodotto SET versione = (SELECT versione FROM catalogo_versione) WHERE id = new.id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS catalogo_eliminazione AFTER DELETE ON prodotto BEGIN
+            UPDATE catalogo_versione SET versione = versione + 1, versione_eliminazione = versione + 1;
+        END""",
+    ]),
+    (6, "Storia dei prezzi di listino (versioni con data di inizio e fine)", [
+        """CREATE TABLE IF NOT EXISTS prezzo_listino (
+            id INTEGER NOT NULL PRIMARY KEY,
+            prodotto_id INTEGER NOT NULL,
+            valido_dal DATE NOT NULL,
+            valido_al DATE,
+            prezzo INTEGER NOT NULL,
+            FOREIGN KEY(prodotto_id) REFERENCES prodotto (id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_prezzo_listino_prodotto_dal ON prezzo_listino (prodotto_id, valido_dal)",
+        # I listini passati non li conosciamo: il prezzo di oggi è la prima versione e
+        # vale per tutto lo storico (come il primo prezzo di ogni prodotto nuovo, sotto)
+        """INSERT INTO prezzo_listino (prodotto_id, valido_dal, valido_al, prezzo)
+           SELECT id, '2000-01-01', NULL, COALESCE(prezzo, 0) FROM prodotto
+           WHERE id NOT IN (SELECT prodotto_id FROM prezzo_listino)""",
+        # Nuova versione in vigore: si chiude quella precedente e si aggiorna la copia in prodotto.prezzo
+        # (MAX: una versione che parte prima di quella aperta la sostituisce, non crea periodi al contrario)
+        """CREATE TRIGGER IF NOT EXISTS prezzo_listino_nuova_versione AFTER INSERT ON prezzo_listino
+        WHEN new.valido_al IS NULL BEGIN
+            UPDATE prezzo_listino SET valido_al = MAX(valido_dal, new.valido_dal)
+            WHERE prodotto_id = new.prodotto_id AND valido_al IS NULL AND id != new.id;
+            UPDATE prodotto SET prezzo = new.prezzo WHERE id = new.prodotto_id;
+        END""",
+        # Ogni prodotto nuovo (app, import, anagrafiche) nasce con la sua prima versione
+        """CREATE TRIGGER IF NOT EXISTS prezzo_listino_nuovo_prodotto AFTER INSERT ON prodotto BEGIN
+            INSERT INTO prezzo_listino (prodotto_id, valido_dal, prezzo) VALUES (new.id, '2000-01-01', COALESCE(new.prezzo, 0));
+        END""",
+    ]),
+    (7, "Prezzi e fatturati in centesimi interi (somme esatte)", [
+        # Stesse colonne, nuova unità (vedi denaro.py) e tipo INTEGER. SQLite non cambia il
+        # tipo di una colonna: si ricrea la tabella (nuova tabella, copia convertita, DROP,
+        # RENAME) e si rimettono indici e trigger, che spariscono con la tabella vecchia.
+        # ROUND(x, 2) arrotonda il decimale come a_centesimi() (0,125 -> 13, 1,005 -> 101)
+        """CREATE TABLE prodotto_nuovo (
+            id INTEGER NOT NULL,
+            codice VARCHAR(30) NOT NULL,
+            nome VARCHAR(150) NOT NULL,
+            ingredienti TEXT,
+            prezzo INTEGER,
+            attivo BOOLEAN NOT NULL,
+            versione INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (id),
+            UNIQUE (codice)
+        )""",
+        """INSERT INTO prodotto_nuovo (id, codice, nome, ingredienti, prezzo, attivo, versione)
+           SELECT id, codice, nome, ingredienti, CAST(ROUND(ROUND(COALESCE(prezzo, 0), 2) * 100) AS INTEGER), attivo, versione
+           FROM prodotto""",
+        """CREATE TABLE prezzo_listino_nuovo (
+            id INTEGER NOT NULL,
+            prodotto_id INTEGER NOT NULL,
+            valido_dal DATE NOT NULL,
+            valido_al DATE,
+            prezzo INTEGER NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(prodotto_id) REFERENCES prodotto (id)
+        )""",
+        """INSERT INTO prezzo_listino_nuovo (id, prodotto_id, valido_dal, valido_al, prezzo)
+           SELECT id, prodotto_id, valido_dal, valido_al, CAST(ROUND(ROUND(prezzo, 2) * 100) AS INTEGER)
+           FROM prezzo_listino""",
+        """CREATE TABLE dettaglio_ordine_nuovo (
+            id INTEGER NOT NULL,
+            ordine_id INTEGER NOT NULL,
+            cliente_id INTEGER NOT NULL,
+            prodotto_id INTEGER NOT NULL,
+            quantita INTEGER NOT NULL,
+            prezzo_storico INTEGER,
+            PRIMARY KEY (id),
+            FOREIGN KEY(ordine_id) REFERENCES ordine (id),
+            FOREIGN KEY(cliente_id) REFERENCES cliente (id),
+            FOREIGN KEY(prodotto_id) REFERENCES prodotto (id)
+        )""",
+        """INSERT INTO dettaglio_ordine_nuovo (id, ordine_id, cliente_id, prodotto_id, quantita, prezzo_storico)
+           SELECT id, ordine_id, cliente_id, prodotto_id, quantita, CAST(ROUND(ROUND(COALESCE(prezzo_storico, 0), 2) * 100) AS INTEGER)
+           FROM dettaglio_ordine""",
+        # Prima tutti i DROP (con le tabelle se ne vanno i loro trigger), poi i RENAME:
+        # così nessun trigger rimasto punta a una tabella che in quel momento non esiste
+        "DROP TABLE prezzo_listino",
+        "DROP TABLE dettaglio_ordine",
+        "DROP TABLE prodotto",
+        "ALTER TABLE prodotto_nuovo RENAME TO prodotto",
+        "ALTER TABLE prezzo_listino_nuovo RENAME TO prezzo_listino",
+        "ALTER TABLE dettaglio_ordine_nuovo RENAME TO dettaglio_ordine",
+        # Indici (migrazioni 1, 5 e 6)
+        "CREATE INDEX ix_dettaglio_ordine_ordine_id ON dettaglio_ordine (ordine_id)",
+        "CREATE INDEX ix_dettaglio_ordine_prodotto_id ON dettaglio_ordine (prodotto_id)",
+        "CREATE INDEX ix_dettaglio_cliente_prodotto_ordine ON dettaglio_ordine (cliente_id, prodotto_id, ordine_id, quantita)",
+        "CREATE INDEX ix_prodotto_versione ON prodotto (versione)",
+        "CREATE INDEX ix_prezzo_listino_prodotto_dal ON prezzo_listino (prodotto_id, valido_dal)",
+        # Trigger (migrazioni 4, 5 e 6). L'indice FTS non si tocca: gli id dei prodotti sono gli stessi
+        """CREATE TRIGGER prodotto_fts_inserimento AFTER INSERT ON prodotto BEGIN
+            INSERT INTO prodotto_fts (rowid, nome, codice, ingredienti) VALUES (new.id, new.nome, new.codice, new.ingredienti);
+        END""",
+        """CREATE TRIGGER prodotto_fts_eliminazione AFTER DELETE ON prodotto BEGIN
+            INSERT INTO prodotto_fts (prodotto_fts, rowid, nome, codice, ingredienti) VALUES ('delete', old.id, old.nome, old.codice, old.ingredienti);
+        END""",
+        """CREATE TRIGGER prodotto_fts_modifica AFTER UPDATE OF nome, codice, ingredienti ON prodotto BEGIN
+            INSERT INTO prodotto_fts (prodotto_fts, rowid, nome, codice, ingredienti) VALUES ('delete', old.id, old.nome, old.codice, old.ingredienti);
+            INSERT INTO prodotto_fts (rowid, nome, codice, ingredienti) VALUES (new.id, new.nome, new.codice, new.ingredienti);
+        END""",
+        """CREATE TRIGGER catalogo_inserimento AFTER INSERT ON prodotto BEGIN
+            UPDATE catalogo_versione SET versione = versione + 1;
+            UPDATE prodotto SET versione = (SELECT versione FROM catalogo_versione) WHERE id = new.id;
+        END""",
+        """CREATE TRIGGER catalogo_modifica AFTER UPDATE OF codice, nome, ingredienti, prezzo, attivo ON prodotto
+        WHEN old.codice IS NOT new.codice OR old.nome IS NOT new.nome OR old.ingredienti IS NOT new.ingredienti
+          OR old.prezzo IS NOT new.prezzo OR old.attivo IS NOT new.attivo BEGIN
+            UPDATE catalogo_versione SET versione = versione + 1;
+            UPDATE prodotto SET versione = (SELECT versione FROM catalogo_versione) WHERE id = new.id;
+        END""",
+        """CREATE TRIGGER catalogo_eliminazione AFTER DELETE ON prodotto BEGIN
+            UPDATE catalogo_versione SET versione = versione + 1, versione_eliminazione = versione + 1;
+        END""",
+        """CREATE TRIGGER prezzo_listino_nuova_versione AFTER INSERT ON prezzo_listino
+        WHEN new.valido_al IS NULL BEGIN
+            UPDATE prezzo_listino SET valido_al = MAX(valido_dal, new.valido_dal)
+            WHERE prodotto_id = new.prodotto_id AND valido_al IS NULL AND id != new.id;
+            UPDATE prodotto SET prezzo = new.prezzo WHERE id = new.prodotto_id;
+        END""",
+        """CREATE TRIGGER prezzo_listino_nuovo_prodotto AFTER INSERT ON prodotto BEGIN
+            INSERT INTO prezzo_listino (prodotto_id, valido_dal, prezzo) VALUES (new.id, '2000-01-01', COALESCE(new.prezzo, 0));
+        END""",
+        # Il riepilogo è tutto calcolato: si ricrea con fatturato INTEGER (sui DB creati
+        # dall'app era FLOAT; gli script possono girare prima dell'app, quando non c'è ancora)
+        # e si riempie dalle righe già convertite
+        "DROP TABLE IF EXISTS riepilogo_vendite",
+        """CREATE TABLE riepilogo_vendite (
+            mese VARCHAR(7) NOT NULL,
+            cliente_id INTEGER NOT NULL,
+            prodotto_id INTEGER NOT NULL,
+            quantita INTEGER NOT NULL,
+            fatturato INTEGER NOT NULL,
+            PRIMARY KEY (mese, cliente_id, prodotto_id),
+            FOREIGN KEY(cliente_id) REFERENCES cliente (id),
+            FOREIGN KEY(prodotto_id) REFERENCES prodotto (id)
+        )""",
+        """INSERT INTO riepilogo_vendite (mese, cliente_id, prodotto_id, quantita, fatturato)
+           SELECT strftime('%Y-%m', o.data_consegna), d.cliente_id, d.prodotto_id,
+                  SUM(d.quantita), SUM(d.quantita * COALESCE(d.prezzo_storico, 0))
+           FROM dettaglio_ordine d
+           JOIN ordine o ON o.id = d.ordine_id
+           WHERE COALESCE(o.stato, '') != 'cancellato'
+           GROUP BY 1, 2, 3""",
+        # Le statistiche degli indici (migrazione 1) se ne sono andate con le tabelle
+        "ANALYZE",
+    ]),
+]
+
+def get_db_path():
+    if os.path.exists(DB_NAME): return DB_NAME
+    elif os.path.exists(os.path.join('instance', DB_NAME)): return os.path.join('instance', DB_NAME)
+    else: return None
+
+def versione_database(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def applica_migrazioni(conn):
+    """
+    Applica in ordine le migrazioni non ancora presenti nel database.
+    conn: connessione sqlite3 (va bene anche quella "raw" di SQLAlchemy).
+    Restituisce la lista delle migrazioni applicate [(numero, descrizione), ...].
+    """
+    versione = versione_database(conn)
+    applicate = []
+
+    for numero, descrizione, istruzioni in MIGRAZIONI:
+        if numero <= versione:
+            continue
+
+        # Ogni migrazione è una transazione: o passa tutta o niente
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            for sql in istruzioni:
+                cursor.execute(sql)
+            cursor.execute(f"PRAGMA user_version = {int(numero)}")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            cursor.close()
+
+        applicate.append((numero, descrizione))
+
+    return applicate
+
+def migra():
+    db_path = get_db_path()
+    if not db_path:
+        print("❌ ERRORE: Database non trovato. Avvia prima 'py app.py'.")
+        return
+
+    conn = apri_connessione(db_path)
+    print(f"📂 Database: {db_path} (versione {versione_database(conn)})")
+
+    applicate = applica_migrazioni(conn)
+    for numero, descrizione in applicate:
+        print(f"✅ Migrazione {numero}: {descrizione}")
+    if not applicate:
+        print("✨ Il database è già aggiornato.")
+
+    print(f"🏁 Versione attuale: {versione_database(conn)}")
+    conn.close()
+
+if __name__ == "__main__":
+    migra()
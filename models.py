@@ -19,12 +19,30 @@ class Prodotto(db.Model):
     codice = db.Column(db.String(30), unique=True, nullable=False)
     nome = db.Column(db.String(150), nullable=False)
     ingredienti = db.Column(db.Text, nullable=True)
-    # Prezzo di Listino Attuale (default 0.0 se non lo sappiamo)
-    prezzo = db.Column(db.Float, default=0.0) 
+    # Prezzo di Listino Attuale in CENTESIMI (default 0 se non lo sappiamo, vedi denaro.py)
+    # È la copia del prezzo in vigore: la storia dei prezzi è in PrezzoListino e
+    # un trigger aggiorna questa colonna a ogni nuova versione (migrazione 6)
+    prezzo = db.Column(db.Integer, default=0) 
     attivo = db.Column(db.Boolean, default=True, nullable=False)
     
     dettagli = db.relationship('DettaglioOrdine', backref='prodotto', lazy=True)
 
+# Tabella Prezzi di Listino (storia dei prezzi di ogni prodotto)
+# Ogni versione vale da valido_dal (compreso) a valido_al (escluso); quella in vigore
+# ha valido_al vuoto. Non si modifica mai una versione: se ne aggiunge una nuova e il
+# trigger chiude la precedente e aggiorna prodotto.prezzo.
+class PrezzoListino(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    prodotto_id = db.Column(db.Integer, db.ForeignKey('prodotto.id'), nullable=False)
+    valido_dal = db.Column(db.Date, nullable=False)
+    valido_al = db.Column(db.Date, nullable=True)
+    prezzo = db.Column(db.Integer, nullable=False, default=0) # Centesimi
+
+    # Stesso nome della migrazione 6 in migrazioni.py: "prezzo del prodotto X alla data D"
+    __table_args__ = (
+        db.Index('ix_prezzo_listino_prodotto_dal', 'prodotto_id', 'valido_dal'),
+    )
+
 # Tabella Ordini 
 class Ordine(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -35,6 +53,11 @@ class Ordine(db.Model):
 
     righe = db.relationship('DettaglioOrdine', backref='ordine', lazy=True, cascade="all, delete-orphan")
 
+    # Indici (stessi nomi della migrazione 1 in migrazioni.py)
+    __table_args__ = (
+        db.Index('ix_ordine_data_consegna_stato', 'data_consegna', 'stato'),
+    )
+
 # Tabella Dettaglio (Righe dell'ordine)
 class DettaglioOrdine(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -43,5 +66,159 @@ class DettaglioOrdine(db.Model):
     prodotto_id = db.Column(db.Integer, db.ForeignKey('prodotto.id'), nullable=False)
     
     quantita = db.Column(db.Integer, nullable=False)
-    # Prezzo al momento dell'ordine (Storico)
-    prezzo_storico = db.Column(db.Float, default=0.0)
\ No newline at end of file
+    # Prezzo al momento dell'ordine (Storico), in centesimi
+    prezzo_storico = db.Column(db.Integer, default=0)
+
+    # Indici (stessi nomi della migrazione 1 in migrazioni.py)
+    # Quello su (cliente, prodotto, ordine, quantita) copre storico e suggerimenti del cliente
+    __table_args__ = (
+        db.Index('ix_dettaglio_ordine_ordine_id', 'ordine_id'),
+        db.Index('ix_dettaglio_ordine_prodotto_id', 'prodotto_id'),
+        db.Index('ix_dettaglio_cliente_prodotto_ordine', 'cliente_id', 'prodotto_id', 'ordine_id', 'quantita'),
+    )
+
+# Tabella Riepilogo Vendite (Statistiche PRECALCOLATE per Mese + Cliente + Prodotto)
+# Viene aggiornata ad ogni salvataggio/modifica/eliminazione ordine,
+# così la pagina Statistiche non deve rileggere tutte le righe di dettaglio.
+class RiepilogoVendite(db.Model):
+    mese = db.Column(db.String(7), primary_key=True) # Formato 'YYYY-MM'
+    cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), primary_key=True)
+    prodotto_id = db.Column(db.Integer, db.ForeignKey('prodotto.id'), primary_key=True)
+
+    quantita = db.Column(db.Integer, nullable=False, default=0)
+    # Somma di quantita * prezzo_storico, in centesimi
+    fatturato = db.Column(db.Integer, nullable=False, default=0)
+
+# Query per ricostruire da zero il riepilogo (usata dal comando CLI e dagli script di import)
+SQL_RICOSTRUZIONE_RIEPILOGO = [
+    "DELETE FROM riepilogo_vendite",
+    """
+    INSERT INTO riepilogo_vendite (mese, cliente_id, prodotto_id, quantita, fatturato)
+    SELECT strftime('%Y-%m', o.data_consegna), d.cliente_id, d.prodotto_id,
+           SUM(d.quantita), SUM(d.quantita * COALESCE(d.prezzo_storico, 0))
+    FROM dettaglio_ordine d
+    JOIN ordine o ON o.id = d.ordine_id
+    WHERE COALESCE(o.stato, '') != 'cancellato'
+    GROUP BY 1, 2, 3
+    """
+]
+
+# Stessa ricostruzione ma per UN solo mese (parametro: 'YYYY-MM' due volte)
+SQL_RICOSTRUZIONE_RIEPILOGO_MESE = [
+    "DELETE FROM riepilogo_vendite WHERE mese = ?",
+    """
+    INSERT INTO riepilogo_vendite (mese, cliente_id, prodotto_id, quantita, fatturato)
+    SELECT strftime('%Y-%m', o.data_consegna), d.cliente_id, d.prodotto_id,
+           SUM(d.quantita), SUM(d.quantita * COALESCE(d.prezzo_storico, 0))
+    FROM dettaglio_ordine d
+    JOIN ordine o ON o.id = d.ordine_id
+    WHERE COALESCE(o.stato, '') != 'cancellato' AND strftime('%Y-%m', o.data_consegna) = ?
+    GROUP BY 1, 2, 3
+    """
+]
+
+# Tabella Ultimo Acquisto ("Chi ha comprato cosa": indice inverso Prodotto -> Clienti)
+# Una riga per (prodotto, cliente): ultima data, quantità di quell'ultimo ordine e totale.
+# Tenuta aggiornata a ogni salvataggio/modifica/eliminazione ordine e dagli import,
+# così "chi mi ha ordinato i Krapfen l'ultima volta?" non rilegge tutto il dettaglio.
+class UltimoAcquisto(db.Model):
+    prodotto_id = db.Column(db.Integer, db.ForeignKey('prodotto.id'), primary_key=True)
+    cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), primary_key=True)
+
+    ultima_data = db.Column(db.Date, nullable=False)
+    ultima_quantita = db.Column(db.Integer, nullable=False, default=0) # Pezzi nell'ultimo ordine
+    quantita_totale = db.Column(db.Integer, nullable=False, default=0)
+
+    # Stesso nome della migrazione 4 in migrazioni.py: i clienti di un prodotto già in ordine di data
+    __table_args__ = (
+        db.Index('ix_ultimo_acquisto_prodotto_data', 'prodotto_id', 'ultima_data'),
+    )
+
+# Ricalcolo di ultimo_acquisto dal dettaglio: si somma per ordine, poi per ogni
+# (cliente, prodotto) si tiene l'ordine più recente (a parità di data, l'ultimo creato)
+# Gli ordini cancellati non contano (come nel riepilogo vendite).
+SQL_SELEZIONE_ULTIMO_ACQUISTO = """
+    INSERT INTO ultimo_acquisto (prodotto_id, cliente_id, ultima_data, ultima_quantita, quantita_totale)
+    SELECT prodotto_id, cliente_id, data_consegna, quantita, totale FROM (
+        SELECT d.prodotto_id, d.cliente_id, o.data_consegna, SUM(d.quantita) AS quantita,
+               SUM(SUM(d.quantita)) OVER (PARTITION BY d.cliente_id, d.prodotto_id) AS totale,
+               ROW_NUMBER() OVER (PARTITION BY d.cliente_id, d.prodotto_id
+                                  ORDER BY o.data_consegna DESC, o.id DESC) AS posizione
+        FROM dettaglio_ordine d
+        JOIN ordine o ON o.id = d.ordine_id
+        WHERE COALESCE(o.stato, '') != 'cancellato' {filtro}
+        GROUP BY d.cliente_id, d.prodotto_id, o.id
+    ) WHERE posizione = 1
+"""
+
+SQL_RICOSTRUZIONE_ULTIMO_ACQUISTO = [
+    "DELETE FROM ultimo_acquisto",
+    SQL_SELEZIONE_ULTIMO_ACQUISTO.format(filtro=""),
+]
+
+# Stesso ricalcolo per UNA coppia (parametri di entrambe: cliente_id, prodotto_id).
+# Usa l'indice (cliente, prodotto, ordine, quantita) del dettaglio: pochi record per coppia.
+SQL_RICOSTRUZIONE_ULTIMO_ACQUISTO_COPPIA = [
+    "DELETE FROM ultimo_acquisto WHERE cliente_id = ? AND prodotto_id = ?",
+    SQL_SELEZIONE_ULTIMO_ACQUISTO.format(filtro="AND d.cliente_id = ? AND d.prodotto_id = ?"),
+]
+
+# Tabella Email in Uscita (Coda persistente: sopravvive anche a un riavvio del programma)
+class EmailInUscita(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    destinatario = db.Column(db.String(150), nullable=False)
+    oggetto = db.Column(db.String(200), nullable=False)
+    corpo = db.Column(db.Text, nullable=True)
+    nome_allegato = db.Column(db.String(150), nullable=True)
+    allegato = db.Column(db.LargeBinary, nullable=True)
+
+    stato = db.Column(db.String(20), default='in_attesa', nullable=False, index=True) # in_attesa, inviata, fallita
+    tentativi = db.Column(db.Integer, default=0, nullable=False)
+    prossimo_tentativo = db.Column(db.DateTime, nullable=False)
+    ultimo_errore = db.Column(db.Text, nullable=True)
+    creata_il = db.Column(db.DateTime, nullable=False)
+    inviata_il = db.Column(db.DateTime, nullable=True)
+
+# Tabella File Importati (impronta SHA-256 del contenuto: lo stesso file non viene importato due volte)
+class ImportazioneFile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    hash_file = db.Column(db.String(64), unique=True, nullable=False)
+    nome_file = db.Column(db.String(255), nullable=False)
+    importato_il = db.Column(db.DateTime, nullable=False)
+    righe = db.Column(db.Integer, nullable=False, default=0)
+
+# Tabella Righe Importate (impronta di ogni riga dell'Excel della sede -> riga d'ordine creata)
+# Serve all'import incrementale per capire cosa è già stato caricato.
+# dettaglio_id volutamente senza ForeignKey: se l'ordine viene eliminato dall'app,
+# l'impronta resta e la riga NON viene reimportata al giro successivo.
+class RigaImportata(db.Model):
+    impronta = db.Column(db.String(40), primary_key=True) # SHA-1 di DataDoc|Cd_CF|Cd_AR|Qta|Prezzo|n° ripetizione
+    data_doc = db.Column(db.String(10), nullable=False, index=True) # 'YYYY-MM-DD'
+    dettaglio_id = db.Column(db.Integer, nullable=True)
+
+# Tabella Bozze Ordine (ordine in preparazione, lato server)
+# Nel cookie di sessione resta solo l'id della bozza, non tutte le righe.
+# Le bozze non toccate da più di BOZZA_DURATA_ORE (app.py) vengono cancellate.
+class BozzaOrdine(db.Model):
+    id = db.Column(db.String(32), primary_key=True) # Token casuale (session['bozza_id'])
+    data_consegna = db.Column(db.String(10), nullable=True) # 'YYYY-MM-DD' come arriva dalla pagina
+    note = db.Column(db.Text, nullable=True)
+    aggiornata_il = db.Column(db.DateTime, nullable=False, index=True)
+
+    righe = db.relationship('BozzaRiga', backref='bozza', lazy=True, cascade="all, delete-orphan",
+                            order_by='BozzaRiga.id')
+
+# Righe della bozza: una per (cliente, prodotto), nell'ordine in cui sono state aggiunte
+class BozzaRiga(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    bozza_id = db.Column(db.String(32), db.ForeignKey('bozza_ordine.id', ondelete='CASCADE'), nullable=False)
+    cliente_id = db.Column(db.Integer, nullable=False)
+    prodotto_id = db.Column(db.Integer, nullable=False)
+    quantita = db.Column(db.Integer, nullable=False)
+    # Testi "Nome (Cod. X)" mostrati nella pagina: servono per il PDF
+    cliente_check = db.Column(db.String(200), nullable=True)
+    prodotto_check = db.Column(db.String(200), nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('bozza_id', 'cliente_id', 'prodotto_id', name='uq_bozza_riga'),
+    )
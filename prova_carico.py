@@ -0,0 +1,89 @@
+import sys
+import time
+import argparse
+import threading
+import urllib.request
+import urllib.error
+
+# ==============================================================================
+# PROVA DI CARICO (più "utenti" insieme sul gestionale acceso)
+# ==============================================================================
+# Ogni client è un thread che chiede le pagine in giro, una dopo l'altra, per
+# --durata secondi. Alla fine: richieste al secondo e tempi di risposta.
+#
+# Uso (con il gestionale già acceso):
+#   py prova_carico.py                         (1, 4, 8 e 16 client)
+#   py prova_carico.py --client 8 --durata 10
+#   py prova_carico.py --url http://192.168.1.10:5000
+#
+# Confronto server di sviluppo / produzione:
+#   py app.py --debug --porta 5001   e   py app.py --porta 5000
+#   py prova_carico.py --url http://127.0.0.1:5001   poi   --url http://127.0.0.1:5000
+
+URL_BASE = 'http://127.0.0.1:5000'
+PERCORSI = [
+    '/',
+    '/crea_ordine',
+    '/api/suggerimenti_cliente/1',
+    '/api/storico/ordini',
+    '/api/statistiche',
+]
+
+def client(url_base, percorsi, fine, risultati, lock):
+    tempi, errori = [], 0
+    i = 0
+    while time.perf_counter() < fine:
+        url = url_base + percorsi[i % len(percorsi)]
+        i += 1
+        inizio = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=30) as risposta:
+                risposta.read()
+            tempi.append(time.perf_counter() - inizio)
+        except (urllib.error.URLError, OSError):
+            errori += 1
+    with lock:
+        risultati['tempi'].extend(tempi)
+        risultati['errori'] += errori
+
+def percentile(valori, p):
+    if not valori:
+        return 0.0
+    valori = sorted(valori)
+    return valori[min(int(len(valori) * p / 100), len(valori) - 1)]
+
+def prova(url_base, num_client, durata, percorsi):
+    risultati = {'tempi': [], 'errori': 0}
+    lock = threading.Lock()
+    fine = time.perf_counter() + durata
+    threads = [threading.Thread(target=client, args=(url_base, percorsi, fine, risultati, lock)) for _ in range(num_client)]
+    inizio = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    secondi = time.perf_counter() - inizio
+
+    tempi = risultati['tempi']
+    print(f"{num_client:>7} | {len(tempi):>9} | {len(tempi) / secondi:>8.1f} | "
+          f"{percentile(tempi, 50) * 1000:>7.0f} | {percentile(tempi, 95) * 1000:>7.0f} | {risultati['errori']:>6}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prova di carico sul gestionale acceso.")
+    parser.add_argument('--url', default=URL_BASE, help=f"Indirizzo del gestionale (default: {URL_BASE})")
+    parser.add_argument('--client', type=int, nargs='+', default=[1, 4, 8, 16], help="Numero di client in parallelo (anche più valori)")
+    parser.add_argument('--durata', type=float, default=5, help="Secondi per ogni prova (default: 5)")
+    argomenti = parser.parse_args()
+
+    try:
+        urllib.request.urlopen(argomenti.url + '/', timeout=10).read()
+    except (urllib.error.URLError, OSError) as e:
+        print(f"❌ Il gestionale non risponde su {argomenti.url}: {e}")
+        sys.exit(1)
+
+    print(f"📈 Prova di carico su {argomenti.url} ({argomenti.durata:g}s per prova)")
+    print(f"   Pagine: {', '.join(PERCORSI)}")
+    print(" client | richieste |  rich/s  | p50 ms  | p95 ms  | errori")
+    print("-" * 60)
+    for num_client in argomenti.client:
+        prova(argomenti.url, num_client, argomenti.durata, PERCORSI)
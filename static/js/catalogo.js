@@ -0,0 +1,142 @@
+// ==============================================================================
+// COPIA DEL CATALOGO PRODOTTI NEL BROWSER (crea ordine / modifica ordine)
+// ==============================================================================
+// Il catalogo viene scaricato UNA volta e tenuto in IndexedDB con la sua versione.
+// Alle visite successive si chiede al server solo cosa è cambiato
+// (/api/catalogo/snapshot?since=<versione>): di solito la risposta è un 304 vuoto.
+// La select dei prodotti cerca qui dentro, senza una richiesta a ogni tasto.
+
+var NOME_DB_CATALOGO = 'gestionale';
+var PER_PAGINA_CATALOGO = 30;
+
+var promessaCatalogo = null;      // Un solo caricamento per pagina
+var storicoClienti = {};          // cliente_id -> Promise({id_prodotto: {totale, punteggio, ...}})
+
+function apriDbCatalogo() {
+    return new Promise(function(resolve, reject) {
+        if (!window.indexedDB) { reject(new Error('IndexedDB non disponibile')); return; }
+        var richiesta = indexedDB.open(NOME_DB_CATALOGO, 1);
+        richiesta.onupgradeneeded = function() { richiesta.result.createObjectStore('catalogo'); };
+        richiesta.onsuccess = function() { resolve(richiesta.result); };
+        richiesta.onerror = function() { reject(richiesta.error); };
+    });
+}
+
+function leggiCopiaLocale(db) {
+    return new Promise(function(resolve) {
+        var richiesta = db.transaction('catalogo', 'readonly').objectStore('catalogo').get('prodotti');
+        richiesta.onsuccess = function() { resolve(richiesta.result || null); };
+        richiesta.onerror = function() { resolve(null); };
+    });
+}
+
+function scriviCopiaLocale(db, copia) {
+    return new Promise(function(resolve) {
+        var transazione = db.transaction('catalogo', 'readwrite');
+        transazione.objectStore('catalogo').put(copia, 'prodotti');
+        transazione.oncomplete = resolve;
+        transazione.onerror = resolve;  // Una copia non salvata si riscarica la prossima volta
+    });
+}
+
+function aggiornaCopia(copia) {
+    // copia: {versione, prodotti: {id: [id, codice, nome, prezzo]}} oppure null
+    var url = '/api/catalogo/snapshot' + (copia ? '?since=' + copia.versione : '');
+    var intestazioni = copia ? { 'If-None-Match': '"' + copia.versione + '-' + copia.versione + '"' } : {};
+
+    return fetch(url, { headers: intestazioni, cache: 'no-store' }).then(function(r) {
+        if (r.status === 304) return { copia: copia, cambiata: false };
+        if (!r.ok) throw new Error('Catalogo non disponibile (' + r.status + ')');
+        return r.json().then(function(dati) {
+            var prodotti = dati.completo ? {} : copia.prodotti;
+            dati.rimossi.forEach(function(id) { delete prodotti[id]; });
+            dati.prodotti.forEach(function(p) { prodotti[p[0]] = p; });
+            return { copia: { versione: dati.versione, prodotti: prodotti }, cambiata: true };
+        });
+    });
+}
+
+function caricaCatalogo() {
+    // Promise -> {id: {id, codice, nome, prezzo, text}}
+    if (promessaCatalogo) return promessaCatalogo;
+
+    promessaCatalogo = apriDbCatalogo()
+        .then(function(db) {
+            return leggiCopiaLocale(db).then(aggiornaCopia).then(function(esito) {
+                if (!esito.cambiata) return esito.copia;
+                return scriviCopiaLocale(db, esito.copia).then(function() { return esito.copia; });
+            });
+        })
+        // Senza IndexedDB (es. navigazione privata) si scarica comunque, solo per questa pagina
+        .catch(function() { return aggiornaCopia(null).then(function(esito) { return esito.copia; }); })
+        .then(function(copia) {
+            var catalogo = {};
+            Object.keys(copia.prodotti).forEach(function(id) {
+                var p = copia.prodotti[id];
+                catalogo[id] = { id: p[0], codice: p[1], nome: p[2], prezzo: p[3], text: p[2] + ' (Cod. ' + p[1] + ')' };
+            });
+            return catalogo;
+        });
+
+    promessaCatalogo.catch(function() { promessaCatalogo = null; });  // Riprova alla prossima ricerca
+    return promessaCatalogo;
+}
+
+function storicoCliente(clienteId) {
+    if (!clienteId) return Promise.resolve({});
+    if (!storicoClienti[clienteId]) {
+        storicoClienti[clienteId] = fetch('/api/suggerimenti_cliente/' + clienteId + '?completo=1')
+            .then(function(r) { return r.json(); })
+            .catch(function() { delete storicoClienti[clienteId]; return {}; });
+    }
+    return storicoClienti[clienteId];
+}
+
+function cercaNelCatalogo(catalogo, storico, testo, pagina) {
+    // Stesso ordine di /api/catalogo/prodotti: prima i prodotti che il cliente compra
+    // (punteggio recente), poi quelli che INIZIANO con la prima parola, poi alfabetico
+    var parole = (testo || '').toLowerCase().split(/\s+/).filter(Boolean);
+    var primaParola = parole[0] || '';
+
+    var trovati = [];
+    Object.keys(catalogo).forEach(function(id) {
+        var p = catalogo[id];
+        var nome = p.nome.toLowerCase(), codice = String(p.codice).toLowerCase();
+        if (!parole.every(function(parola) { return nome.includes(parola) || codice.includes(parola); })) return;
+        var acquisti = storico[id] || {};
+        trovati.push({
+            id: p.id, text: p.text, tipo: 'prodotti', prezzo: p.prezzo,
+            acquistati: acquisti.totale || 0,
+            _punteggio: acquisti.punteggio || 0,
+            _inizia: primaParola !== '' && (nome.startsWith(primaParola) || codice.startsWith(primaParola)),
+            _nome: nome
+        });
+    });
+
+    trovati.sort(function(a, b) {
+        if (a._punteggio !== b._punteggio) return b._punteggio - a._punteggio;
+        if (a._inizia !== b._inizia) return a._inizia ? -1 : 1;
+        return a._nome < b._nome ? -1 : (a._nome > b._nome ? 1 : 0);
+    });
+
+    var inizio = (pagina - 1) * PER_PAGINA_CATALOGO;
+    return {
+        results: trovati.slice(inizio, inizio + PER_PAGINA_CATALOGO),
+        pagination: { more: trovati.length > inizio + PER_PAGINA_CATALOGO }
+    };
+}
+
+function ajaxCatalogoLocale(clienteSelezionato) {
+    // Opzione "ajax" di Select2 che invece del server interroga la copia locale
+    return {
+        delay: 100,
+        transport: function(params, success, failure) {
+            var dati = params.data || {};
+            Promise.all([caricaCatalogo(), storicoCliente(clienteSelezionato())])
+                .then(function([catalogo, storico]) { success(cercaNelCatalogo(catalogo, storico, dati.term, dati.page || 1)); })
+                .catch(failure);
+            return { abort: function() {} };
+        },
+        processResults: function(risultati) { return risultati; }
+    };
+}
@@ -0,0 +1,232 @@
+import os
+import time
+import secrets
+import click
+from datetime import datetime, timedelta
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event
+
+from models import db, Cliente, Prodotto
+
+# ==============================================================================
+# COMANDI DI CONTROLLO (INDICI, TEMPI, NUMERO DI QUERY)
+# ==============================================================================
+# Controlli da lanciare a mano dopo una modifica al DB o alle query:
+#   flask --app app verifica-indici
+#   flask --app app benchmark-ordine
+#   flask --app app benchmark-storico
+#   flask --app app verifica-query
+# Ogni comando stampa OK/KO ed esce con codice 1 se qualcosa non va (usabile in
+# uno script). Quelli che scrivono dati di prova alla fine fanno ROLLBACK.
+#
+# Le funzioni del gestionale (query, salvataggio ordini, rotte) stanno in app.py,
+# che a sua volta registra questi comandi con registra_verifiche(app): per non
+# importarsi a vicenda, ogni comando prende da app.py quello che gli serve solo
+# quando viene eseguito.
+
+def registra_verifiche(app):
+    """Aggiunge i comandi di controllo a 'flask --app app ...'."""
+    for comando in (comando_verifica_indici, comando_benchmark_ordine, comando_benchmark_storico, comando_verifica_query):
+        app.cli.add_command(comando)
+
+def piano_query(query):
+    """Restituisce le righe di EXPLAIN QUERY PLAN per una query SQLAlchemy."""
+    compilata = query.statement.compile(dialect=db.engine.dialect)
+    parametri = tuple(compilata.params[nome] for nome in compilata.positiontup)
+    with db.engine.connect() as conn:
+        risultato = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compilata}", parametri)
+        return [riga[-1] for riga in risultato]
+
+@click.command('verifica-indici')
+@with_appcontext
+def comando_verifica_indici():
+    """
+    Controlla con EXPLAIN QUERY PLAN che le query di storico cliente, suggerimenti
+    e clienti dormienti usino gli indici di dettaglio_ordine (e non una scansione completa).
+    Uso: flask --app app verifica-indici
+    """
+    from app import aggiorna_schema_database, query_storico_cliente, query_suggerimenti_cliente, query_clienti_dormienti
+
+    aggiorna_schema_database()
+    controlli = {
+        'api_storico_cliente': query_storico_cliente(1),
+        'api_suggerimenti_cliente': query_suggerimenti_cliente(1),
+        'clienti dormienti': query_clienti_dormienti(),
+    }
+
+    tutto_ok = True
+    for nome, query in controlli.items():
+        piano = piano_query(query)
+        righe_dettaglio = [p for p in piano if 'dettaglio_ordine' in p]
+        ok = bool(righe_dettaglio) and all('INDEX ix_' in p for p in righe_dettaglio)
+        tutto_ok = tutto_ok and ok
+        print(f"{'OK ' if ok else 'KO '} {nome}")
+        for p in piano:
+            print(f"     {p}")
+
+    if not tutto_ok:
+        raise SystemExit(1)
+
+def ordine_di_prova(righe, note):
+    """
+    Dati di un ordine giornaliero di prova (formato di salva_ordine) con 'righe' righe
+    sui clienti e prodotti attivi. Esce con codice 1 se non ce ne sono.
+    """
+    clienti = [c.id for c in Cliente.query.filter_by(attivo=True).all()]
+    prodotti = [p.id for p in Prodotto.query.filter_by(attivo=True).all()]
+    if not clienti or not prodotti:
+        print("Servono almeno un cliente e un prodotto attivi.")
+        raise SystemExit(1)
+
+    # Coppie (cliente, prodotto) tutte diverse finché ce ne sono, poi si ripetono
+    coppie = [(c_id, p_id) for p_id in prodotti for c_id in clienti]
+    return {
+        'data': datetime.now().strftime('%Y-%m-%d'),
+        'note': note,
+        'righe': [{'cliente_id': coppie[i % len(coppie)][0], 'prodotto_id': coppie[i % len(coppie)][1], 'quantita': 1 + i % 5}
+                  for i in range(righe)]
+    }
+
+@click.command('benchmark-ordine')
+@click.option('--righe', default=2000, show_default=True, help="Righe dell'ordine di prova")
+@click.option('--limite', default=0.5, show_default=True, help="Tempo massimo accettato (secondi)")
+@with_appcontext
+def comando_benchmark_ordine(righe, limite):
+    """
+    Salva un ordine giornaliero di prova (stesso percorso di invia_definitivo) e
+    controlla che ci metta meno di --limite secondi. Alla fine fa ROLLBACK: il
+    database resta com'era (resta fuori solo il commit finale, cioè un fsync).
+    Uso: flask --app app benchmark-ordine --righe 2000 --limite 0.5
+    """
+    from app import aggiorna_schema_database, salva_ordine
+
+    aggiorna_schema_database()
+    dati_ordine = ordine_di_prova(righe, 'BENCHMARK')
+
+    inizio = time.perf_counter()
+    try:
+        salva_ordine(dati_ordine, datetime.now().strftime('%H-%M'))
+        db.session.flush()
+        durata = time.perf_counter() - inizio
+    finally:
+        db.session.rollback()
+
+    ok = durata <= limite
+    print(f"{'OK ' if ok else 'KO '} ordine da {righe} righe salvato in {durata * 1000:.0f} ms (limite {limite * 1000:.0f} ms)")
+    if not ok:
+        raise SystemExit(1)
+
+@click.command('benchmark-storico')
+@click.option('--prodotti', default=500, show_default=True, help="Prodotti diversi comprati dal cliente di prova")
+@click.option('--ordini', default=20, show_default=True, help="Ordini (giorni) in cui li ha comprati")
+@click.option('--limite', default=0.1, show_default=True, help="Tempo massimo accettato (secondi, mediana)")
+@with_appcontext
+def comando_benchmark_storico(prodotti, ordini, limite):
+    """
+    Crea un cliente di prova che ha comprato --prodotti prodotti diversi in --ordini
+    giorni (prodotti x ordini righe) e misura /api/storico_cliente su di lui
+    (query_storico_cliente, funzioni finestra). Alla fine fa ROLLBACK: il database resta com'era.
+    Uso: flask --app app benchmark-storico --prodotti 500 --ordini 20 --limite 0.1
+    """
+    from app import aggiorna_schema_database, salva_ordine, api_storico_cliente
+
+    aggiorna_schema_database()
+    id_prodotti = [p.id for p in Prodotto.query.filter_by(attivo=True).order_by(Prodotto.id).limit(prodotti).all()]
+    if len(id_prodotti) < prodotti:
+        print(f"Servono almeno {prodotti} prodotti attivi (ce ne sono {len(id_prodotti)}).")
+        raise SystemExit(1)
+
+    try:
+        cliente = Cliente(codice=f"BENCHMARK-{secrets.token_hex(4)}", nome='BENCHMARK STORICO')
+        db.session.add(cliente)
+        db.session.flush()
+
+        oggi = datetime.now().date()
+        for giorno in range(ordini):
+            salva_ordine({
+                'data': (oggi - timedelta(days=giorno)).strftime('%Y-%m-%d'),
+                'note': 'BENCHMARK',
+                'righe': [{'cliente_id': cliente.id, 'prodotto_id': p_id, 'quantita': 1 + (giorno + i) % 5}
+                          for i, p_id in enumerate(id_prodotti)]
+            }, 'benchmark')
+        db.session.flush()
+
+        # Prima chiamata a parte (cache di SQLite calde), poi la mediana di 5
+        durate = []
+        with current_app.test_request_context():
+            risposta = current_app.make_response(api_storico_cliente(cliente.id))
+            for _ in range(5):
+                inizio = time.perf_counter()
+                api_storico_cliente(cliente.id)
+                durate.append(time.perf_counter() - inizio)
+        trovati = len(risposta.get_json() or [])
+    finally:
+        db.session.rollback()
+
+    durata = sorted(durate)[len(durate) // 2]
+    ok = risposta.status_code == 200 and trovati == prodotti and durata <= limite
+    print(f"{'OK ' if ok else 'KO '} storico di {prodotti} prodotti ({prodotti * ordini} righe) in {durata * 1000:.0f} ms "
+          f"(limite {limite * 1000:.0f} ms, {trovati} prodotti nella risposta)")
+    if not ok:
+        raise SystemExit(1)
+
+@click.command('verifica-query')
+@click.option('--righe', default=1000, show_default=True, help="Righe dell'ordine di prova")
+@click.option('--limite', default=5, show_default=True, help="Query massime accettate per pagina")
+@with_appcontext
+def comando_verifica_query(righe, limite):
+    """
+    Conta le query SQL di dettaglio ordine, modifica ordine ed Excel su un ordine
+    di prova con tante righe: con carica_ordine_completo() sono sempre le stesse
+    poche query, se diventano una per riga (lazy load) il controllo fallisce.
+    Alla fine fa ROLLBACK (e cancella l'Excel di prova): il database resta com'era.
+    Uso: flask --app app verifica-query --righe 1000 --limite 5
+    """
+    from app import aggiorna_schema_database, salva_ordine, api_dettaglio_ordine, modifica_ordine_page, scarica_ordine_excel
+
+    aggiorna_schema_database()
+    dati_ordine = ordine_di_prova(righe, 'VERIFICA QUERY')
+
+    query_eseguite = []
+    def conta_query(conn, cursor, statement, parametri, contesto, executemany):
+        query_eseguite.append(statement)
+
+    controlli = {
+        'api_dettaglio_ordine': api_dettaglio_ordine,
+        'modifica_ordine_page': modifica_ordine_page,
+        'scarica_ordine_excel': scarica_ordine_excel,
+    }
+
+    tutto_ok = True
+    path_excel = None
+    try:
+        # Orario 'verifica': l'Excel di prova non può sovrascrivere quello di un ordine vero
+        ordine, _ = salva_ordine(dati_ordine, 'verifica')
+        db.session.flush()
+        ordine_id = ordine.id
+        path_excel = os.path.join(current_app.root_path, 'ARCHIVIO_EXCEL',
+                                  f"ordini_{ordine.data_consegna.strftime('%d-%m-%Y')}_orario_verifica.xlsx")
+
+        event.listen(db.engine, 'before_cursor_execute', conta_query)
+        try:
+            for nome, vista in controlli.items():
+                # Oggetti dimenticati: ogni pagina li ricarica dal DB come in una richiesta vera
+                db.session.expire_all()
+                query_eseguite.clear()
+                # Stesso contesto dell'app: stessa sessione, vede l'ordine non ancora committato
+                with current_app.test_request_context():
+                    risposta = current_app.make_response(vista(ordine_id))
+                ok = risposta.status_code == 200 and len(query_eseguite) <= limite
+                tutto_ok = tutto_ok and ok
+                print(f"{'OK ' if ok else 'KO '} {nome}: {len(query_eseguite)} query (limite {limite}, "
+                      f"ordine da {righe} righe, risposta {risposta.status_code})")
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', conta_query)
+    finally:
+        db.session.rollback()
+        if path_excel and os.path.exists(path_excel):
+            os.remove(path_excel)
+
+    if not tutto_ok:
+        raise SystemExit(1)